@@ -1,4 +1,17 @@
-def accessibility(aoi_file, city_inputs, local_output_dir, city_name_l, cloud_bucket, output_dir):    
+def accessibility_outputs(city_inputs):
+    """
+    Outputs of accessibility per scenario, as names without the city name prefix: the POIs of
+    each osm_query tag, keyed ('osm', tag), and each isochrone, keyed ('isochrone', tag, distance).
+    """
+    outputs = {}
+    for tag in (city_inputs.get('osm_query') or {}):
+        outputs[('osm', tag)] = [f'osm_{tag}.gpkg']
+    for tag, dists in (city_inputs.get('isochrone') or {}).items():
+        for dist in (dists or []):
+            outputs[('isochrone', tag, dist)] = [f'accessibility_{tag}_{dist}m.gpkg']
+    return outputs
+
+def accessibility(aoi_file, city_inputs, local_output_dir, city_name_l, cloud_bucket, output_dir, skip_isochrones = ()):    
     print('run accessibility')
     
     import os
@@ -79,6 +92,9 @@ def accessibility(aoi_file, city_inputs, local_output_dir, city_name_l, cloud_bu
             # SNAP POI TO ROADS ############################
             snapped_destinations_dict = {}
             for results_gpd in isochrones:
+                # no need to snap POIs whose isochrones are all kept from a previous run
+                if all((results_gpd, threshold) in skip_isochrones for threshold in isochrones[results_gpd] or []):
+                    continue
                 results_gpd_gpkg = f'{local_output_dir}/{city_name_l}_osm_{results_gpd}_{fi}.gpkg'
                 if os.path.exists(results_gpd_gpkg):
                     snapped_destinations = gn.pandana_snap(G, gpd.read_file(results_gpd_gpkg, layer = f'{results_gpd}_{fi}'))
@@ -99,6 +115,8 @@ def accessibility(aoi_file, city_inputs, local_output_dir, city_name_l, cloud_bu
                     print(f"no destinations for {amenity_type} exist")
                 else:
                     for threshold in amenity_threshold_list:
+                        if (amenity_type, threshold) in skip_isochrones:
+                            continue
                         print(f'process isochrone for {amenity_type}')
                         iso_gdf = gn.make_iso_polys(G, snapped_destinations_dict[amenity_type], [threshold], edge_buff = 300, node_buff = 300, weight = 'length', measure_crs = G_utm)
                         dissolved = iso_gdf.dissolve(by = "thresh")
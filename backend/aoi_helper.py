@@ -9,7 +9,7 @@ def find_country(data_bucket, countries_shp_dir, countries_shp_blob, local_data_
     
     # Load global countries shapefile
     for blob in utils.list_blobs_with_prefix(data_bucket, f"{countries_shp_dir}/{countries_shp_blob}"):
-        utils.download_blob(data_bucket, blob.name, f"{local_data_dir}/{blob.name.split('/')[-1]}", check_exists=True)
+        utils.download_blob(data_bucket, blob.name, f"{local_data_dir}/{blob.name.split('/')[-1]}", check_exists=True, cache=True)
     countries = gpd.read_file(f"{local_data_dir}/{countries_shp_blob}.shp").to_crs(epsg=4326)
 
     if aoi_file is not None:
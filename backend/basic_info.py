@@ -8,7 +8,7 @@ def get_koeppen_classification(features, data_bucket, koeppen_blob, local_data_d
     centroid = features.centroid.values[0]
     coords = {' Lon': centroid.x, 'Lat': centroid.y}
 
-    utils.download_blob(data_bucket, koeppen_blob, f'{local_data_dir}/koeppen.csv')
+    utils.download_blob(data_bucket, koeppen_blob, f'{local_data_dir}/koeppen.csv', cache=True)
     koeppen = pd.read_csv(f'{local_data_dir}/koeppen.csv')
 
     lon_min, lon_max = coords[' Lon'] - 0.5, coords[' Lon'] + 0.5
@@ -0,0 +1,425 @@
+"""
+Benchmarks of the backend components on synthetic cities.
+
+Every case runs one component or raster_pro function on the synthetic inputs of a city
+size (small, medium or megacity, see benchmark_data.py), in a fresh Python process with
+the in-memory storage backend, so that neither Cloud Storage nor the other cases affect
+the measurements. For each case, the wall time, CPU time and peak memory (the maximum
+resident memory of the process) are recorded.
+
+Run from the backend directory:
+
+    python benchmark.py list
+    python benchmark.py run --sizes small medium --output benchmark_baseline.json
+    python benchmark.py run --cases slope flood_stats --compare benchmark_baseline.json
+    python benchmark.py compare benchmark_baseline.json benchmark_results.json --threshold 0.2
+
+compare flags every case whose wall time or peak memory grew by more than the threshold
+(and by more than a minimum absolute amount, to ignore noise on very short cases), and
+exits with status 1 if there is any regression. Results are only comparable between runs
+on the same machine type.
+"""
+import json
+import os
+import shutil
+import sys
+
+RESULT_MARKER = 'BENCHMARK_RESULT '
+
+class Case:
+    """
+    A benchmark case.
+
+    Args:
+        name: Unique case name.
+        run: Function taking the environment of the case (see _make_env); this is measured.
+        setup: Optional function taking the environment, preparing the inputs (not measured).
+    """
+    def __init__(self, name, run, setup = None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    def __repr__(self):
+        return f'Case({self.name})'
+
+########################################################
+# CASES ################################################
+########################################################
+
+def _copy_inputs(env, file_names):
+    for f in file_names:
+        shutil.copy(f'{env.data_dir}/{f}', f'{env.local_output_dir}/{f}')
+
+def run_raster_mask(env):
+    import raster_pro
+    raster_pro.raster_mask_file(f'{env.data_dir}/elevation.tif', env.aoi_file.geometry)
+
+def setup_raster_mosaic(env):
+    import rasterio
+    from rasterio.windows import Window
+
+    # Split the land cover raster into 2 x 2 tiles, like the tiles of a global dataset
+    env.tiles = []
+    with rasterio.open(f'{env.data_dir}/landcover.tif') as src:
+        half_w, half_h = src.width // 2, src.height // 2
+        for row_off, height in ((0, half_h), (half_h, src.height - half_h)):
+            for col_off, width in ((0, half_w), (half_w, src.width - half_w)):
+                window = Window(col_off, row_off, width, height)
+                meta = src.meta.copy()
+                meta.update({'height': height, 'width': width, 'transform': src.window_transform(window)})
+                tile = f'{env.local_data_dir}/tile_{row_off}_{col_off}.tif'
+                with rasterio.open(tile, 'w', **meta) as dst:
+                    dst.write(src.read(window=window))
+                env.tiles.append(tile)
+
+def run_raster_mosaic(env):
+    import raster_pro
+    mosaic = raster_pro.mosaic_raster(env.tiles, env.local_output_dir, 'mosaic.tif')
+    raster_pro.raster_mask_file(mosaic, env.aoi_file.geometry)
+
+def run_raster_mosaic_virtual(env):
+    import raster_pro
+    mosaic = raster_pro.mosaic_raster(env.tiles, env.local_output_dir, 'mosaic.tif', virtual=True)
+    raster_pro.raster_mask_file(mosaic, env.aoi_file.geometry)
+
+def run_warp_pipeline(env):
+    import raster_pro
+    raster_pro.warp_pipeline(env.tiles, env.aoi_file.geometry,
+                             [{'path': f'{env.local_output_dir}/clip.tif'},
+                              {'path': f'{env.local_output_dir}/clip_utm.tif', 'crs': env.aoi_file.estimate_utm_crs()},
+                              {'path': f'{env.local_output_dir}/clip_3857.tif', 'crs': 'EPSG:3857'}])
+
+def run_raster_reproject(env):
+    import raster_pro
+    raster_pro.reproject_raster(f'{env.data_dir}/elevation.tif', f'{env.local_output_dir}/elevation_utm.tif', dst_crs=env.aoi_file.estimate_utm_crs())
+
+def run_raster_histogram(env):
+    import raster_pro
+    raster_pro.get_raster_histogram(f'{env.data_dir}/elevation.tif', [0, 50, 100, 200, 300, 400, 500], f'{env.local_output_dir}/histogram.csv')
+
+def run_raster_area(env):
+    import raster_pro
+    import benchmark_data
+    raster_pro.calculate_raster_area(f'{env.data_dir}/landcover.tif', benchmark_data.LANDCOVER_CODES)
+
+def setup_raster_mask_remote(env):
+    import cog
+
+    # Windowed read of a COG over HTTP range requests, from a local range server
+    cog.convert_to_cog(f'{env.data_dir}/landcover.tif', f'{env.local_data_dir}/landcover_cog.tif')
+    env.server = cog.serve(env.local_data_dir)
+
+def run_raster_mask_remote(env):
+    import raster_pro
+    raster_pro.raster_mask_remote(f'{env.server.url}/landcover_cog.tif', env.aoi_file.geometry)
+
+def setup_slope(env):
+    import utils
+
+    # slope reads the buffered elevation raster written by the elevation component and deletes its blob
+    elev_raster = f'{env.local_output_dir}/{env.city_name_l}_elevation_buf.tif'
+    shutil.copy(f'{env.data_dir}/elevation.tif', elev_raster)
+    utils.upload_blob(env.cloud_bucket, elev_raster, f'{env.output_dir}/{env.city_name_l}_elevation_buf.tif')
+
+def run_slope(env):
+    import raster_pro
+    raster_pro.slope(env.aoi_file, f'{env.local_output_dir}/{env.city_name_l}_elevation_buf.tif', env.cloud_bucket, env.output_dir, env.city_name_l, env.local_output_dir)
+
+def setup_flood_stats(env):
+    import utils
+    import benchmark_data
+
+    # Flood rasters are local (written by process_fathom), the other layers are downloaded from the outputs
+    _copy_inputs(env, [f'{env.city_name_l}_{benchmark_data.FLOOD_SCENARIO}{suf}.tif' for suf in ['', '_utm']])
+    layers = ['wsf_evolution_utm.tif', 'population.tif', 'major_roads.gpkg'] + [f'osm_{poi}.gpkg' for poi in benchmark_data.POI_TYPES]
+    for f in layers:
+        utils.upload_blob(env.cloud_bucket, f'{env.data_dir}/{env.city_name_l}_{f}', f'{env.output_dir}/{env.city_name_l}_{f}')
+
+def run_flood_stats(env):
+    import fathom
+    import benchmark_data
+
+    menu = {'wsf': False, 'population': False, 'road_network': False, 'accessibility': False,
+            'flood_coastal': True, 'flood_fluvial': False, 'flood_pluvial': False, 'flood_comb': False}
+    fathom.calculate_flood_stats(menu, ['coastal', 'fluvial', 'pluvial'], [2020], [], env.cloud_bucket, env.output_dir, env.local_output_dir, env.city_name_l, benchmark_data.POI_TYPES, env.aoi_file.estimate_utm_crs())
+
+def setup_ghs_builtup_overtime(env):
+    import benchmark_data
+    _copy_inputs(env, [f'{env.city_name_l}_ghs_built_E{year}.tif' for year in benchmark_data.GHS_YEARS])
+
+def run_ghs_builtup_overtime(env):
+    import ghs_builtup
+    ghs_builtup.ghs_builtup_overtime(env.aoi_file, {}, env.local_output_dir, env.city_name_l, env.data_bucket, env.cloud_bucket, env.output_dir, None)
+
+def setup_landcover_burn(env):
+    import utils
+    utils.upload_blob(env.data_bucket, f'{env.data_dir}/landcover.tif', 'landcover/landcover.tif', type='data')
+
+def run_landcover_burn(env):
+    import landcover_burnability
+    landcover_burnability.landcover_burn(env.city_name_l, env.aoi_file, env.data_bucket, 'landcover/landcover.tif', env.local_output_dir, env.cloud_bucket, env.output_dir)
+
+def setup_fwi(env):
+    import utils
+    utils.upload_many(env.data_bucket, [(f'{env.data_dir}/fwi/{f}', f'fwi/{f}') for f in sorted(os.listdir(f'{env.data_dir}/fwi'))], type='data')
+
+def run_fwi(env):
+    import fwi
+    import benchmark_data
+    fwi.fwi(env.aoi_file, env.local_data_dir, env.data_bucket, benchmark_data.FWI_YEAR, benchmark_data.FWI_YEAR, 'fwi', benchmark_data.FWI_PREFIX, env.local_output_dir, env.city_name_l, env.cloud_bucket, env.output_dir)
+
+def setup_rwi(env):
+    import utils
+    import benchmark_data
+
+    rwi_data = f'{benchmark_data.COUNTRY_ISO3}{benchmark_data.RWI_SUFFIX}'
+    utils.upload_blob(env.data_bucket, f'{env.data_dir}/{rwi_data}', f'rwi/{rwi_data}', type='data')
+
+def run_rwi(env):
+    import rwi
+    import benchmark_data
+    rwi.rwi('rwi', benchmark_data.RWI_SUFFIX, benchmark_data.COUNTRY_ISO3, env.data_bucket, env.local_data_dir, env.aoi_file, env.local_output_dir, env.city_name_l, env.cloud_bucket, env.output_dir)
+
+def setup_routing(env):
+    import pickle
+    import geopandas as gpd
+
+    with open(f'{env.data_dir}/roads.pickle', 'rb') as f:
+        env.road_graph = pickle.load(f)
+    env.destinations = gpd.read_file(f'{env.data_dir}/{env.city_name_l}_osm_schools.gpkg', layer='schools')
+
+def run_routing(env):
+    # The GOSTnets calls of the accessibility component, on the synthetic road graph
+    import GOSTnets as gn
+
+    G = gn.convert_network_to_time(env.road_graph, 'length')
+    gn.edge_gdf_from_graph(G)
+    snapped_destinations = list(gn.pandana_snap(G, env.destinations)['NN'].unique())
+    G_utm = gn.utm_of_graph(G)
+    gn.make_iso_polys(G, snapped_destinations, [800], edge_buff=300, node_buff=300, weight='length', measure_crs=G_utm)
+
+CASES = [
+    Case('raster_mask', run_raster_mask),
+    Case('raster_mask_remote', run_raster_mask_remote, setup_raster_mask_remote),
+    Case('raster_mosaic', run_raster_mosaic, setup_raster_mosaic),
+    Case('raster_mosaic_virtual', run_raster_mosaic_virtual, setup_raster_mosaic),
+    Case('warp_pipeline', run_warp_pipeline, setup_raster_mosaic),
+    Case('raster_reproject', run_raster_reproject),
+    Case('raster_histogram', run_raster_histogram),
+    Case('raster_area', run_raster_area),
+    Case('slope', run_slope, setup_slope),
+    Case('flood_stats', run_flood_stats, setup_flood_stats),
+    Case('ghs_builtup_overtime', run_ghs_builtup_overtime, setup_ghs_builtup_overtime),
+    Case('landcover_burn', run_landcover_burn, setup_landcover_burn),
+    Case('fwi', run_fwi, setup_fwi),
+    Case('rwi', run_rwi, setup_rwi),
+    Case('routing', run_routing, setup_routing),
+]
+
+CASES_BY_NAME = {c.name: c for c in CASES}
+
+########################################################
+# RUNNER ###############################################
+########################################################
+
+def _make_env(size, data_dir, work_dir):
+    import geopandas as gpd
+    from types import SimpleNamespace
+    import benchmark_data
+
+    env = SimpleNamespace(
+        size=size,
+        data_dir=data_dir,
+        local_data_dir=f'{work_dir}/data',
+        local_output_dir=f'{work_dir}/output',
+        city_name_l=benchmark_data.CITY_NAME_L,
+        cloud_bucket='benchmark-cloud',
+        data_bucket='benchmark-data',
+        output_dir='output',
+        aoi_file=gpd.read_file(f'{data_dir}/aoi.gpkg'),
+    )
+    os.makedirs(env.local_data_dir, exist_ok=True)
+    os.makedirs(env.local_output_dir, exist_ok=True)
+    return env
+
+def run_case(case_name, size, data_dir, work_dir):
+    """Run one case in this process and return its measurements. Called in the child process."""
+    import resource
+    import perf
+    import utils
+
+    utils.configure_storage({'backend': 'memory'})
+    case = CASES_BY_NAME[case_name]
+    env = _make_env(size, data_dir, work_dir)
+    if case.setup is not None:
+        case.setup(env)
+    with perf.measure(f'{case_name}/{size}') as record:
+        case.run(env)
+    # The exact peak of the process (interpreter, imports and setup included) rather than the sampled one
+    record['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return {k: record[k] for k in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'calls')}
+
+def _run_in_subprocess(case_name, size, data_dir, verbose = False):
+    import subprocess
+    import tempfile
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    work_dir = tempfile.mkdtemp(prefix=f'benchmark-{case_name}-{size}-')
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '_case', case_name, size, data_dir, work_dir],
+                              cwd=backend_dir, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if verbose:
+        print(proc.stdout)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return {'error': (proc.stderr or proc.stdout).strip().splitlines()[-1:] or [f'exit status {proc.returncode}']}
+
+def run(case_names, sizes, data_root, repeat = 1, verbose = False):
+    """
+    Run the cases for the sizes, each repeat times in a fresh process.
+
+    Returns:
+        The results as a dict with run metadata and, per 'case/size', the median wall and
+        CPU time and the largest peak memory of the repeats, or the error of a failed case.
+    """
+    import platform
+    import statistics
+    from datetime import datetime, timezone
+    import benchmark_data
+    import fingerprint
+
+    results = {}
+    for size in sizes:
+        data_dir = benchmark_data.generate(size, os.path.abspath(f'{data_root}/{size}'))
+        for case_name in case_names:
+            key = f'{case_name}/{size}'
+            runs = [_run_in_subprocess(case_name, size, data_dir, verbose) for _ in range(repeat)]
+            errors = [r['error'] for r in runs if 'error' in r]
+            if errors:
+                results[key] = {'error': ' '.join(errors[0])}
+                print(f'{key}: failed: {results[key]["error"]}')
+                continue
+            results[key] = {
+                'wall_seconds': round(statistics.median(r['wall_seconds'] for r in runs), 3),
+                'cpu_seconds': round(statistics.median(r['cpu_seconds'] for r in runs), 3),
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+                'calls': runs[0]['calls'],
+                'runs': [r['wall_seconds'] for r in runs],
+            }
+            print(f'{key}: {results[key]["wall_seconds"]:.2f} s wall, {results[key]["cpu_seconds"]:.2f} s CPU, peak RSS {results[key]["peak_rss_mb"]:.0f} MB')
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'code_version': fingerprint.code_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+########################################################
+# COMPARE ##############################################
+########################################################
+
+# Metric: minimum absolute increase counted as a regression
+COMPARE_METRICS = {'wall_seconds': 0.5, 'peak_rss_mb': 20}
+
+def compare(baseline, current, threshold = 0.2):
+    """
+    Compare two result sets (as returned by run) and print a table of the changes.
+
+    Args:
+        baseline: Results to compare against.
+        current: New results.
+        threshold: Relative increase of a metric flagged as a regression, e.g. 0.2 for +20%.
+
+    Returns:
+        A list of (case/size, metric, baseline value, current value) regressions. Cases
+        that failed in the current results but not in the baseline are regressions too.
+    """
+    regressions = []
+    print(f"{'case':<36}{'metric':<14}{'baseline':>10}{'current':>10}{'change':>9}")
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        base, cur = baseline['results'][key], current['results'][key]
+        if 'error' in cur:
+            if 'error' not in base:
+                regressions.append((key, 'error', None, cur['error']))
+                print(f"{key:<36}{'error':<14}{'ok':>10}{'failed':>10}  REGRESSION")
+            continue
+        if 'error' in base:
+            continue
+        for metric, min_increase in COMPARE_METRICS.items():
+            change = cur[metric] / base[metric] - 1 if base[metric] else 0
+            flag = ''
+            if change > threshold and cur[metric] - base[metric] > min_increase:
+                regressions.append((key, metric, base[metric], cur[metric]))
+                flag = '  REGRESSION'
+            print(f'{key:<36}{metric:<14}{base[metric]:>10.2f}{cur[metric]:>10.2f}{change:>+9.0%}{flag}')
+    for key in sorted(set(baseline['results']) ^ set(current['results'])):
+        print(f"{key}: only in the {'baseline' if key in baseline['results'] else 'current results'}")
+    print(f'{len(regressions)} regression(s) beyond +{threshold:.0%}')
+    return regressions
+
+def _load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main(argv = None):
+    import argparse
+    import tempfile
+    import benchmark_data
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the backend components on synthetic cities.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='list the cases and sizes')
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--cases', nargs='+', choices=list(CASES_BY_NAME), default=list(CASES_BY_NAME))
+    run_parser.add_argument('--sizes', nargs='+', choices=list(benchmark_data.SIZES), default=list(benchmark_data.SIZES))
+    run_parser.add_argument('--repeat', type=int, default=1, help='runs per case; the median time is reported')
+    run_parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'city-scan-benchmark'), help='directory of the synthetic inputs, reused between runs')
+    run_parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the results, e.g. a new baseline')
+    run_parser.add_argument('--compare', metavar='BASELINE', help='compare the results with a baseline JSON file')
+    run_parser.add_argument('--threshold', type=float, default=0.2)
+    run_parser.add_argument('--verbose', action='store_true', help='print the output of the cases')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+
+    case_parser = subparsers.add_parser('_case')
+    case_parser.add_argument('case')
+    case_parser.add_argument('size')
+    case_parser.add_argument('data_dir')
+    case_parser.add_argument('work_dir')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for c in CASES:
+            print(c.name)
+        print(f"sizes: {', '.join(benchmark_data.SIZES)}")
+        return 0
+
+    if args.command == '_case':
+        print(RESULT_MARKER + json.dumps(run_case(args.case, args.size, args.data_dir, args.work_dir)))
+        return 0
+
+    if args.command == 'run':
+        current = run(args.cases, args.sizes, args.data_dir, args.repeat, args.verbose)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f'Results written to {args.output}')
+        if args.compare:
+            return 1 if compare(_load(args.compare), current, args.threshold) else 0
+        return 0
+
+    return 1 if compare(_load(args.baseline), _load(args.current), args.threshold) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
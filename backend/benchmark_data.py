@@ -0,0 +1,252 @@
+"""
+Synthetic inputs for the benchmarks (see benchmark.py).
+
+generate(size, data_dir) writes an AOI and the rasters, vectors, tables and road graph
+read by the benchmarked components for a city of the given size. The data is random but
+deterministic (seeded), spatially correlated like the real inputs, and at the resolutions
+of the real sources, so that the benchmarks exercise the same code paths at the same scale.
+Files are only written once per data directory; delete it to regenerate.
+"""
+import os
+
+# City sizes: AOI radius in degrees, road graph spacing in degrees, number of points of
+# interest per type and number of major roads
+SIZES = {
+    'small': {'radius': 0.05, 'road_spacing': 0.002, 'pois': 50, 'major_roads': 200},
+    'medium': {'radius': 0.2, 'road_spacing': 0.0025, 'pois': 300, 'major_roads': 1500},
+    'megacity': {'radius': 0.4, 'road_spacing': 0.003, 'pois': 1500, 'major_roads': 8000},
+}
+
+CENTER = (36.82, -1.29)
+CITY_NAME_L = 'bench'
+COUNTRY_ISO3 = 'BEN'
+POI_TYPES = ['schools', 'health']
+FLOOD_SCENARIO = 'coastal_2020'
+GHS_YEARS = list(range(1975, 2035, 5))
+FWI_PREFIX = 'fwi.'
+FWI_YEAR = 2020
+RWI_SUFFIX = '_relative_wealth_index.csv'
+
+# Resolutions of the real sources, in degrees
+ARCSEC = 1 / 3600
+LANDCOVER_CODES = [10, 11, 12, 20, 30, 40, 50, 60, 61, 62, 70, 71, 80, 81, 82, 90, 100, 110, 120, 121, 122,
+                   130, 140, 150, 151, 152, 153, 160, 170, 180, 190, 200, 201, 202, 210, 220]
+
+def _rng(size, name):
+    import zlib
+    import numpy as np
+
+    return np.random.default_rng(zlib.crc32(f'{size}/{name}'.encode()))
+
+def make_aoi(radius, rng, vertices = 64):
+    """An irregular, roughly circular city polygon around CENTER."""
+    import numpy as np
+    import geopandas as gpd
+    from shapely.geometry import Polygon
+
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    r = radius * (0.75 + 0.25 * rng.random(vertices))
+    coords = zip(CENTER[0] + r * np.cos(angles), CENTER[1] + r * np.sin(angles))
+    return gpd.GeoDataFrame({'name': [CITY_NAME_L]}, geometry=[Polygon(coords)], crs='EPSG:4326')
+
+def smooth_field(shape, rng, waves = 6):
+    """A spatially correlated field in [0, 1]: a sum of random plane waves plus a little noise."""
+    import numpy as np
+
+    rows = np.arange(shape[0], dtype=np.float32)[:, None] / shape[0]
+    cols = np.arange(shape[1], dtype=np.float32)[None, :] / shape[1]
+    field = np.zeros(shape, dtype=np.float32)
+    for _ in range(waves):
+        fy, fx = rng.uniform(1, 12, 2)
+        field += np.sin(2 * np.pi * fy * rows + rng.uniform(0, 2 * np.pi)) * np.cos(2 * np.pi * fx * cols + rng.uniform(0, 2 * np.pi))
+    field += 0.3 * rng.standard_normal(shape, dtype=np.float32)
+    field -= field.min()
+    field /= max(float(field.max()), 1e-6)
+    return field
+
+def write_raster(path, array, bounds, crs = 'EPSG:4326', nodata = None):
+    """Write a single-band array covering bounds (minx, miny, maxx, maxy) as a GeoTIFF."""
+    import rasterio
+    from rasterio.transform import from_bounds
+
+    height, width = array.shape
+    meta = {'driver': 'GTiff', 'height': height, 'width': width, 'count': 1, 'dtype': array.dtype.name,
+            'crs': crs, 'transform': from_bounds(*bounds, width, height), 'nodata': nodata}
+    with rasterio.open(path, 'w', **meta) as dst:
+        dst.write(array, 1)
+
+def _grid_shape(bounds, res):
+    return max(1, round((bounds[3] - bounds[1]) / res)), max(1, round((bounds[2] - bounds[0]) / res))
+
+def _buffered_bounds(aoi, buffer):
+    minx, miny, maxx, maxy = aoi.total_bounds
+    return (minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+
+def _random_points(aoi, n, rng):
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    minx, miny, maxx, maxy = aoi.total_bounds
+    polygon = aoi.geometry.iloc[0]
+    points = []
+    while len(points) < n:
+        p = Point(rng.uniform(minx, maxx), rng.uniform(miny, maxy))
+        if polygon.contains(p):
+            points.append(p)
+    return gpd.GeoDataFrame({'amenity': ['bench'] * n}, geometry=points, crs='EPSG:4326')
+
+def _random_roads(aoi, n, rng):
+    import numpy as np
+    import geopandas as gpd
+    from shapely.geometry import LineString
+
+    minx, miny, maxx, maxy = aoi.total_bounds
+    step = (maxx - minx) / 40
+    lines = []
+    for _ in range(n):
+        x, y = rng.uniform(minx, maxx), rng.uniform(miny, maxy)
+        heading = rng.uniform(0, 2 * np.pi)
+        coords = []
+        for _ in range(rng.integers(3, 12)):
+            coords.append((x, y))
+            heading += rng.normal(0, 0.3)
+            x, y = x + step * np.cos(heading), y + step * np.sin(heading)
+        lines.append(LineString(coords))
+    return gpd.GeoDataFrame({'highway': ['primary'] * n}, geometry=lines, crs='EPSG:4326')
+
+def _quadkey(lon, lat, zoom = 14):
+    """Bing Maps quadkey of the tile containing a point."""
+    import math
+
+    sin_lat = math.sin(math.radians(lat))
+    x = int((lon + 180) / 360 * 2 ** zoom)
+    y = int((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * 2 ** zoom)
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+def _road_graph(aoi, spacing, rng):
+    """A perturbed lattice road graph in the format of osmnx graphs, trimmed to the AOI."""
+    import numpy as np
+    import networkx as nx
+    from shapely import contains_xy
+
+    minx, miny, maxx, maxy = aoi.total_bounds
+    xs = np.arange(minx, maxx, spacing)
+    ys = np.arange(miny, maxy, spacing)
+    gx, gy = np.meshgrid(xs, ys)
+    gx = gx + rng.normal(0, spacing / 8, gx.shape)
+    gy = gy + rng.normal(0, spacing / 8, gy.shape)
+    inside = contains_xy(aoi.geometry.iloc[0], gx, gy)
+    # Edge lengths in meters, from an equirectangular approximation
+    m_per_deg_y = 111_320
+    m_per_deg_x = 111_320 * np.cos(np.radians(CENTER[1]))
+
+    def node_id(i, j):
+        return int(i * len(xs) + j)
+
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    for i, j in zip(*np.nonzero(inside)):
+        G.add_node(node_id(i, j), x=float(gx[i, j]), y=float(gy[i, j]))
+    for i, j in zip(*np.nonzero(inside)):
+        for di, dj in ((0, 1), (1, 0)):
+            ni, nj = i + di, j + dj
+            # Drop some links so that the network is not a perfect lattice
+            if ni < inside.shape[0] and nj < inside.shape[1] and inside[ni, nj] and rng.random() > 0.1:
+                length = float(np.hypot((gx[ni, nj] - gx[i, j]) * m_per_deg_x, (gy[ni, nj] - gy[i, j]) * m_per_deg_y))
+                highway = 'primary' if (i % 10 == 0 or j % 10 == 0) else 'residential'
+                for u, v in ((node_id(i, j), node_id(ni, nj)), (node_id(ni, nj), node_id(i, j))):
+                    G.add_edge(u, v, length=length, highway=highway, oneway=False)
+    return G
+
+def generate(size, data_dir):
+    """Write the synthetic inputs for a city size to data_dir and return data_dir."""
+    import pickle
+    import numpy as np
+    import pandas as pd
+    import raster_pro
+
+    spec = SIZES[size]
+    os.makedirs(data_dir, exist_ok=True)
+    done_marker = f'{data_dir}/.complete'
+    if os.path.exists(done_marker):
+        return data_dir
+    print(f'Generating synthetic {size} inputs in {data_dir}')
+
+    aoi = make_aoi(spec['radius'], _rng(size, 'aoi'))
+    aoi.to_file(f'{data_dir}/aoi.gpkg', driver='GPKG')
+    utm_crs = aoi.estimate_utm_crs()
+
+    # Elevation (FABDEM, 1 arcsec) around the AOI, in meters
+    bounds = _buffered_bounds(aoi, spec['radius'] * 0.1)
+    write_raster(f'{data_dir}/elevation.tif', smooth_field(_grid_shape(bounds, ARCSEC), _rng(size, 'elevation')) * 500, bounds)
+
+    # Land cover (ESA CCI, 300 m) classes in patches, on a window of the global raster around the AOI
+    bounds = _buffered_bounds(aoi, 1)
+    shape = _grid_shape(bounds, 1 / 360)
+    rng = _rng(size, 'landcover')
+    coarse = rng.choice(np.array(LANDCOVER_CODES, dtype=np.uint8), size=(shape[0] // 8 + 1, shape[1] // 8 + 1))
+    write_raster(f'{data_dir}/landcover.tif', np.repeat(np.repeat(coarse, 8, axis=0), 8, axis=1)[:shape[0], :shape[1]], bounds)
+
+    # Flood probability composite (Fathom, 1 arcsec) on the buffered AOI of process_fathom, and its UTM version
+    extent = max(np.ptp(aoi.total_bounds[[0, 2]]), np.ptp(aoi.total_bounds[[1, 3]]))
+    bounds = _buffered_bounds(aoi, extent)
+    depth = smooth_field(_grid_shape(bounds, ARCSEC), _rng(size, 'flood'))
+    # Probability weights of the 1-in-100, 1-in-20 and 1-in-5 year floods, as composited by process_fathom
+    flood = np.zeros_like(depth)
+    flood[depth > 0.6] = 100 / 100
+    flood[depth > 0.7] = 100 / 20
+    flood[depth > 0.8] = 100 / 5
+    del depth
+    flood_raster = f'{data_dir}/{CITY_NAME_L}_{FLOOD_SCENARIO}.tif'
+    write_raster(flood_raster, flood, bounds, nodata=0)
+    raster_pro.reproject_raster(flood_raster, f'{flood_raster[:-4]}_utm.tif', dst_crs=utm_crs)
+
+    # WSF evolution (30 m, UTM): year of settlement or 0
+    utm_bounds = aoi.to_crs(utm_crs).total_bounds
+    settled = smooth_field(_grid_shape(utm_bounds, 30), _rng(size, 'wsf'))
+    wsf = np.where(settled > 0.45, 1985 + ((1 - settled) / 0.55 * 30).astype(np.uint16), 0).astype(np.uint16)
+    write_raster(f'{data_dir}/{CITY_NAME_L}_wsf_evolution_utm.tif', wsf, utm_bounds, crs=utm_crs, nodata=0)
+
+    # Population (WorldPop, 3 arcsec) clipped to the AOI, with the WorldPop nodata value outside
+    bounds = tuple(aoi.total_bounds)
+    population = smooth_field(_grid_shape(bounds, 3 * ARCSEC), _rng(size, 'population')) ** 2 * 200
+    write_raster(f'{data_dir}/{CITY_NAME_L}_population.tif', population.astype(np.float32), bounds, nodata=-99999)
+
+    # Built-up surface (GHSL, 100 m) per epoch, growing over time, in m² per cell
+    bounds = tuple(aoi.total_bounds)
+    built = smooth_field(_grid_shape(bounds, 3 * ARCSEC), _rng(size, 'ghs'))
+    for i, year in enumerate(GHS_YEARS):
+        growth = (i + 1) / len(GHS_YEARS)
+        write_raster(f'{data_dir}/{CITY_NAME_L}_ghs_built_E{year}.tif', np.clip((built - 1 + growth) * 2 * 10000, 0, 10000).astype(np.uint16), bounds)
+
+    # Fire weather index (0.25°), one raster per week of FWI_YEAR
+    os.makedirs(f'{data_dir}/fwi', exist_ok=True)
+    bounds = _buffered_bounds(aoi, 10)
+    rng = _rng(size, 'fwi')
+    for date in pd.date_range(f'{FWI_YEAR}-01-01', f'{FWI_YEAR}-12-31', freq='7D'):
+        write_raster(f"{data_dir}/fwi/{FWI_PREFIX}{date.strftime('%Y%m%d')}.tif", smooth_field(_grid_shape(bounds, 0.25), rng) * 60, bounds)
+
+    # Relative wealth index table of the country (zoom 14 quadkeys) around the AOI
+    minx, miny, maxx, maxy = _buffered_bounds(aoi, 1)
+    quadkeys = sorted({_quadkey(x, y) for x in np.arange(minx, maxx, 0.02) for y in np.arange(miny, maxy, 0.02)})
+    rng = _rng(size, 'rwi')
+    pd.DataFrame({
+        'quadkey': [int(q) for q in quadkeys],
+        'rwi': rng.normal(0, 1, len(quadkeys)).round(3),
+        'error': rng.uniform(0.2, 0.6, len(quadkeys)).round(3),
+    }).to_csv(f'{data_dir}/{COUNTRY_ISO3}{RWI_SUFFIX}', index=False)
+
+    # Points of interest and major roads (OSM)
+    for poi in POI_TYPES:
+        _random_points(aoi, spec['pois'], _rng(size, poi)).to_file(f'{data_dir}/{CITY_NAME_L}_osm_{poi}.gpkg', driver='GPKG', layer=poi)
+    _random_roads(aoi, spec['major_roads'], _rng(size, 'major_roads')).to_file(f'{data_dir}/{CITY_NAME_L}_major_roads.gpkg', driver='GPKG', layer='major_roads')
+
+    # Road graph
+    with open(f'{data_dir}/roads.pickle', 'wb') as f:
+        pickle.dump(_road_graph(aoi, spec['road_spacing'], _rng(size, 'roads')), f, pickle.HIGHEST_PROTOCOL)
+
+    open(done_marker, 'w').close()
+    return data_dir
@@ -1,20 +1,23 @@
-def burned_area(aoi_file, gf_dir, gf_blob_prefix, task_index, data_bucket, local_data_dir, local_output_dir, city_name_l, cloud_bucket, output_dir):
-    print('run burned_area')
+def burned_area(aoi_file, gf_dir, gf_blob_prefix, part, data_bucket, local_data_dir, local_output_dir, city_name_l, cloud_bucket, output_dir):
+    """
+    Find GlobFire burned area centroids around the AOI for one part (1-5) of the time
+    period, each part covering two years. merge_burned_area combines the parts.
+    """
+    print(f'run burned_area part {part}')
 
     import os
+    from concurrent.futures import ThreadPoolExecutor
     import pandas as pd
     import geopandas as gpd
     import utils
 
     # SET PARAMETERS ################################
-    task_index_range = range(1, 6)
-
     # Buffer AOI ------------------
     aoi_buff = aoi_file.buffer(1)  # 1 degree is about 111 km at the equator
     features = aoi_buff.geometry[0]
 
     # Set time period --------------
-    years = range(2009 + task_index * 2, 2011 + task_index * 2)
+    years = range(2009 + part * 2, 2011 + part * 2)
     months = range(1, 13)
 
     # Make local data folder --------------
@@ -25,12 +28,25 @@ def burned_area(aoi_file, gf_dir, gf_blob_prefix, task_index, data_bucket, local
     # PROCESS DATA ##################################
     df = pd.DataFrame(columns=['year', 'month', 'x', 'y'])
 
-    for year in years:
-        for month in months:
+    # Download GlobFire shapefiles month by month, a few months ahead of the one being read ----------------
+    shp_suffixes = ['cpg', 'dbf', 'prj', 'shp', 'shx']
+    months_ahead = 2
+    periods = [(year, month) for year in years for month in months]
+
+    def download_month(year, month):
+        utils.download_many(data_bucket, [(f'{gf_dir}/{gf_blob_prefix}{month}_{year}.{suf}', f'{local_gf_folder}/{gf_blob_prefix}{month}_{year}.{suf}')
+                                          for suf in shp_suffixes])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = {}
+        for n, (year, month) in enumerate(periods):
+            for period in periods[n:n + months_ahead + 1]:
+                if period not in pending:
+                    pending[period] = executor.submit(download_month, *period)
+            pending.pop((year, month)).result()
+
             # Filter GlobFire ----------------
-            shp_names = [f'{gf_blob_prefix}{month}_{year}.{suf}' for suf in ['cpg', 'dbf', 'prj', 'shp', 'shx']]
-            for f in shp_names:
-                utils.download_blob(data_bucket, f'{gf_dir}/{f}', f'{local_gf_folder}/{f}')
+            shp_names = [f'{gf_blob_prefix}{month}_{year}.{suf}' for suf in shp_suffixes]
             gf_shp = gpd.read_file(f'{local_gf_folder}/{gf_blob_prefix}{month}_{year}.shp')
             gf_aoi = gf_shp[gf_shp.intersects(features)]
 
@@ -41,35 +57,33 @@ def burned_area(aoi_file, gf_dir, gf_blob_prefix, task_index, data_bucket, local
             
             # Delete downloaded files -----------------
             for f in shp_names:
-                os.remove(f'{local_gf_folder}/{f}')
+                if os.path.exists(f'{local_gf_folder}/{f}'):
+                    os.remove(f'{local_gf_folder}/{f}')
     
     # Save dataframe to csv -----------------------
-    df.to_csv(f'{local_output_dir}/{city_name_l}_globfire_centroids_{task_index}.csv')
-    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_globfire_centroids_{task_index}.csv', f'{output_dir}/{city_name_l}_globfire_centroids_{task_index}.csv')
+    df.to_csv(f'{local_output_dir}/{city_name_l}_globfire_centroids_{part}.csv')
+    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_globfire_centroids_{part}.csv', f'{output_dir}/{city_name_l}_globfire_centroids_{part}.csv')
+
+def merge_burned_area(city_name_l, local_output_dir, cloud_bucket, output_dir, parts = range(1, 6)):
+    print('run merge_burned_area')
+
+    import pandas as pd
+    import geopandas as gpd
+    import utils
+    from os.path import exists
 
     # Concatenate csv ------------------------
-    if task_index == task_index_range[-1]:
-        from datetime import datetime as dt
-        import time
-        from os.path import exists
-
-        time0 = dt.now()
-        while (dt.now()-time0).total_seconds() <= 120*60:
-            download_gf_csv = [utils.download_blob(cloud_bucket, 
-                                                   f"{output_dir}/tabular/{city_name_l}_globfire_centroids_{ti}.csv", 
-                                                   f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv',
-                                                   check_exists=True) for ti in task_index_range]
-            if all(download_gf_csv):
-                print('all globfire centroids csv files downloaded')
-                break
-            time.sleep(60)
-        
-        concat_df = pd.concat([pd.read_csv(f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv') for ti in task_index_range if exists(f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv')])
-
-        # Save centroids to geopackage ----------------
-        gpd.GeoDataFrame(concat_df, geometry = gpd.points_from_xy(concat_df.x, concat_df.y, crs = 'EPSG:4326')).to_file(f'{local_output_dir}/{city_name_l}_globfire_centroids.gpkg', driver='GPKG', layer = 'burned_area')
-        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_globfire_centroids.gpkg', f'{output_dir}/{city_name_l}_globfire_centroids.gpkg')
-
-        # Delete csv files -------------------------
-        for ti in task_index_range:
-            utils.delete_blob(cloud_bucket, f'{output_dir}/tabular/{city_name_l}_globfire_centroids_{ti}.csv')
+    # The scheduler only runs this step once every part has finished
+    utils.download_many(cloud_bucket, [(f"{output_dir}/tabular/{city_name_l}_globfire_centroids_{ti}.csv", 
+                                        f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv') for ti in parts],
+                        check_exists=True)
+    
+    concat_df = pd.concat([pd.read_csv(f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv') for ti in parts if exists(f'{local_output_dir}/{city_name_l}_globfire_centroids_{ti}.csv')])
+
+    # Save centroids to geopackage ----------------
+    gpd.GeoDataFrame(concat_df, geometry = gpd.points_from_xy(concat_df.x, concat_df.y, crs = 'EPSG:4326')).to_file(f'{local_output_dir}/{city_name_l}_globfire_centroids.gpkg', driver='GPKG', layer = 'burned_area')
+    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_globfire_centroids.gpkg', f'{output_dir}/{city_name_l}_globfire_centroids.gpkg')
+
+    # Delete csv files -------------------------
+    for ti in parts:
+        utils.delete_blob(cloud_bucket, f'{output_dir}/tabular/{city_name_l}_globfire_centroids_{ti}.csv')
@@ -0,0 +1,219 @@
+"""
+Cloud-Optimized GeoTIFF (COG) utilities for the global rasters of the data bucket.
+
+raster_pro.raster_mask_blob reads only the AOI window of tiled rasters, over HTTP range
+requests; rasters stored in strips are still downloaded whole. This module converts the
+global rasters to COGs (tiled, compressed, with overviews) and serves local files with
+range requests to test windowed reads without Cloud Storage.
+
+Run from the backend directory:
+
+    # Check and convert the global rasters listed in global_inputs.yml, in place
+    python cog.py check --global-inputs global_inputs.yml
+    python cog.py convert --global-inputs global_inputs.yml
+    # Convert single blobs, writing <name>_cog.tif next to them
+    python cog.py convert --suffix _cog path/to/raster.tif
+    # Serve a directory with range requests on http://127.0.0.1:8000/
+    python cog.py serve ./data --port 8000
+
+The bucket defaults to the data bucket in config.yaml.
+"""
+import http.server
+import os
+import re
+import threading
+
+def is_cog(raster_path, gdal_options = None):
+    """Whether a raster (any path GDAL can open) is tiled, i.e. can be read by window."""
+    import rasterio
+    import raster_pro
+
+    with rasterio.Env(**{**raster_pro.REMOTE_GDAL_OPTIONS, **(gdal_options or {})}):
+        with rasterio.open(raster_path) as src:
+            return raster_pro.is_tiled(src)
+
+def convert_to_cog(src_path, dst_path, blocksize = 512, compress = 'DEFLATE', resampling = 'NEAREST'):
+    """
+    Rewrite a raster as a COG. Nearest-neighbour overviews keep categorical rasters (e.g.
+    land cover classes) valid.
+    """
+    from rasterio.shutil import copy
+
+    copy(src_path, dst_path, driver='COG', BLOCKSIZE=blocksize, COMPRESS=compress, PREDICTOR='YES',
+         OVERVIEW_RESAMPLING=resampling, BIGTIFF='IF_SAFER', NUM_THREADS='ALL_CPUS')
+
+def global_raster_blobs(global_inputs):
+    """Blob names of the global rasters read with raster_pro.raster_mask_blob."""
+    import components
+
+    keys = [f'{i}_blob' for i in components.GLOBAL_RASTERS] + ['lc_burn_blob']
+    return [global_inputs[k] for k in keys if global_inputs.get(k)]
+
+def _cog_blob_name(blob_name, suffix):
+    root, ext = os.path.splitext(blob_name)
+    return f'{root}{suffix}{ext or ".tif"}' if suffix else blob_name
+
+def convert_blobs(bucket_name, blob_names, suffix = '', force = False):
+    """
+    Convert raster blobs to COGs, skipping those that are already tiled unless force is set.
+
+    Args:
+        bucket_name: Name of the bucket.
+        blob_names: Raster blobs to convert.
+        suffix: Suffix added to the blob name before the extension for the converted file,
+            or '' to replace the blob.
+        force: Convert tiled rasters too, e.g. to add overviews or change the compression.
+
+    Returns:
+        A dict of blob name to the name of the converted blob, or None if it was skipped.
+    """
+    import tempfile
+    import utils
+
+    converted = {}
+    for blob_name in blob_names:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src_path = os.path.join(tmp_dir, 'src.tif')
+            dst_path = os.path.join(tmp_dir, 'cog.tif')
+            if not utils.download_blob(bucket_name, blob_name, src_path):
+                converted[blob_name] = None
+                continue
+            if is_cog(src_path) and not force:
+                print(f'{blob_name} is already tiled.')
+                converted[blob_name] = None
+                continue
+            convert_to_cog(src_path, dst_path)
+            print(f'{blob_name}: {os.path.getsize(src_path) / 1e6:.0f} MB -> {os.path.getsize(dst_path) / 1e6:.0f} MB COG')
+            converted[blob_name] = _cog_blob_name(blob_name, suffix)
+            utils.upload_blob(bucket_name, dst_path, converted[blob_name], type='data')
+    return converted
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Static file handler that answers single byte ranges (Range: bytes=start-end) with
+    206 Partial Content, as GDAL's /vsicurl/ expects. Counts requests and bytes sent on
+    the server, so tests can check that only a window was read.
+    """
+    def send_head(self):
+        self._range_length = None
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', (range_header or '').strip())
+        if match is None or not any(match.groups()) or not os.path.isfile(path):
+            return super().send_head()
+
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+        if start >= size or start > end:
+            f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return None
+
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        f.seek(start)
+        self._range_length = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = self._range_length
+        if remaining is None:
+            remaining = os.fstat(source.fileno()).st_size - source.tell()
+        sent = 0
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+            sent += len(chunk)
+        with self.server.stats_lock:
+            self.server.requests += 1
+            self.server.bytes_sent += sent
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory, port = 0):
+    """
+    Serve directory with range requests on 127.0.0.1 in a background thread.
+
+    Returns:
+        The server; server.url is its base URL, server.requests and server.bytes_sent
+        count the GET requests and bytes sent, and server.shutdown() stops it.
+    """
+    import functools
+
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.requests = 0
+    server.bytes_sent = 0
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv = None):
+    import argparse
+    import yaml
+    import utils
+
+    parser = argparse.ArgumentParser(description='Cloud-Optimized GeoTIFF utilities for the global rasters.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command in ('check', 'convert'):
+        command_parser = subparsers.add_parser(command)
+        command_parser.add_argument('blobs', nargs='*', help='raster blobs in the bucket')
+        command_parser.add_argument('--bucket', help='bucket name (default: the data bucket in config.yaml)')
+        command_parser.add_argument('--global-inputs', help='also use the global raster blobs of this global_inputs.yml')
+        if command == 'convert':
+            command_parser.add_argument('--suffix', default='', help='write <name><suffix>.tif instead of replacing the blob')
+            command_parser.add_argument('--force', action='store_true', help='also convert rasters that are already tiled')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('directory')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = serve(args.directory, args.port)
+        print(f'Serving {args.directory} at {server.url} (Ctrl+C to stop)')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    with open('config.yaml', 'r') as f:
+        config = yaml.safe_load(f)
+    utils.configure_storage(config.get('storage'))
+    bucket_name = args.bucket or config['cloud']['data_bucket']
+    blob_names = list(args.blobs)
+    if args.global_inputs:
+        with open(args.global_inputs, 'r') as f:
+            blob_names += global_raster_blobs(yaml.safe_load(f))
+
+    if args.command == 'check':
+        for blob_name in blob_names:
+            remote = utils.blob_raster_path(bucket_name, blob_name)
+            if remote is None:
+                print(f'{blob_name}: cannot be opened in place with this storage backend')
+                continue
+            print(f"{blob_name}: {'tiled' if is_cog(*remote) else 'not tiled'}")
+        return 0
+
+    convert_blobs(bucket_name, blob_names, args.suffix, args.force)
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Registry of the City Scan processing components.
+
+Each component declares the menu items that enable it, the components it depends on,
+the inputs it reads, the outputs it writes to the output directory and an estimated
+processing time. The scheduler uses the registry to pack the enabled components onto
+the available Cloud Run tasks, and main.py runs them through the functions below.
+
+Every run function takes a single context object (ctx) holding the per-city variables
+set up in main.main, e.g. ctx.aoi_file, ctx.city_name_l, ctx.output_dir.
+"""
+
+
+class Component:
+    """
+    A unit of work in the pipeline.
+
+    Args:
+        name: Unique component name.
+        run: Function taking the context object.
+        menu_items: Menu keys that enable the component (any of them).
+        deps: Components that must finish first; if one of them fails, this one is skipped.
+        soft_deps: Components whose outputs are used if available; waited for but not required.
+        inputs: Keys of city_inputs/global_inputs read by the component, e.g. 'global:fwi_dir',
+            or 'city:flood.threshold' for a key of a nested dict.
+        outputs: File names (without the city name prefix) written to the output directory.
+        transient: Outputs that dependent components read and then delete, e.g. the buffered
+            elevation used by slope. They are not checked when reusing the component.
+        scenarios: Optional function ctx -> dict of scenario to its output names, for
+            components producing one set of outputs per scenario.
+        scenario_inputs: Inputs that only select the scenarios, e.g. 'city:flood.year'. They
+            are left out of the base fingerprint, so a re-run only runs new scenarios.
+        sources: Blob prefixes in the data bucket read by the component, formatted with the
+            global inputs and country_iso3, e.g. '{fwi_dir}/{fwi_blob_prefix}'. Their
+            generations are part of the component's fingerprint (see fingerprint.py).
+        cost: Estimated processing time in minutes.
+    """
+    def __init__(self, name, run, menu_items, deps = (), soft_deps = (), inputs = (), outputs = (), transient = (), scenarios = None, scenario_inputs = (), sources = (), cost = 1):
+        self.name = name
+        self.run = run
+        self.menu_items = list(menu_items)
+        self.deps = list(deps)
+        self.soft_deps = list(soft_deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.transient = list(transient)
+        self.scenarios = scenarios
+        self.scenario_inputs = list(scenario_inputs)
+        self.sources = list(sources)
+        self.cost = cost
+
+    def is_enabled(self, menu):
+        return any(menu.get(item, False) for item in self.menu_items)
+
+    def __repr__(self):
+        return f'Component({self.name})'
+
+
+########################################################
+# RUN FUNCTIONS ########################################
+########################################################
+
+def run_accessibility(ctx):
+    import accessibility
+    # Isochrones kept from a previous run with the same POIs are not computed again
+    reusable = getattr(ctx, 'reusable_scenarios', {}).get('accessibility', set())
+    skip_isochrones = {scenario[1:] for scenario in reusable if scenario[0] == 'isochrone'}
+    accessibility.accessibility(ctx.aoi_file, ctx.city_inputs, ctx.local_output_dir, ctx.city_name_l, ctx.cloud_bucket, ctx.output_dir, skip_isochrones=skip_isochrones)
+
+def accessibility_scenarios(ctx):
+    import accessibility
+    return accessibility.accessibility_outputs(ctx.city_inputs)
+
+def run_burned_area_part(part):
+    def run(ctx):
+        import burned_area
+        burned_area.burned_area(ctx.aoi_file, ctx.global_inputs['burned_area_dir'], ctx.global_inputs['burned_area_blob_prefix'], part, ctx.data_bucket, ctx.local_data_dir, ctx.local_output_dir, ctx.city_name_l, ctx.cloud_bucket, ctx.output_dir)
+    return run
+
+def run_burned_area_merge(ctx):
+    import burned_area
+    burned_area.merge_burned_area(ctx.city_name_l, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, parts=BURNED_AREA_PARTS)
+
+def run_demographics(ctx):
+    import demographics
+    demographics.demographics(ctx.local_data_dir, ctx.local_output_dir, ctx.data_bucket, ctx.cloud_bucket, ctx.city_name_l, ctx.country_iso3, ctx.features, ctx.output_dir)
+    demographics.demo_plot(ctx.city_name, ctx.city_name_l, ctx.render_dir, ctx.font_dict, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir)
+
+def run_population(ctx):
+    import raster_pro
+    import shared_assets
+    import utils
+
+    # The country mosaic is built once and clipped for every city in the country
+    population_mosaic = shared_assets.population_mosaic(ctx.country_iso3, ctx.local_data_dir, ctx.data_bucket)
+    out_image, out_meta = raster_pro.raster_mask_file(population_mosaic, ctx.features)
+    raster_pro.write_raster(f'{ctx.local_output_dir}/{ctx.city_name_l}_population.tif', out_image, out_meta)
+    utils.upload_blob(ctx.cloud_bucket, f'{ctx.local_output_dir}/{ctx.city_name_l}_population.tif', f'{ctx.output_dir}/{ctx.city_name_l}_population.tif')
+
+def run_wsf(ctx):
+    import wsf
+    wsf.wsf(ctx.aoi_file, ctx.local_data_dir, ctx.data_bucket, ctx.city_name_l, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_elevation(ctx):
+    import elevation
+    elevation.elevation(ctx.aoi_file, ctx.local_data_dir, ctx.data_bucket, ctx.city_name, ctx.city_name_l, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_slope(ctx):
+    import raster_pro
+    import utils
+    from elevation import plot_slope_stats
+    raster_pro.slope(ctx.aoi_file, f'{ctx.local_output_dir}/{ctx.city_name_l}_elevation_buf.tif', ctx.cloud_bucket, ctx.output_dir, ctx.city_name_l, ctx.local_output_dir)
+    raster_pro.get_raster_histogram(f'{ctx.local_output_dir}/{ctx.city_name_l}_slope.tif', [0, 2, 5, 10, 20, 90], f'{ctx.local_output_dir}/{ctx.city_name_l}_slope.csv')
+    utils.upload_blob(ctx.cloud_bucket, f'{ctx.local_output_dir}/{ctx.city_name_l}_slope.csv', f'{ctx.output_dir}/{ctx.city_name_l}_slope.csv')
+    plot_slope_stats(ctx.city_name, ctx.city_name_l, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def _fathom_aws_credentials():
+    import yaml
+
+    with open('fathom_aws_credentials.yml', 'r') as f:
+        fathom_aws_credentials = yaml.safe_load(f)
+    return fathom_aws_credentials['aws_access_key_id'], fathom_aws_credentials['aws_secret_access_key'], fathom_aws_credentials.get('endpoint_url')
+
+def run_flood(ctx):
+    import fathom
+
+    aws_access_key_id, aws_secret_access_key, aws_endpoint_url = _fathom_aws_credentials()
+    aws_bucket = ctx.global_inputs['fathom_aws_bucket']
+    # Years and SSPs kept from a previous run with the same threshold and return periods are not processed again
+    skip_scenarios = getattr(ctx, 'reusable_scenarios', {}).get('flood', set())
+    fathom.process_fathom(ctx.aoi_file, ctx.city_name_l, ctx.local_data_dir, ctx.city_inputs, ctx.menu, aws_access_key_id, aws_secret_access_key, aws_bucket, ctx.data_bucket, 'Fathom', ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, aws_endpoint_url, skip_scenarios=skip_scenarios)
+
+def flood_scenarios(ctx):
+    import fathom
+    return fathom.flood_scenario_outputs(ctx.city_inputs, ctx.menu)
+
+def run_flood_stats(ctx):
+    import fathom
+    fathom.flood_stats(ctx.aoi_file, ctx.city_name_l, ctx.city_inputs, ctx.menu, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir)
+
+def run_fwi(ctx):
+    import fwi
+    fwi.fwi(ctx.aoi_file, ctx.local_data_dir, ctx.data_bucket, ctx.city_inputs['fwi_first_year'], ctx.city_inputs['fwi_last_year'], ctx.global_inputs['fwi_dir'], ctx.global_inputs['fwi_blob_prefix'], ctx.local_output_dir, ctx.city_name_l, ctx.cloud_bucket, ctx.output_dir)
+
+def run_landcover_burn(ctx):
+    import landcover_burnability
+    landcover_burnability.landcover_burn(ctx.city_name_l, ctx.aoi_file, ctx.data_bucket, ctx.global_inputs['lc_burn_blob'], ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir)
+
+def run_road_network(ctx):
+    import road_network
+    road_network.road_network(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir)
+
+def run_rwi(ctx):
+    import rwi
+    rwi.rwi(ctx.global_inputs['rwi_dir'], ctx.global_inputs['rwi_blob_suffix'], ctx.country_iso3, ctx.data_bucket, ctx.local_data_dir, ctx.aoi_file, ctx.local_output_dir, ctx.city_name_l, ctx.cloud_bucket, ctx.output_dir)
+
+def run_global_rasters(ctx):
+    import gc
+    import raster_pro
+    import utils
+
+    for i in GLOBAL_RASTERS:
+        if ctx.menu[i]:
+            out_image, out_meta = raster_pro.raster_mask_blob(ctx.data_bucket, ctx.global_inputs[f'{i}_blob'], ctx.features)
+            raster_pro.write_raster(f'{ctx.local_output_dir}/{ctx.city_name_l}_{i}.tif', out_image, out_meta)
+
+            utils.upload_blob(ctx.cloud_bucket, f"{ctx.local_output_dir}/{ctx.city_name_l}_{i}.tif", f"{ctx.output_dir}/{ctx.city_name_l}_{i}.tif")
+
+            del out_image
+            gc.collect()
+
+    if ctx.menu['solar']:
+        import solar
+        solar.plot_solar(ctx.cloud_bucket, ctx.local_data_dir, ctx.data_bucket, ctx.global_inputs['solar_graph_blob'], ctx.features, ctx.city_name_l, ctx.local_output_dir, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_gee(ctx):
+    import gee_fun
+    import utils
+
+    menu, city_inputs = ctx.menu, ctx.city_inputs
+    gee_outputs = []
+
+    if menu['forest']:  # processing time (all GEE): 1m
+        gee_outputs += gee_fun.gee_forest(ctx.city_name_l, ctx.aoi_file, ctx.cloud_bucket, ctx.output_dir)
+
+    if menu['green']:
+        gee_outputs += gee_fun.gee_ndxi(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, city_inputs['first_year'], city_inputs['last_year'], ctx.data_bucket, ctx.cloud_bucket, ctx.output_dir, index_type = 'ndvi')
+
+    if menu['landcover']:
+        gee_outputs += gee_fun.gee_landcover(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir)
+        utils.upload_blob(ctx.cloud_bucket, f"{ctx.local_output_dir}/{ctx.city_name_l}_lc.csv", f'{ctx.output_dir}/{ctx.city_name_l}_lc.csv')
+        gee_fun.gee_landcover_stats(ctx.cloud_bucket, ctx.city_name, ctx.city_name_l, ctx.local_output_dir, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+    if menu['lst_summer']:
+        gee_outputs += gee_fun.gee_lst(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, city_inputs['first_year'], city_inputs['last_year'], ctx.data_bucket, ctx.cloud_bucket, ctx.output_dir, season = 'summer')
+
+    if menu['lst_winter']:
+        gee_outputs += gee_fun.gee_lst(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, city_inputs['first_year'], city_inputs['last_year'], ctx.data_bucket, ctx.cloud_bucket, ctx.output_dir, season = 'winter')
+
+    if menu['ndmi']:
+        gee_outputs += gee_fun.gee_ndxi(ctx.city_name_l, ctx.aoi_file, ctx.local_output_dir, city_inputs['first_year'], city_inputs['last_year'], ctx.data_bucket, ctx.cloud_bucket, ctx.output_dir, index_type = 'ndmi')
+
+    if menu['nightlight']:
+        gee_outputs += gee_fun.gee_nightlight(ctx.city_name_l, ctx.aoi_file, ctx.cloud_bucket, ctx.output_dir)
+
+    # Earth Engine writes the exports to the bucket directly, so they are checked with backoff
+    utils.wait_for_blobs(ctx.cloud_bucket, gee_outputs)
+    print('All GEE outputs are ready.')
+
+def run_basic_info(ctx):
+    import yaml
+    import basic_info
+    import utils
+
+    basic_info_dict = {
+        'country': ctx.country_name,
+        'aoi_area': basic_info.calculate_aoi_area(ctx.aoi_file),
+        'koeppen': basic_info.get_koeppen_classification(ctx.features, ctx.data_bucket, ctx.global_inputs['koeppen_blob'], ctx.local_data_dir)
+    }
+
+    with open(f'{ctx.local_output_dir}/{ctx.city_name_l}_basic_info.yml', 'w') as f:
+        yaml.dump(basic_info_dict, f)
+    utils.upload_blob(ctx.cloud_bucket, f'{ctx.local_output_dir}/{ctx.city_name_l}_basic_info.yml', f'{ctx.output_dir}/{ctx.city_name_l}_basic_info.yml')
+
+def run_oe_plot(ctx):
+    import oe_plot
+    oe_plot.oe_plot(ctx.data_bucket, ctx.cloud_bucket, ctx.global_inputs['oe_dir'], ctx.global_inputs['oe_locations_blob'], ctx.global_inputs['oegc_blob'], ctx.global_inputs['countries_shp_blob'], ctx.local_data_dir,
+                    ctx.country_name, ctx.country_name_l, ctx.city_name, ctx.city_name_l, ctx.city_inputs.get('alternate_city_name', None), ctx.local_output_dir, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_earthquake(ctx):
+    import earthquake_event
+    earthquake_event.plot_earthquake_event(ctx.features, ctx.city_name_l, ctx.local_output_dir, ctx.cloud_bucket, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_flood_event(ctx):
+    import flood_event
+    flood_event.plot_flood_event(ctx.data_bucket, ctx.cloud_bucket, ctx.global_inputs['flood_archive_dir'], ctx.global_inputs['flood_archive_blob'], ctx.features, ctx.local_data_dir, ctx.local_output_dir, ctx.city_name_l, ctx.output_dir, ctx.render_dir, ctx.font_dict)
+
+def run_ghs_population(ctx):
+    import ghs_population
+    ghs_population.ghs_population(ctx.aoi_file, ctx.city_inputs, ctx.local_output_dir, ctx.city_name_l, ctx.global_inputs['ghsl_bucket'], ctx.cloud_bucket, ctx.output_dir, ctx.global_inputs['ghsl_blob'])
+
+def run_ghs_builtup(ctx):
+    import ghs_builtup
+    ghs_builtup.ghs_builtup(ctx.aoi_file, ctx.city_inputs, ctx.local_output_dir, ctx.city_name_l, ctx.global_inputs['ghsl_bucket'], ctx.cloud_bucket, ctx.output_dir, ctx.global_inputs['ghsl_blob'])
+    ghs_builtup.ghs_builtup_overtime(ctx.aoi_file, ctx.city_inputs, ctx.local_output_dir, ctx.city_name_l, ctx.global_inputs['ghsl_bucket'], ctx.cloud_bucket, ctx.output_dir, ctx.global_inputs['ghsl_blob'], threshold=1200)
+
+
+########################################################
+# REGISTRY #############################################
+########################################################
+
+BURNED_AREA_PARTS = range(1, 6)
+GLOBAL_RASTERS = ['air', 'landslide', 'liquefaction', 'solar']
+FLOOD_MENU_ITEMS = ['flood_coastal', 'flood_fluvial', 'flood_pluvial']
+GEE_MENU_ITEMS = ['forest', 'green', 'landcover', 'lst_summer', 'lst_winter', 'ndmi', 'nightlight']
+
+# Estimated processing times (cost, in minutes) are from typical runs
+COMPONENTS = [
+    Component('accessibility', run_accessibility, ['accessibility'], inputs=['city:osm_query', 'city:accessibility_buffer'],
+              outputs=['osm_roads.gpkg'], scenarios=accessibility_scenarios, scenario_inputs=['city:isochrone'], cost=40),
+    *[Component(f'burned_area_{part}', run_burned_area_part(part), ['burned_area'], inputs=['global:burned_area_dir', 'global:burned_area_blob_prefix'],
+                transient=[f'globfire_centroids_{part}.csv'], sources=['{burned_area_dir}/{burned_area_blob_prefix}'], cost=60) for part in BURNED_AREA_PARTS],
+    Component('burned_area_merge', run_burned_area_merge, ['burned_area'], deps=[f'burned_area_{part}' for part in BURNED_AREA_PARTS],
+              outputs=['globfire_centroids.gpkg'], cost=1),
+    Component('demographics', run_demographics, ['demographics'], inputs=['country_iso3'],
+              outputs=['demographics.csv', 'demographics_summary.yml'], cost=19),
+    Component('population', run_population, ['population'], inputs=['country_iso3'],
+              outputs=['population.tif'], cost=0.5),
+    Component('wsf', run_wsf, ['wsf'],
+              outputs=['wsf_evolution.tif', 'wsf_evolution_utm.tif', 'wsf_stats.csv', 'wsf_evolution_3857.tif'], cost=0.5),
+    Component('elevation', run_elevation, ['elevation'],
+              outputs=['elevation.tif', 'elevation.csv', 'contours.gpkg'], transient=['elevation_buf.tif'], cost=6),
+    Component('slope', run_slope, ['slope'], deps=['elevation'],
+              outputs=['slope.tif', 'slope.csv'], cost=0.5),
+    Component('flood', run_flood, FLOOD_MENU_ITEMS, inputs=['city:flood.threshold', 'city:flood.return_period', 'global:fathom_aws_bucket'],
+              scenarios=flood_scenarios, scenario_inputs=['city:flood.year', 'city:flood.ssp'], cost=13),
+    Component('flood_stats', run_flood_stats, FLOOD_MENU_ITEMS, deps=['flood'], soft_deps=['wsf', 'population', 'road_network', 'accessibility'],
+              inputs=['city:flood', 'city:osm_query'],
+              outputs=['flood_wsf.csv', 'flood_pop.csv', 'flood_osm.csv', 'flood_road.csv'], cost=5),
+    Component('fwi', run_fwi, ['fwi'], inputs=['city:fwi_first_year', 'city:fwi_last_year', 'global:fwi_dir', 'global:fwi_blob_prefix'],
+              outputs=['fwi.tif', 'fwi.csv'], sources=['{fwi_dir}/{fwi_blob_prefix}'], cost=5),
+    Component('landcover_burn', run_landcover_burn, ['landcover_burn'], inputs=['global:lc_burn_blob'],
+              outputs=['lc_burn.tif'], sources=['{lc_burn_blob}'], cost=0.7),
+    Component('road_network', run_road_network, ['road_network'],
+              outputs=['major_roads.gpkg', 'nodes_and_edges.gpkg', 'road_network_basic_stats.csv'], cost=720),
+    Component('rwi', run_rwi, ['rwi'], inputs=['country_iso3', 'global:rwi_dir', 'global:rwi_blob_suffix'],
+              outputs=['rwi.gpkg'], sources=['{rwi_dir}/{country_iso3}{rwi_blob_suffix}'], cost=0.8),
+    Component('global_rasters', run_global_rasters, GLOBAL_RASTERS, inputs=[f'global:{i}_blob' for i in GLOBAL_RASTERS] + ['global:solar_graph_blob'],
+              outputs=[f'{i}.tif' for i in GLOBAL_RASTERS], sources=[f'{{{i}_blob}}' for i in GLOBAL_RASTERS] + ['{solar_graph_blob}'], cost=1),
+    Component('gee', run_gee, GEE_MENU_ITEMS, inputs=['city:first_year', 'city:last_year'],
+              outputs=['lc.csv'], cost=10),
+    Component('basic_info', run_basic_info, ['basic_info'], inputs=['global:koeppen_blob'],
+              outputs=['basic_info.yml'], sources=['{koeppen_blob}'], cost=0.5),
+    Component('oe_plot', run_oe_plot, ['oe_plot'], inputs=['global:oe_dir', 'global:oe_locations_blob', 'global:oegc_blob', 'city:alternate_city_name'],
+              sources=['{oe_dir}/{oe_locations_blob}', '{oe_dir}/{oegc_blob}'], cost=1),
+    Component('earthquake', run_earthquake, ['earthquake'], cost=0.5),
+    Component('flood_event', run_flood_event, ['flood_event'], inputs=['global:flood_archive_dir', 'global:flood_archive_blob'],
+              outputs=['flood_events.yml'], sources=['{flood_archive_dir}/{flood_archive_blob}.'], cost=0.5),
+    Component('ghs_population', run_ghs_population, ['ghs_population'], inputs=['global:ghsl_bucket', 'global:ghsl_blob'],
+              outputs=[f'ghs_pop_E{year}.tif' for year in range(1975, 2035, 5)], cost=5),
+    Component('ghs_builtup', run_ghs_builtup, ['ghs_builtup'], inputs=['global:ghsl_bucket', 'global:ghsl_blob'],
+              outputs=['ghs_built_over_time.tif'], cost=5),
+]
+
+REGISTRY = {c.name: c for c in COMPONENTS}
+
+def get_component(name):
+    return REGISTRY[name]
+
+def enabled_components(menu):
+    """Return the enabled components, keeping only dependencies that are enabled as well."""
+    import copy
+
+    enabled = [copy.copy(c) for c in COMPONENTS if c.is_enabled(menu)]
+    enabled_names = {c.name for c in enabled}
+    for c in enabled:
+        c.deps = [d for d in c.deps if d in enabled_names]
+        c.soft_deps = [d for d in c.soft_deps if d in enabled_names]
+    return enabled
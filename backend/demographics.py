@@ -1,16 +1,10 @@
 def demographics(local_data_dir, local_output_dir, data_bucket, cloud_bucket, city_name_l, country_iso3, features, output_dir):
     import raster_pro
-    import requests
-    import os
+    import shared_assets
     import utils
 
-    local_demo_folder = f'{local_data_dir}/demographics'
-    os.makedirs(local_demo_folder, exist_ok=True)
-
-    wp_file_json = requests.get(f"https://www.worldpop.org/rest/data/age_structures/ascic_2020?iso3={country_iso3}").json()
-    wp_file_list = wp_file_json['data'][0]['files']
-
-    raster_pro.download_raster(wp_file_list, local_demo_folder, data_bucket, data_bucket_dir='WorldPop age structures')
+    # Downloaded once per country and shared by all cities in it
+    local_demo_folder = shared_assets.age_structure_rasters(country_iso3, local_data_dir, data_bucket)
 
     sexes = ['f', 'm']
 
@@ -123,6 +117,6 @@ def demo_plot(city_name, city_name_l, render_dir, font_dict, local_output_dir, c
     with open(f"{local_output_dir}/{city_name_l}_demographics_summary.yml", 'w') as summary_file:
         yaml.dump(summary_data, summary_file, default_flow_style=False)
 
-    utils.upload_blob(cloud_bucket, render_path, f'{render_dir}/{city_name_l}_age_stats.png', type = 'render')
-    utils.upload_blob(cloud_bucket, render_path.replace('.png', '.html'), f'{render_dir}/{city_name_l}_age_stats.html', type = 'render')
+    utils.upload_many(cloud_bucket, [(render_path, f'{render_dir}/{city_name_l}_age_stats.png'), 
+                                     (render_path.replace('.png', '.html'), f'{render_dir}/{city_name_l}_age_stats.html')], type = 'render')
     utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_demographics_summary.yml', f'{output_dir}/{city_name_l}_demographics_summary.yml')
@@ -2,7 +2,6 @@ def elevation(aoi_file, local_data_dir, data_bucket, city_name, city_name_l, loc
     import raster_pro
     import zipfile
     import os
-    import rasterio
     import utils
 
     # download
@@ -35,15 +34,12 @@ def elevation(aoi_file, local_data_dir, data_bucket, city_name, city_name_l, loc
                 pass
     
     if mosaic_list:
-        raster_pro.mosaic_raster(mosaic_list, local_elev_folder, f'{city_name_l}_elevation.tif')
-        out_image, out_meta = raster_pro.raster_mask_file(f'{local_elev_folder}/{city_name_l}_elevation.tif', aoi_file.geometry)
-        with rasterio.open(f'{local_output_dir}/{city_name_l}_elevation.tif', "w", **out_meta) as dest:
-            dest.write(out_image)
-        out_image, out_meta = raster_pro.raster_mask_file(f'{local_elev_folder}/{city_name_l}_elevation.tif', aoi_file_buf.geometry)
-        with rasterio.open(f'{local_output_dir}/{city_name_l}_elevation_buf.tif', "w", **out_meta) as dest:
-            dest.write(out_image)
-        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_elevation.tif', f'{output_dir}/{city_name_l}_elevation.tif')
-        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_elevation_buf.tif', f'{output_dir}/{city_name_l}_elevation_buf.tif')
+        elev_mosaic = raster_pro.mosaic_raster(mosaic_list, local_elev_folder, f'{city_name_l}_elevation.tif', virtual=True)
+        out_image, out_meta = raster_pro.raster_mask_file(elev_mosaic, aoi_file.geometry)
+        raster_pro.write_raster(f'{local_output_dir}/{city_name_l}_elevation.tif', out_image, out_meta)
+        out_image, out_meta = raster_pro.raster_mask_file(elev_mosaic, aoi_file_buf.geometry)
+        raster_pro.write_raster(f'{local_output_dir}/{city_name_l}_elevation_buf.tif', out_image, out_meta)
+        utils.upload_many(cloud_bucket, [(f'{local_output_dir}/{city_name_l}_{f}', f'{output_dir}/{city_name_l}_{f}') for f in ['elevation.tif', 'elevation_buf.tif']])
         with open(f"{local_output_dir}/{city_name_l}_elevation_source.txt", 'w') as f:
             f.write('FABDEM')
     else:
@@ -5,74 +5,154 @@ def set_flood_folder(local_data_dir):
     os.makedirs(local_flood_folder, exist_ok=True)
     return local_flood_folder
 
-def download_fathom_from_aws(download_list, aws_access_key_id, aws_secret_access_key, aws_bucket, local_flood_folder, data_bucket, data_bucket_dir):
-    # download requested raster file(s) and return a list of downloaded raster file(s)
+# Fathom folders of the flood types and labels of the SSP scenarios
+FLOOD_TYPE_FOLDERS = {'coastal': 'COASTAL-UNDEFENDED',
+                      'fluvial': 'FLUVIAL-UNDEFENDED',
+                      'pluvial': 'PLUVIAL-DEFENDED'}
+FLOOD_SSP_LABELS = {1: '1_2.6', 2: '2_4.5', 3: '3_7.0', 5: '5_8.5'}
+
+def fathom_key(ft, year, ssp, rp, lat, lon):
+    """S3 key of a Fathom tile; ssp is None for years up to 2020."""
+    scenario = f'{year}' if ssp is None else f'{year}-SSP{FLOOD_SSP_LABELS[ssp]}'
+    return f"FATHOM/v2023/GLOBAL-1ARCSEC-NW_OFFSET-1in{rp}-{FLOOD_TYPE_FOLDERS[ft]}-DEPTH-{scenario}-PERCENTILE50-v3.0/{lat.lower()}{lon.lower()}.tif"
+
+def plan_fathom_downloads(menu, flood_types, flood_years, flood_ssps, flood_rps, lat_tiles, lon_tiles):
+    """
+    Enumerate the Fathom tiles of a run up front.
+
+    Returns:
+        A dict of (flood type, year, ssp, return period) to the S3 keys of its tiles, with
+        ssp None for years up to 2020.
+    """
+    plan = {}
+    for ft in flood_types:
+        if menu[f'flood_{ft}']:
+            for year in flood_years:
+                for ssp in ([None] if year <= 2020 else flood_ssps):
+                    for rp in flood_rps:
+                        plan[(ft, year, ssp, rp)] = [fathom_key(ft, year, ssp, rp, lat, lon) for lat in lat_tiles for lon in lon_tiles]
+    return plan
+
+def download_fathom_from_aws(download_list, aws_access_key_id, aws_secret_access_key, aws_bucket, local_flood_folder, data_bucket, data_bucket_dir, endpoint_url = None, max_workers = 8):
+    """
+    Download Fathom tiles once each: from the mirror in the data bucket when they are there
+    (checked and fetched concurrently), otherwise from the Fathom S3 bucket with a bounded
+    pool of threads, mirroring them to the data bucket.
+
+    Args:
+        download_list: S3 keys of the tiles; duplicates are downloaded once.
+        endpoint_url: S3 endpoint, e.g. of a local S3-compatible server for tests (default: AWS).
+        max_workers: Maximum number of concurrent downloads.
+
+    Returns:
+        The local paths of the downloaded tiles, in the order of the first occurrence of
+        their keys. Tiles that Fathom does not have (e.g. in the ocean) are left out.
+    """
     if not download_list:
         print('download_raster function error: download_list is empty')
         exit()
 
     import boto3
+    from botocore.exceptions import ClientError
     import utils
+    import perf
     import os
-    
-    downloaded_list = []
+    from concurrent.futures import ThreadPoolExecutor
 
-    # initiate s3 resource
-    s3 = boto3.resource('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-    # select bucket
-    bucket = s3.Bucket(name=aws_bucket)
+    keys = list(dict.fromkeys(download_list))
+    local_paths = {f: f'{local_flood_folder}/{f[7:]}' for f in keys}
 
-    for f in download_list:
-        os.makedirs(os.path.dirname(f'{local_flood_folder}/{f[7:]}'), exist_ok=True)
-        if utils.download_blob(data_bucket, f'{data_bucket_dir}/{f[7:]}', f'{local_flood_folder}/{f[7:]}'):
-            downloaded_list.append(f'{local_flood_folder}/{f[7:]}')
-        else:
+    # fetch every tile already mirrored in the data bucket concurrently
+    mirror_results = utils.download_many(data_bucket, [(f'{data_bucket_dir}/{f[7:]}', local_paths[f]) for f in keys], max_workers=max_workers, cache=True)
+    downloaded = {f for f, r in zip(keys, mirror_results) if r['ok']}
+    missing = [f for f in keys if f not in downloaded]
+
+    if missing:
+        print(f'Downloading {len(missing)} Fathom tiles from S3.')
+        # boto3 clients (unlike resources) can be shared by threads
+        s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, endpoint_url=endpoint_url)
+
+        def fetch(f):
+            try:
+                size = s3.head_object(Bucket=aws_bucket, Key=f)['ContentLength']
+            except Exception as e:
+                if isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                    # no such tile
+                    return False
+                # credentials, throttling, network, etc.
+                print(f'{f} head_object exception: {e}')
+                raise
             try:
-                for obj in bucket.objects.filter(Prefix = f):
-                    bucket.download_file(obj.key, f'{local_flood_folder}/{f[7:]}')
-                if utils.upload_blob(data_bucket, f'{local_flood_folder}/{f[7:]}', f'{data_bucket_dir}/{f[7:]}', type = 'data'):
-                    downloaded_list.append(f'{local_flood_folder}/{f[7:]}')
+                os.makedirs(os.path.dirname(local_paths[f]), exist_ok=True)
+                s3.download_file(aws_bucket, f, local_paths[f])
+                perf.record_transfer(f's3:{aws_bucket}', 'download', size)
+                return True
             except Exception as e:
                 print(f'{f} download exception: {e}')
+                return False
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            fetched = [f for f, ok in zip(missing, executor.map(fetch, missing)) if ok]
+        upload_results = utils.upload_many(data_bucket, [(local_paths[f], f'{data_bucket_dir}/{f[7:]}') for f in fetched], type='data', max_workers=max_workers)
+        downloaded.update(f for f, r in zip(fetched, upload_results) if r['ok'])
 
-    return downloaded_list
+    return [local_paths[f] for f in keys if f in downloaded]
 
-def apply_flood_threshold(out_image, out_meta, flood_threshold, prob):
+def flood_probability_codes(flood_rps):
+    """
+    uint8 codes of the return periods for compositing, ordered by flood probability (100/rp),
+    so that the max of the codes is the code of the max probability.
+
+    Returns:
+        A dict of return period to code (1 for the least probable), and the float32 lookup
+        table of the probability of each code (0 for code 0, i.e. not flooded).
+    """
     import numpy as np
 
-    # Ensure out_image is a NumPy array
-    out_image = np.asarray(out_image)
+    probabilities = sorted({100/rp for rp in flood_rps})
+    return {rp: probabilities.index(100/rp) + 1 for rp in flood_rps}, np.array([0] + probabilities, dtype=np.float32)
 
-    # Replace nodata values with 0
-    out_image[out_image == out_meta['nodata']] = 0
+def fold_flood_threshold(composite, out_image, out_meta, flood_threshold, code):
+    """
+    Fold one return period into the running composite: pixels flooded at least
+    flood_threshold deep (nodata counting as 0) are set to code where it is higher.
 
-    # Apply flood threshold
-    out_image = np.where(out_image < flood_threshold, 0, out_image)
-    out_image = np.where(out_image >= flood_threshold, 1, out_image)
+    Args:
+        composite: The uint8 composite so far, or None for the first return period.
+        out_image: The masked flood depths of the return period.
 
-    # Multiply by probability
-    out_image = out_image * prob
+    Returns:
+        The composite and out_meta updated for the composite raster.
+    """
+    import numpy as np
 
-    # Update metadata
-    out_meta.update({'nodata': 0, 'dtype': 'float32'})
+    if composite is None:
+        composite = np.zeros(out_image.shape, dtype=np.uint8)
 
-    return out_image, out_meta
+    flooded = out_image >= flood_threshold
+    if out_meta['nodata'] is not None:
+        flooded[out_image == out_meta['nodata']] = 0 >= flood_threshold
+    np.maximum(composite, flooded.view(np.uint8) * np.uint8(code), out=composite)
 
-def composite_flood_raster(raster_arrays, out_meta, output_raster):
+    out_meta.update({'nodata': 0, 'dtype': 'float32'})
+    return composite, out_meta
+
+def composite_flood_raster(composite, probabilities, out_meta, output_raster):
+    """Write the composite of return period codes as flood probabilities (float32), and return them."""
     import numpy as np
-    import rasterio
+    import raster_pro
 
-    out_image = np.squeeze(np.maximum.reduce(raster_arrays)).astype(np.float32)
+    out_image = probabilities[np.squeeze(composite)]
 
-    with rasterio.open(output_raster, 'w', **out_meta) as dst:
-        dst.write(out_image, 1)
+    raster_pro.write_raster(output_raster, out_image, out_meta)
+    return out_image
 
 def check_asset_exists(menu, menu_item, cloud_bucket, output_dir, local_output_dir, city_name_l, file_name, wait_minute=30):
     import utils
 
     if menu[menu_item]:
-        if utils.download_blob_timed(cloud_bucket, f"{output_dir}/spatial/{city_name_l}_{file_name}", f'{local_output_dir}/{city_name_l}_{file_name}', wait_minute*60, 60):
-            return True
+        # The asset is produced in this run; wait for it to be published
+        return utils.download_blob_timed(cloud_bucket, f"{output_dir}/spatial/{city_name_l}_{file_name}", f'{local_output_dir}/{city_name_l}_{file_name}', wait_minute*60, 60)
     else:
         return utils.download_blob(cloud_bucket, f"{output_dir}/spatial/{city_name_l}_{file_name}", f'{local_output_dir}/{city_name_l}_{file_name}')
 
@@ -83,26 +163,19 @@ def conditional_assign(dictionary, key, value):
 def calculate_flood_wsf_stats(wsf_exists, local_output_dir, city_name_l, flood_raster):
     if wsf_exists:
         import raster_pro
-        import rasterio
-        import numpy as np
         from os.path import exists
 
         # reproject flood raster to match wsf raster grid
         if not exists(f'{local_output_dir}/{flood_raster[:-4]}_wsf.tif'):
             raster_pro.reproject_raster(f'{local_output_dir}/{flood_raster}', f'{local_output_dir}/{flood_raster[:-4]}_wsf.tif', target_raster_path=f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif')
 
-        # computer zonal stats
+        # computer zonal stats: built-up area by year where flooded, in one pass
         flood_stats = {}
-
-        with rasterio.open(f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif') as wsf:
-            wsf_array = wsf.read(1)
-            pixelSizeX, pixelSizeY = wsf.res
-
-            with rasterio.open(f'{local_output_dir}/{flood_raster[:-4]}_wsf.tif') as fld:
-                flood_array = fld.read(1)
-                for year in range(1985, 2016):
-                    exposed_sqkm = np.count_nonzero(flood_array[wsf_array == year]) * pixelSizeX * pixelSizeY / 1e6
-                    flood_stats[year] = exposed_sqkm + flood_stats.get(year - 1, 0)
+        exposed_area = raster_pro.zonal_counts(f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif', values=range(1985, 2016),
+                                               where=f'{local_output_dir}/{flood_raster[:-4]}_wsf.tif', area=True)
+        for year in range(1985, 2016):
+            exposed_sqkm = exposed_area[year] / 1e6
+            flood_stats[year] = exposed_sqkm + flood_stats.get(year - 1, 0)
         
         return flood_stats
     return
@@ -145,78 +218,79 @@ def calculate_flood_pop_stats(pop_exists, local_output_dir, city_name_l, flood_r
     return
 
 def calculate_flood_osm_stats(osm_exists, local_output_dir, city_name_l, poi, flood_raster):
+    """
+    Share of the POIs of a category in flood zones (flood value > 0). flood_raster is a
+    raster name, or a list of them to sample in one call, which returns a dict of raster
+    name to stats.
+    """
     if osm_exists:
         import geopandas as gpd
-        import rasterio
-        from rasterio.transform import rowcol
+        import numpy as np
+        import raster_pro
         
         # load osm shapefile
         osm_gdf = gpd.read_file(f'{local_output_dir}/{city_name_l}_osm_{poi}.gpkg', layer = poi)
 
-        # Load the flood zone raster
-        with rasterio.open(f'{local_output_dir}/{flood_raster}') as src:
-            flood_data = src.read(1)  # Read the first band (assuming single-band raster)
-            flood_transform = src.transform  # Get the affine transformation matrix
+        # Sample the flood zone raster(s) at every location at once
+        flood_rasters = [flood_raster] if isinstance(flood_raster, str) else flood_raster
+        samples = raster_pro.sample_points([f'{local_output_dir}/{f}' for f in flood_rasters], osm_gdf.geometry.x.values, osm_gdf.geometry.y.values)
 
-        # Function to check if a point is in a flood zone
-        def is_in_flood_zone(point, flood_data, transform):
-            # Convert point coordinates to row, col in raster space
-            row, col = rowcol(transform, point.x, point.y)
+        stats = {}
+        for f, values in zip(flood_rasters, samples):
+            # Calculate total number of locations and those in flood zones
+            total_pois = len(osm_gdf)
+            pois_in_flood_zone = np.sum(values > 0)
 
-            # Check if the point falls within the bounds of the raster
-            if 0 <= row < flood_data.shape[0] and 0 <= col < flood_data.shape[1]:
-                # Return True if the value at that location is greater than 0 (flood zone)
-                return flood_data[row, col] > 0
-            return False
+            # Calculate percentage of pois in flood zones
+            percentage_in_flood_zone = (pois_in_flood_zone / total_pois) * 100
+            stats[f] = (total_pois, pois_in_flood_zone, percentage_in_flood_zone)
 
-        # Apply the function to each osm location
-        osm_gdf['in_flood_zone'] = osm_gdf['geometry'].apply(lambda point: is_in_flood_zone(point, flood_data, flood_transform))
+        # Return results
+        return stats[flood_raster] if isinstance(flood_raster, str) else stats
+    return
 
-        # Calculate total number of locations and those in flood zones
-        total_pois = len(osm_gdf)
-        pois_in_flood_zone = osm_gdf['in_flood_zone'].sum()
+# Road length by cell of each flood grid (see road_cell_lengths)
+_road_cell_lengths = {}
 
-        # Calculate percentage of pois in flood zones
-        percentage_in_flood_zone = (pois_in_flood_zone / total_pois) * 100
+def road_cell_lengths(roads_file, utm_crs, transform, width, height):
+    """
+    The major roads in utm_crs, and their length by cell of a flood grid
+    (raster_pro.line_cell_lengths), computed once per roads file and grid and shared by
+    all the flood scenarios on that grid.
+    """
+    import os
+    import geopandas as gpd
+    import raster_pro
 
-        # Return results
-        return total_pois, pois_in_flood_zone, percentage_in_flood_zone
-    return
+    key = (roads_file, os.path.getmtime(roads_file), str(utm_crs), tuple(transform), width, height)
+    if key not in _road_cell_lengths:
+        major_roads_gdf = gpd.read_file(roads_file, layer='major_roads').to_crs(utm_crs)
+        cells = lengths = None
+        if not major_roads_gdf.empty:
+            cells, lengths = raster_pro.line_cell_lengths(major_roads_gdf.geometry.values, transform, width, height)
+        if len(_road_cell_lengths) >= 4:
+            _road_cell_lengths.pop(next(iter(_road_cell_lengths)))
+        _road_cell_lengths[key] = (major_roads_gdf, cells, lengths)
+    return _road_cell_lengths[key]
 
 def calculate_flood_road_stats(road_exists, local_output_dir, city_name_l, utm_crs, flood_raster):
     if road_exists:
-        import geopandas as gpd
         import rasterio
-        from shapely.geometry import shape
 
-        # Step 1: Load the roads layer from the GeoPackage
-        major_roads_gdf = gpd.read_file(f'{local_output_dir}/{city_name_l}_major_roads.gpkg', layer='major_roads').to_crs(utm_crs)
+        # Load the flood zone raster
+        with rasterio.open(f'{local_output_dir}/{flood_raster}') as src:
+            flood_data = src.read(1)  # Read first band (assuming single-band raster)
+            flood_transform = src.transform  # Get affine transformation
+
+        # Load the roads layer from the GeoPackage, and their length in each cell of the flood grid
+        major_roads_gdf, cells, lengths = road_cell_lengths(f'{local_output_dir}/{city_name_l}_major_roads.gpkg', utm_crs, flood_transform, flood_data.shape[1], flood_data.shape[0])
 
         if major_roads_gdf.empty:
             total_major_road_length = length_in_flood_zones = percentage_in_flood_zones = 0
         else:
-            # Step 2: Load the flood zone raster
-            with rasterio.open(f'{local_output_dir}/{flood_raster}') as src:
-                flood_data = src.read(1)  # Read first band (assuming single-band raster)
-                flood_transform = src.transform  # Get affine transformation
-
-            # Step 3: Create a mask for the flood zones
-            flood_zone_mask = flood_data > 0
-
-            # Step 4: Convert the flood zone mask to polygons
-            flood_zone_polygons = [
-                shape(geom) for geom, value in rasterio.features.shapes(flood_zone_mask.astype('uint8'), transform=flood_transform) if value == 1
-            ]
-
-            # Step 5: Create a GeoDataFrame for the flood zones
-            flood_zones_gdf = gpd.GeoDataFrame(geometry=flood_zone_polygons, crs=utm_crs)
-
-            # Step 6: Clip the major roads to the flood zones
-            clipped_roads_gdf = gpd.overlay(major_roads_gdf, flood_zones_gdf, how='intersection')
-
-            # Step 7: Calculate the total length of major roads and those in flood zones
+            # Calculate the total length of major roads and those in flood zones, by lookup
             total_major_road_length = major_roads_gdf.length.sum()
-            length_in_flood_zones = clipped_roads_gdf.length.sum()
+            length_in_flood_zones = lengths[flood_data.ravel()[cells] > 0].sum()
 
             # Calculate percentage of major roads in flood zones
             percentage_in_flood_zones = (length_in_flood_zones / total_major_road_length) * 100
@@ -244,6 +318,19 @@ def calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_buck
     flood_osm_stats = {}
     flood_road_stats = {}
 
+    # sample every scenario raster at the POIs of a category in one call
+    osm_results = {}
+    if osm_pois is not None:
+        scenario_rasters = []
+        for ft in flood_types+['comb']:
+            if menu[f'flood_{ft}']:
+                for year in flood_years:
+                    scenarios = [f'{ft}_{year}'] if year <= 2020 else [f'{ft}_{year}_ssp{ssp}' for ssp in flood_ssps]
+                    scenario_rasters += [f'{city_name_l}_{sc}.tif' for sc in scenarios if exists(f'{local_output_dir}/{city_name_l}_{sc}.tif')]
+        if scenario_rasters:
+            for poi in osm_pois:
+                osm_results[poi] = calculate_flood_osm_stats(osm_exists.get(poi, False), local_output_dir, city_name_l, poi, scenario_rasters) or {}
+
     for ft in flood_types+['comb']:
         if menu[f'flood_{ft}']:
             flood_wsf_stats[ft] = {}
@@ -259,7 +346,7 @@ def calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_buck
                         conditional_assign(flood_road_stats[ft], year, calculate_flood_road_stats(road_exists, local_output_dir, city_name_l, utm_crs, f'{city_name_l}_{ft}_{year}_utm.tif'))
                         if osm_pois is not None:
                             for poi in osm_pois:
-                                conditional_assign(flood_osm_stats[ft][year], poi, calculate_flood_osm_stats(osm_exists.get(poi, False), local_output_dir, city_name_l, poi, f'{city_name_l}_{ft}_{year}.tif'))
+                                conditional_assign(flood_osm_stats[ft][year], poi, osm_results[poi].get(f'{city_name_l}_{ft}_{year}.tif'))
                 elif year > 2020:
                     flood_wsf_stats[ft][year] = {}
                     flood_pop_stats[ft][year] = {}
@@ -272,7 +359,7 @@ def calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_buck
                             flood_osm_stats[ft][year][ssp] = {}
                             if osm_pois is not None:
                                 for poi in osm_pois:
-                                    conditional_assign(flood_osm_stats[ft][year][ssp], poi, calculate_flood_osm_stats(osm_exists.get(poi, False), local_output_dir, city_name_l, poi, f'{city_name_l}_{ft}_{year}_ssp{ssp}.tif'))
+                                    conditional_assign(flood_osm_stats[ft][year][ssp], poi, osm_results[poi].get(f'{city_name_l}_{ft}_{year}_ssp{ssp}.tif'))
     
     # save flood stats as csv and upload
     # wsf
@@ -350,16 +437,7 @@ def calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_buck
     df.to_csv(f'{local_output_dir}/{city_name_l}_flood_road.csv', index=False)
     utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_flood_road.csv', f'{output_dir}/{city_name_l}_flood_road.csv')
 
-def process_fathom(aoi_file, city_name_l, local_data_dir, city_inputs, menu, aws_access_key_id, aws_secret_access_key, aws_bucket, data_bucket, data_bucket_dir, local_output_dir, cloud_bucket, output_dir):
-    print('run process_fathom')
-    
-    import raster_pro
-    import numpy as np
-    import utils
-    from os.path import exists
-    import rasterio
-
-    # set parameters
+def get_flood_params(city_inputs):
     flood_threshold = city_inputs['flood']['threshold']
     flood_years = city_inputs['flood']['year']
     if isinstance(flood_years, int):
@@ -371,10 +449,147 @@ def process_fathom(aoi_file, city_name_l, local_data_dir, city_inputs, menu, aws
     if ('osm_query' in city_inputs) and bool(city_inputs['osm_query']):
         osm_pois = city_inputs['osm_query']
 
-    flood_ssp_labels = {1: '1_2.6', 2: '2_4.5', 3: '3_7.0', 5: '5_8.5'}
-    flood_type_folder_dict = {'coastal': 'COASTAL-UNDEFENDED',
-                              'fluvial': 'FLUVIAL-UNDEFENDED',
-                              'pluvial': 'PLUVIAL-DEFENDED'}
+    return flood_threshold, flood_years, flood_ssps, flood_rps, flood_types, osm_pois
+
+def flood_scenario_outputs(city_inputs, menu):
+    """
+    Output rasters of process_fathom per year and SSP (None up to 2020), as names without
+    the city name prefix: each enabled flood type and, with flood_comb, their combination,
+    with their UTM versions.
+    """
+    _, flood_years, flood_ssps, _, flood_types, _ = get_flood_params(city_inputs)
+    fts = [ft for ft in flood_types if menu[f'flood_{ft}']] + (['comb'] if menu['flood_comb'] else [])
+    outputs = {}
+    for year in flood_years:
+        for ssp in ([None] if year <= 2020 else flood_ssps):
+            suffix = f'{year}' if ssp is None else f'{year}_ssp{ssp}'
+            outputs[(year, ssp)] = [f'{ft}_{suffix}{suf}.tif' for ft in fts for suf in ['', '_utm']]
+    return outputs
+
+def flood_stats(aoi_file, city_name_l, city_inputs, menu, local_output_dir, cloud_bucket, output_dir):
+    """
+    Calculate flood exposure stats from the flood rasters written by process_fathom.
+    Rasters that are not available locally (i.e. process_fathom ran in another task)
+    are downloaded from the output directory first.
+    """
+    print('run flood_stats')
+
+    import utils
+
+    _, flood_years, flood_ssps, _, flood_types, osm_pois = get_flood_params(city_inputs)
+    utm_crs = aoi_file.estimate_utm_crs()
+
+    flood_rasters = []
+    for ft in flood_types + ['comb']:
+        if menu[f'flood_{ft}']:
+            for year in flood_years:
+                scenarios = [f'{ft}_{year}'] if year <= 2020 else [f'{ft}_{year}_ssp{ssp}' for ssp in flood_ssps]
+                flood_rasters += [f'{city_name_l}_{sc}{suf}.tif' for sc in scenarios for suf in ['', '_utm']]
+    utils.download_many(cloud_bucket, [(f'{output_dir}/spatial/{f}', f'{local_output_dir}/{f}') for f in flood_rasters], check_exists=True)
+
+    calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_bucket, output_dir, local_output_dir, city_name_l, osm_pois, utm_crs)
+
+# Memory of a flood scenario process: a baseline for the interpreter and libraries, and bytes
+# per pixel of the buffered AOI window (flood depths and their mask, the flooded mask, the
+# uint8 composite, the float32 probabilities and their COG and UTM copies)
+FLOOD_WORKER_BASE_BYTES = 400e6
+FLOOD_BYTES_PER_PIXEL = 24
+# Fathom resolution (1 arcsecond)
+FATHOM_RESOLUTION = 1 / 3600
+
+def available_memory():
+    """Bytes of memory available to this container (cgroup limit if any, else MemAvailable), or None."""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current') as f:
+            current = int(f.read().strip())
+        if limit != 'max':
+            return int(limit) - current
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def flood_workers(buffer_aoi, n_scenarios, max_workers = None):
+    """Number of flood scenario processes: bounded by the CPUs, max_workers and the memory available for their windows."""
+    import os
+
+    minx, miny, maxx, maxy = buffer_aoi.total_bounds
+    pixels = ((maxx - minx) / FATHOM_RESOLUTION) * ((maxy - miny) / FATHOM_RESOLUTION)
+    per_worker = FLOOD_WORKER_BASE_BYTES + pixels * FLOOD_BYTES_PER_PIXEL
+    workers = min(n_scenarios, max_workers or os.cpu_count() or 1)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, int(memory * 0.8 // per_worker))
+    return max(workers, 1)
+
+def process_flood_scenario(ft, year, ssp, rp_paths, buffer_geometry, flood_threshold, rp_codes, rp_probabilities, local_flood_folder, local_output_dir, city_name_l, utm_crs):
+    """
+    Composite the return periods of one flood type, year and SSP (None up to 2020), and
+    write the composite and its UTM version. Runs in a worker process, so it only reads and
+    writes local files.
+
+    Returns:
+        The names of the rasters written in local_output_dir, to be uploaded.
+    """
+    import raster_pro
+
+    scenario = f'{city_name_l}_{ft}_{year}' if ssp is None else f'{city_name_l}_{ft}_{year}_ssp{ssp}'
+
+    # running max over the return periods, folded in as soon as each is masked
+    composite = None
+    for rp, downloaded_list in rp_paths.items():
+        if downloaded_list:
+            mosaic_file = f"{downloaded_list[0].split('/')[3]}.tif"
+            flood_mosaic = raster_pro.mosaic_raster(downloaded_list, local_flood_folder, mosaic_file, virtual=True)
+            out_image, out_meta = raster_pro.raster_mask_file(flood_mosaic, buffer_geometry)
+            composite, out_meta = fold_flood_threshold(composite, out_image, out_meta, flood_threshold, rp_codes[rp])
+            del out_image
+    if composite is None:
+        return []
+
+    out_image = composite_flood_raster(composite, rp_probabilities, out_meta, f'{local_output_dir}/{scenario}.tif')
+    raster_pro.warp_outputs(out_image[None], out_meta, [{'path': f'{local_output_dir}/{scenario}_utm.tif', 'crs': utm_crs}])
+    return [f'{scenario}.tif', f'{scenario}_utm.tif']
+
+def comb_flood_rasters(flood_types, year, ssp, local_output_dir, city_name_l, utm_crs, cloud_bucket, output_dir):
+    """Combine the flood types of a year and SSP (None up to 2020) with their max, and upload the result."""
+    import raster_pro
+    import utils
+    from os.path import exists
+
+    suffix = f'{year}' if ssp is None else f'{year}_ssp{ssp}'
+    comb_list = [f'{local_output_dir}/{city_name_l}_{ft}_{suffix}.tif' for ft in flood_types if exists(f'{local_output_dir}/{city_name_l}_{ft}_{suffix}.tif')]
+    if comb_list:
+        raster_pro.mosaic_raster(comb_list, local_output_dir, f'{city_name_l}_comb_{suffix}.tif', method='max')
+        raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_comb_{suffix}.tif', f'{local_output_dir}/{city_name_l}_comb_{suffix}_utm.tif', dst_crs=utm_crs)
+
+        utils.upload_many(cloud_bucket, [(f'{local_output_dir}/{city_name_l}_comb_{suffix}{suf}.tif', f'{output_dir}/{city_name_l}_comb_{suffix}{suf}.tif') for suf in ['', '_utm']])
+
+def process_fathom(aoi_file, city_name_l, local_data_dir, city_inputs, menu, aws_access_key_id, aws_secret_access_key, aws_bucket, data_bucket, data_bucket_dir, local_output_dir, cloud_bucket, output_dir, aws_endpoint_url = None, max_workers = None, skip_scenarios = ()):
+    """
+    Composite the Fathom flood rasters of every enabled flood type, year and SSP. Years and
+    SSPs in skip_scenarios, as (year, ssp) with ssp None up to 2020, are left out: their
+    outputs are kept from a previous run (see fingerprint.reusable_scenarios).
+    """
+    print('run process_fathom')
+    
+    import raster_pro
+    import numpy as np
+    import utils
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+
+    # set parameters
+    flood_threshold, flood_years, flood_ssps, flood_rps, flood_types, osm_pois = get_flood_params(city_inputs)
+
     local_flood_folder = set_flood_folder(local_data_dir)
     
     # find relevant tiles
@@ -383,85 +598,50 @@ def process_fathom(aoi_file, city_name_l, local_data_dir, city_inputs, menu, aws
     lat_tiles = raster_pro.tile_finder(buffer_aoi, 'lat')
     lon_tiles = raster_pro.tile_finder(buffer_aoi, 'lon')
     utm_crs = aoi_file.estimate_utm_crs()
-    
-    flood_wsf_stats = {}
-    flood_pop_stats = {}
-    flood_osm_stats = {}
-    flood_road_stats = {}
-
-    for ft in flood_types:
-        if menu[f'flood_{ft}']:
-            flood_wsf_stats[ft] = {}
-            flood_pop_stats[ft] = {}
-            flood_osm_stats[ft] = {}
-            flood_road_stats[ft] = {}
-            for year in flood_years:
-                flood_wsf_stats[ft][year] = {}
-                flood_osm_stats[ft][year] = {}
-                if year <= 2020:
-                    out_image_arrays = []
-                    for rp in flood_rps:
-                        download_list = []
-                        for lat in lat_tiles:
-                            for lon in lon_tiles:
-                                download_list.append(f"FATHOM/v2023/GLOBAL-1ARCSEC-NW_OFFSET-1in{rp}-{flood_type_folder_dict[ft]}-DEPTH-{year}-PERCENTILE50-v3.0/{lat.lower()}{lon.lower()}.tif")
-                                downloaded_list = download_fathom_from_aws(download_list, aws_access_key_id, aws_secret_access_key, aws_bucket, local_flood_folder, data_bucket, data_bucket_dir)
-                        if downloaded_list:
-                            mosaic_file = f"{downloaded_list[0].split('/')[3]}.tif"
-                            raster_pro.mosaic_raster(downloaded_list, local_flood_folder, mosaic_file)
-                            out_image, out_meta = raster_pro.raster_mask_file(f'{local_flood_folder}/{mosaic_file}', buffer_aoi.geometry)
-                            out_image, out_meta = apply_flood_threshold(out_image, out_meta, flood_threshold, 100/rp)
-                            out_image_arrays.append(out_image)
-                    if out_image_arrays:
-                        composite_flood_raster(out_image_arrays, out_meta, f'{local_output_dir}/{city_name_l}_{ft}_{year}.tif')
-                        raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_{ft}_{year}.tif', f'{local_output_dir}/{city_name_l}_{ft}_{year}_utm.tif', dst_crs=utm_crs)
-
-                        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_{ft}_{year}.tif', f'{output_dir}/{city_name_l}_{ft}_{year}.tif')
-                        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_{ft}_{year}_utm.tif', f'{output_dir}/{city_name_l}_{ft}_{year}_utm.tif')
 
-                elif year > 2020:
-                    flood_pop_stats[ft][year] = {}
-                    flood_road_stats[ft][year] = {}
-                    for ssp in flood_ssps:
-                        out_image_arrays = []
-                        for rp in flood_rps:
-                            download_list = []
-                            for lat in lat_tiles:
-                                for lon in lon_tiles:
-                                    download_list.append(f"FATHOM/v2023/GLOBAL-1ARCSEC-NW_OFFSET-1in{rp}-{flood_type_folder_dict[ft]}-DEPTH-{year}-SSP{flood_ssp_labels[ssp]}-PERCENTILE50-v3.0/{lat.lower()}{lon.lower()}.tif")
-                                    downloaded_list = download_fathom_from_aws(download_list, aws_access_key_id, aws_secret_access_key, aws_bucket, local_flood_folder, data_bucket, data_bucket_dir)
-                            if downloaded_list:
-                                mosaic_file = f"{downloaded_list[0].split('/')[3]}.tif"
-                                raster_pro.mosaic_raster(downloaded_list, local_flood_folder, mosaic_file)
-                                out_image, out_meta = raster_pro.raster_mask_file(f'{local_flood_folder}/{mosaic_file}', buffer_aoi.geometry)
-                                out_image, out_meta = apply_flood_threshold(out_image, out_meta, flood_threshold, 100/rp)
-                                out_image_arrays.append(out_image)
-                        if out_image_arrays:
-                            composite_flood_raster(out_image_arrays, out_meta, f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif')
-                            raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif', f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}_utm.tif', dst_crs=utm_crs)
-                            
-                            utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif', f'{output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif')
-                            utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}_utm.tif', f'{output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}_utm.tif')
-                            
+    # download every tile of the run once, before processing the scenarios
+    plan = plan_fathom_downloads(menu, flood_types, flood_years, flood_ssps, flood_rps, lat_tiles, lon_tiles)
+    plan = {k: v for k, v in plan.items() if (k[1], k[2]) not in skip_scenarios}
+    download_list = [f for keys in plan.values() for f in keys]
+    downloaded = set()
+    rp_codes, rp_probabilities = flood_probability_codes(flood_rps)
+    if download_list:
+        downloaded = set(download_fathom_from_aws(download_list, aws_access_key_id, aws_secret_access_key, aws_bucket, local_flood_folder, data_bucket, data_bucket_dir, endpoint_url=aws_endpoint_url))
+
+    # scenarios are independent until the comb step: composite them in a pool of processes
+    scenarios = sorted({(ft, year, ssp) for ft, year, ssp, _ in plan}, key=str)
+    comb_pending = {}
+    for ft, year, ssp in scenarios:
+        comb_pending[(year, ssp)] = comb_pending.get((year, ssp), 0) + 1
+
+    def scenario_args(ft, year, ssp):
+        rp_paths = {rp: [f'{local_flood_folder}/{f[7:]}' for f in plan[(ft, year, ssp, rp)] if f'{local_flood_folder}/{f[7:]}' in downloaded] for rp in flood_rps}
+        return (ft, year, ssp, rp_paths, buffer_aoi.geometry, flood_threshold, rp_codes, rp_probabilities, local_flood_folder, local_output_dir, city_name_l, utm_crs)
+
+    def scenario_done(year, ssp, outputs):
+        if outputs:
+            utils.upload_many(cloud_bucket, [(f'{local_output_dir}/{f}', f'{output_dir}/{f}') for f in outputs])
+        # the comb raster of a year and SSP starts as soon as all its flood types are done
+        comb_pending[(year, ssp)] -= 1
+        if comb_pending[(year, ssp)] == 0 and menu['flood_comb']:
+            comb_flood_rasters(flood_types, year, ssp, local_output_dir, city_name_l, utm_crs, cloud_bucket, output_dir)
+
+    workers = flood_workers(buffer_aoi, len(scenarios), max_workers)
+    if workers <= 1:
+        for ft, year, ssp in scenarios:
+            scenario_done(year, ssp, process_flood_scenario(*scenario_args(ft, year, ssp)))
+    else:
+        print(f'Processing {len(scenarios)} flood scenarios in {workers} processes.')
+        # spawn rather than fork: GDAL and the storage clients are not fork-safe
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(process_flood_scenario, *scenario_args(ft, year, ssp)): (year, ssp) for ft, year, ssp in scenarios}
+            for future in as_completed(futures):
+                year, ssp = futures[future]
+                scenario_done(year, ssp, future.result())
+
+    # comb rasters of scenarios with no flood type processed in this run
     if menu['flood_comb']:
         for year in flood_years:
-            if year <= 2020:
-                comb_list = [f'{local_output_dir}/{city_name_l}_{ft}_{year}.tif' for ft in flood_types if exists(f'{local_output_dir}/{city_name_l}_{ft}_{year}.tif')]
-                if comb_list:
-                    raster_pro.mosaic_raster(comb_list, local_output_dir, f'{city_name_l}_comb_{year}.tif', method='max')
-                    raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_comb_{year}.tif', f'{local_output_dir}/{city_name_l}_comb_{year}_utm.tif', dst_crs=utm_crs)
-
-                    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_comb_{year}.tif', f'{output_dir}/{city_name_l}_comb_{year}.tif')
-                    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_comb_{year}_utm.tif', f'{output_dir}/{city_name_l}_comb_{year}_utm.tif')
-
-            elif year > 2020:
-                for ssp in flood_ssps:
-                    comb_list = [f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif' for ft in flood_types if exists(f'{local_output_dir}/{city_name_l}_{ft}_{year}_ssp{ssp}.tif')]
-                    if comb_list:
-                        raster_pro.mosaic_raster(comb_list, local_output_dir, f'{city_name_l}_comb_{year}_ssp{ssp}.tif', method='max')
-                        raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_comb_{year}_ssp{ssp}.tif', f'{local_output_dir}/{city_name_l}_comb_{year}_ssp{ssp}_utm.tif', dst_crs=utm_crs)
-
-                        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_comb_{year}_ssp{ssp}.tif', f'{output_dir}/{city_name_l}_comb_{year}_ssp{ssp}.tif')
-                        utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_comb_{year}_ssp{ssp}_utm.tif', f'{output_dir}/{city_name_l}_comb_{year}_ssp{ssp}_utm.tif')
-
-    calculate_flood_stats(menu, flood_types, flood_years, flood_ssps, cloud_bucket, output_dir, local_output_dir, city_name_l, osm_pois, utm_crs)
+            for ssp in ([None] if year <= 2020 else flood_ssps):
+                if (year, ssp) not in comb_pending and (year, ssp) not in skip_scenarios:
+                    comb_flood_rasters(flood_types, year, ssp, local_output_dir, city_name_l, utm_crs, cloud_bucket, output_dir)
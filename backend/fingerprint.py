@@ -0,0 +1,266 @@
+"""
+Input fingerprints of the components, for incremental re-runs.
+
+The fingerprint of a component is a hash of everything its outputs are derived from:
+- the AOI geometry,
+- the values of its city_inputs/global_inputs keys (Component.inputs) and menu items,
+- the generations of its source blobs in the data bucket (Component.sources),
+- the code of the component: its run function and the backend modules it imports,
+  directly or through other backend modules,
+- the fingerprints of the components it depends on.
+
+Components that produce one set of outputs per scenario (e.g. flood per year and SSP,
+accessibility per isochrone distance) have a base fingerprint as well, which leaves out
+the inputs that only select the scenarios (Component.scenario_inputs). Outputs made with
+the same base fingerprint are valid whatever other scenarios were selected.
+
+The fingerprints are stored in the run manifest (see perf.py). When a city is re-run in
+the directory of a previous run (prev_run_date), a component whose base fingerprint
+matches the one recorded in a previous manifest, and whose outputs still exist, is not
+run again. If only some scenario outputs exist, the component is run for the other
+scenarios only. Data fetched from outside the data bucket (WorldPop, OSM, Earth Engine,
+Fathom) is not fingerprinted, so a re-run reuses it as long as the inputs above are
+unchanged.
+
+Fingerprints are computed on first use, so a task only fingerprints the components it
+runs and their dependencies.
+"""
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _imported_names(source):
+    """Top-level names of the modules imported by Python source code."""
+    import ast
+
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module.split('.')[0])
+    return names
+
+def _module_files(name):
+    """Files of a backend module or package, or [] if name is not part of the backend."""
+    if os.path.isfile(os.path.join(BACKEND_DIR, f'{name}.py')):
+        return [os.path.join(BACKEND_DIR, f'{name}.py')]
+    package_dir = os.path.join(BACKEND_DIR, name)
+    if os.path.isfile(os.path.join(package_dir, '__init__.py')):
+        return sorted(os.path.join(root, fn) for root, _, fns in os.walk(package_dir) for fn in fns if fn.endswith('.py'))
+    return []
+
+def module_closure(names):
+    """The files of the backend modules named and of every backend module they import, recursively."""
+    files = set()
+    pending = list(names)
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for path in _module_files(name):
+            files.add(path)
+            with open(path, 'rb') as f:
+                pending += _imported_names(f.read())
+    return sorted(files)
+
+def code_version(files = None):
+    """Hash of the given Python files, by default of every module of the backend."""
+    if files is None:
+        files = [os.path.join(BACKEND_DIR, fn) for fn in sorted(os.listdir(BACKEND_DIR)) if fn.endswith('.py')]
+    h = hashlib.sha256()
+    for path in files:
+        h.update(os.path.relpath(path, BACKEND_DIR).encode())
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def component_code_version(component):
+    """
+    Hash of the code of a component: the source of its run function and the backend modules
+    it imports. Modules imported by almost every component, such as utils and raster_pro,
+    still invalidate all of them when they change.
+    """
+    import inspect
+    import textwrap
+
+    source = textwrap.dedent(inspect.getsource(component.run))
+    return _sha256(source.encode() + code_version(module_closure(_imported_names(source))).encode())
+
+def aoi_hash(aoi_file):
+    """Hash of the AOI geometries and CRS."""
+    h = hashlib.sha256(str(aoi_file.crs).encode())
+    for geom in aoi_file.geometry:
+        h.update(geom.wkb)
+    return h.hexdigest()
+
+def _lookup(inputs, path):
+    """Value of a key of city_inputs/global_inputs, where 'flood.year' is inputs['flood']['year']."""
+    value = inputs
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def input_values(component, ctx, keys = None):
+    """Values of the inputs (by default Component.inputs) and menu items of a component."""
+    values = {}
+    for key in component.inputs if keys is None else keys:
+        if key.startswith('city:'):
+            values[key] = _lookup(ctx.city_inputs, key[5:])
+        elif key.startswith('global:'):
+            values[key] = _lookup(ctx.global_inputs, key[7:])
+        else:
+            values[key] = getattr(ctx, key, None)
+    for item in component.menu_items:
+        values[f'menu:{item}'] = ctx.menu.get(item, False)
+    return values
+
+class Fingerprints:
+    """
+    Fingerprints of the enabled components of a city, computed on first use. get() returns
+    the fingerprint of a component and base() its base fingerprint, or None for components
+    that are not enabled.
+    """
+    def __init__(self, components, ctx):
+        import scheduler
+
+        # Raises on circular dependencies before any fingerprint recurses
+        scheduler.bottom_levels(components)
+        self.components = {c.name: c for c in components}
+        self.ctx = ctx
+        self._aoi = None
+        self._listings = {}
+        self._base = {}
+        self._full = {}
+
+    def source_generations(self, component):
+        """Name and generation of every data bucket blob under the source prefixes of a component."""
+        import utils
+
+        ctx = self.ctx
+        fields = {**ctx.global_inputs, 'country_iso3': ctx.country_iso3}
+        generations = {}
+        for source in component.sources:
+            try:
+                prefix = source.format(**fields)
+            except KeyError as e:
+                logger.warning(f'Source {source} of {component.name}: missing global input {e}')
+                continue
+            if prefix not in self._listings:
+                self._listings[prefix] = {blob.name: blob.generation for blob in utils.list_blobs_with_prefix(ctx.data_bucket, prefix)}
+            generations.update(self._listings[prefix])
+        return generations
+
+    def base(self, name):
+        if name not in self.components:
+            return None
+        if name not in self._base:
+            c = self.components[name]
+            if self._aoi is None:
+                self._aoi = aoi_hash(self.ctx.aoi_file)
+            record = {
+                'aoi': self._aoi,
+                'code': component_code_version(c),
+                'component': name,
+                'inputs': input_values(c, self.ctx),
+                'sources': self.source_generations(c),
+                'deps': {d: self.get(d) for d in c.deps + c.soft_deps if d in self.components},
+            }
+            self._base[name] = _sha256(json.dumps(record, sort_keys=True, default=str).encode())
+        return self._base[name]
+
+    def get(self, name):
+        if name not in self.components:
+            return None
+        if name not in self._full:
+            c = self.components[name]
+            if c.scenario_inputs:
+                scenarios = {key: _lookup(self.ctx.city_inputs if key.startswith('city:') else self.ctx.global_inputs, key.split(':', 1)[1]) for key in c.scenario_inputs}
+                self._full[name] = _sha256(json.dumps({'base': self.base(name), 'scenarios': scenarios}, sort_keys=True, default=str).encode())
+            else:
+                self._full[name] = self.base(name)
+        return self._full[name]
+
+    def dependents(self, name):
+        return [c for c in self.components.values() if name in c.deps + c.soft_deps]
+
+def load_previous_records(ctx):
+    """
+    The latest successful record of each component in the manifests of previous
+    executions in the city directory, as a dict of component name to record.
+    """
+    import utils
+
+    records = {}
+    for blob in utils.list_blobs_with_prefix(ctx.cloud_bucket, f'{ctx.city_dir}/manifests/'):
+        if not blob.name.endswith('.json') or f'/{ctx.execution_id}/' in blob.name:
+            continue
+        try:
+            manifest = json.loads(utils.read_blob_to_memory(ctx.cloud_bucket, blob.name))
+        except Exception as e:
+            logger.warning(f'Could not read manifest {blob.name}: {e}')
+            continue
+        for record in manifest.get('components', []):
+            if record.get('status') not in ('done', 'reused') or not record.get('fingerprint'):
+                continue
+            name = record['component']
+            if name not in records or record['started'] > records[name]['started']:
+                records[name] = record
+    return records
+
+def _output_exists(output, ctx):
+    import utils
+
+    return utils.check_blob_exists(ctx.cloud_bucket, utils.output_blob_name(f'{ctx.output_dir}/{ctx.city_name_l}_{output}'))
+
+def scenario_outputs(component, ctx):
+    """The outputs of each scenario of a component, as a dict of scenario to output names."""
+    return component.scenarios(ctx) if component.scenarios is not None else {}
+
+def outputs_exist(component, ctx):
+    """Check that the declared outputs of a component, and the outputs of all its scenarios, exist."""
+    outputs = list(component.outputs) + [o for outputs in scenario_outputs(component, ctx).values() for o in outputs]
+    return all(_output_exists(output, ctx) for output in outputs)
+
+def _base_matches(component, ctx):
+    previous = getattr(ctx, 'previous_records', {}).get(component.name)
+    fingerprints = getattr(ctx, 'fingerprints', None)
+    if previous is None or fingerprints is None:
+        return False
+    # Records written before base fingerprints existed only have the full one
+    return previous.get('base_fingerprint', previous['fingerprint']) == fingerprints.base(component.name)
+
+def can_reuse(component, ctx, _checking = ()):
+    """
+    Whether the outputs of a previous run can be reused instead of running the component.
+    A component with transient outputs (deleted by its dependents once used) is only reused
+    if all its dependents are reused too, since a dependent that runs again needs them.
+    """
+    if not getattr(ctx, 'previous_records', None) or not _base_matches(component, ctx):
+        return False
+    if component.transient:
+        for dependent in ctx.fingerprints.dependents(component.name):
+            if dependent.name not in _checking and not can_reuse(dependent, ctx, _checking + (component.name,)):
+                return False
+    return outputs_exist(component, ctx)
+
+def reusable_scenarios(component, ctx):
+    """
+    The scenarios of a component whose outputs can be reused from a previous run with the
+    same base fingerprint, so that the component only runs the other scenarios.
+    """
+    if component.scenarios is None or not getattr(ctx, 'previous_records', None) or not _base_matches(component, ctx):
+        return set()
+    return {scenario for scenario, outputs in scenario_outputs(component, ctx).items() if all(_output_exists(o, ctx) for o in outputs)}
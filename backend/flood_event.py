@@ -6,8 +6,7 @@ def plot_flood_event(data_bucket, cloud_bucket, flood_archive_dir, flood_archive
     import yaml
     import utils
     
-    for f in [f'{flood_archive_blob}.{suf}' for suf in ['dbf', 'prj', 'shp', 'shx']]:
-        utils.download_blob(data_bucket, f'{flood_archive_dir}/{f}', f'{local_data_dir}/{f}')
+    utils.download_many(data_bucket, [(f'{flood_archive_dir}/{f}', f'{local_data_dir}/{f}') for f in [f'{flood_archive_blob}.{suf}' for suf in ['dbf', 'prj', 'shp', 'shx']]], cache=True)
     flood_archive = gpd.read_file(f'{local_data_dir}/{flood_archive_blob}.shp')
     flood_archive = flood_archive[flood_archive.is_valid]
     aoi = features.to_crs(flood_archive.crs)
@@ -4,8 +4,6 @@ def fwi(aoi_file, local_data_dir, data_bucket, fwi_first_year, fwi_last_year, fw
     import os
     import pandas as pd
     import geopandas as gpd
-    import rasterio.mask
-    import rasterio
     from shapely.geometry import box
     import glob
     import numpy as np
@@ -25,8 +23,7 @@ def fwi(aoi_file, local_data_dir, data_bucket, fwi_first_year, fwi_last_year, fw
     fwi_raster_dict = {}
 
     # download FWI dataset ---------------------------
-    for blob in utils.list_blobs_with_prefix(data_bucket, f'{fwi_dir}/'):
-        utils.download_blob(data_bucket, blob.name, f"{local_fwi_folder}/{blob.name.split('/')[-1]}")
+    utils.download_many(data_bucket, [(blob.name, f"{local_fwi_folder}/{blob.name.split('/')[-1]}") for blob in utils.list_blobs_with_prefix(data_bucket, f'{fwi_dir}/')])
 
     # clip raster and store in dict --------------------
     for year in range(fwi_first_year, fwi_last_year + 1):
@@ -38,8 +35,7 @@ def fwi(aoi_file, local_data_dir, data_bucket, fwi_first_year, fwi_last_year, fw
             
     q99_raster = np.nanpercentile(list(fwi_raster_dict.values()), 98.6, axis = 0)
 
-    with rasterio.open(f'{local_output_dir}/{city_name_l}_fwi.tif', 'w', **out_meta) as dest:
-        dest.write(q99_raster)
+    raster_pro.write_raster(f'{local_output_dir}/{city_name_l}_fwi.tif', q99_raster, out_meta)
     utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_fwi.tif', f'{output_dir}/{city_name_l}_fwi.tif')
     
     # calculate 95th percentile FWI by week -------------------
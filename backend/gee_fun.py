@@ -1,7 +1,21 @@
 import ee
+import threading
 
-# Initialize Earth Engine
-ee.Initialize()
+_ee_lock = threading.Lock()
+_ee_initialized = False
+
+def initialize():
+    """Initialize Earth Engine on first use, so that importing this module does not authenticate."""
+    global _ee_initialized
+    with _ee_lock:
+        if not _ee_initialized:
+            import time
+            import perf
+
+            time0 = time.perf_counter()
+            ee.Initialize()
+            perf.record_startup('ee_initialize', time.perf_counter() - time0)
+            _ee_initialized = True
 
 def flatten_to_2d(geom):
     import shapely
@@ -29,6 +43,9 @@ def flatten_to_2d(geom):
 def aoi_to_ee_geometry(aoi_file):
     import shapely
 
+    # Every Earth Engine function starts by converting the AOI
+    initialize()
+
     # Remove Z coordinates (convert to 2D)
     aoi_file['geometry'] = aoi_file['geometry'].apply(flatten_to_2d)
     
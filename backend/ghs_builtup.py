@@ -1,9 +1,8 @@
 import os
 import io
-import tempfile
 import zipfile
-import requests
 import geopandas as gpd
+import numpy as np
 import rasterio
 from rasterio.merge import merge
 from rasterio.warp import calculate_default_transform, reproject, Resampling
@@ -14,7 +13,8 @@ from rasterio.mask import mask
 from shapely.geometry import mapping
 from tqdm import tqdm
 import utils  # your upload_blob helper
-from pathlib import Path
+import raster_pro
+import shared_assets
 
 
 def _find_tile_id_column(gdf):
@@ -52,7 +52,6 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
     """
     # config
     years = list(range(1975, 2035, 5))
-    tile_shp_link = "https://ghsl.jrc.ec.europa.eu/download/GHSL_data_54009_shapefile.zip"
     download_base_url = 'https://jeodpp.jrc.ec.europa.eu/ftp/jrc-opendata/GHSL/GHS_BUILT_S_GLOBE_R2023A'
     download_prefix = 'GHS_BUILT_S_E'
     download_subdir = 'GHS_BUILT_S_E{year}_GLOBE_R2023A_54009_100/V1-0/tiles'
@@ -77,68 +76,9 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
     aoi_54009 = aoi_4326.to_crs(mollweide_proj)
 
     # ----------------------------
-    # STEP 1: Download and read tile shapefile (auto-detect internal .shp)
+    # STEP 1: Read tile shapefile (loaded once per process and shared by all cities)
     # ----------------------------
-    print("Downloading GHSL tile shapefile...")
-
-    # Define projection used later
-    mollweide_proj = "+proj=moll +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
-
-    # Temporary directory to store shapefile components or zip
-    tmp_dir = tempfile.mkdtemp()
-    tile_gdf = None
-
-    # --- Try downloading from GCS first ---
-    gcs_success = False
-    if ghsl_blob:
-        print(f"Attempting to download GHSL tile shapefile from GCS: {ghsl_blob}")
-        try:
-            # Get base name (e.g., 'GHSL2_0_MWD_L1_tile_schema_land')
-            base_name = Path(ghsl_blob).stem
-            prefix = str(Path(ghsl_blob).parent)
-
-            # Download the full set of shapefile components
-            for suf in ["shp", "dbf", "shx", "prj"]:
-                blob_path = f"{prefix}/{base_name}.{suf}"
-                local_path = os.path.join(tmp_dir, f"{base_name}.{suf}")
-                ok = utils.download_blob(ghsl_bucket, blob_path, local_path)
-                gcs_success = gcs_success or ok  # mark success if any downloaded
-
-            if gcs_success:
-                shp_path = os.path.join(tmp_dir, f"{base_name}.shp")
-                tile_gdf = gpd.read_file(shp_path).to_crs(mollweide_proj)
-                print("✅ Loaded GHSL tile shapefile from GCS.")
-        except Exception as e:
-            print(f"GCS download failed: {e}")
-            gcs_success = False
-
-    # --- If GCS fails, fall back to GHSL website (ZIP) ---
-    if not gcs_success:
-        tile_shp_link = "https://ghsl.jrc.ec.europa.eu/download/GHSL_data_54009_shapefile.zip"
-        print("Falling back to GHSL website...")
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_zipfile:
-            tmp_zip_path = tmp_zipfile.name
-
-        try:
-            r = requests.get(tile_shp_link, timeout=60)
-            r.raise_for_status()
-            with open(tmp_zip_path, "wb") as f:
-                f.write(r.content)
-            print("✅ Downloaded GHSL shapefile ZIP from website.")
-
-            with zipfile.ZipFile(tmp_zip_path, "r") as z:
-                shp_candidates = [n for n in z.namelist() if n.endswith(".shp")]
-                if not shp_candidates:
-                    raise FileNotFoundError("No shapefile found inside downloaded ZIP.")
-                shp_name = shp_candidates[0]
-                print(f"Found shapefile inside ZIP: {shp_name}")
-                tile_gdf = gpd.read_file(f"zip://{tmp_zip_path}!{shp_name}").to_crs(mollweide_proj)
-        except Exception as e:
-            raise ConnectionError(f"❌ Failed to download GHSL shapefile from both GCS and website: {e}")
-        finally:
-            if os.path.exists(tmp_zip_path):
-                os.remove(tmp_zip_path)
+    tile_gdf = shared_assets.ghsl_tile_index(ghsl_bucket, ghsl_blob)
 
     # --- Verify and detect tile id column ---
     if tile_gdf is None:
@@ -161,7 +101,6 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
 
     if intersecting_tiles.empty:
         print("No intersecting GHSL tiles found for AOI. Exiting.")
-        os.remove(tmp_zip_path)
         return
 
     tile_ids = intersecting_tiles[tile_id_col].tolist()
@@ -173,7 +112,6 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
     for year in tqdm(years, desc="Years"):
         tifs = []
         memfiles = []  # Keep MemoryFiles alive until merge() is done
-        tmp_tile_paths = []  # Keep track to delete temp zips
 
         for tile in tile_ids:
             # build remote filename, e.g. GHS_POP_E1975_..._R10_C29.zip
@@ -181,24 +119,19 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
             sub_path = download_subdir.format(year=year)
             url = f"{download_base_url}/{sub_path}/{file_name}"
 
+            # In batch mode tiles are kept for the process, so cities sharing a tile download it once
             try:
-                r = requests.get(url, timeout=90)
-                r.raise_for_status()
+                tile_zip_path = shared_assets.download_url(url, timeout=90)
             except Exception as e:
                 print(f"Tile not available or failed to download: {url} -> {e}")
                 continue
 
-            # save zip to temp file (so we can list and open inside)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_tile:
-                tmp_tile.write(r.content)
-                tile_zip_path = tmp_tile.name
-                tmp_tile_paths.append(tile_zip_path)
-
             # open zip and find .tif members; read into rasterio MemoryFile
             with zipfile.ZipFile(tile_zip_path, "r") as z:
                 tif_members = [m for m in z.namelist() if m.endswith(".tif")]
                 if not tif_members:
                     print(f"⚠️ No .tif found in {tile_zip_path}")
+                    shared_assets.release(tile_zip_path)
                     continue
                 for member in tif_members:
                     try:
@@ -216,15 +149,11 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
                     except Exception as e:
                         print(f"⚠️ Failed to read TIFF {member}: {e}")
                         continue
+            # The tifs are in memory now
+            shared_assets.release(tile_zip_path)
 
         if not tifs:
             print(f"No tiles downloaded for year {year} (skipping).")
-            # cleanup temp tile zips
-            for p in tmp_tile_paths:
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
             continue
 
         # ----------------------------
@@ -283,11 +212,6 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
                 mem.close()
             except Exception:
                 pass
-        for p in tmp_tile_paths:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
 
 
         # ----------------------------
@@ -318,18 +242,21 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
         out_meta["count"] = clipped_arr.shape[0]
         out_meta["dtype"] = clipped_arr.dtype
 
-        # write and reproject per band
-        with rasterio.open(out_tif, "w", **out_meta) as dst:
-            for band_idx in range(clipped_arr.shape[0]):
-                reproject(
-                    source=clipped_arr[band_idx],
-                    destination=rasterio.band(dst, band_idx + 1),
-                    src_transform=clipped_transform,
-                    src_crs=src_crs,
-                    dst_transform=dst_transform,
-                    dst_crs=dst_crs,
-                    resampling=Resampling.nearest
-                )
+        # reproject per band, then write
+        nodata = out_meta.get("nodata")
+        dst_arr = np.full((clipped_arr.shape[0], dst_height, dst_width), 0 if nodata is None else nodata, dtype=clipped_arr.dtype)
+        for band_idx in range(clipped_arr.shape[0]):
+            reproject(
+                source=clipped_arr[band_idx],
+                destination=dst_arr[band_idx],
+                src_transform=clipped_transform,
+                src_crs=src_crs,
+                dst_transform=dst_transform,
+                dst_crs=dst_crs,
+                dst_nodata=nodata,
+                resampling=Resampling.nearest
+            )
+        raster_pro.write_raster(out_tif, dst_arr, out_meta)
 
         print(f"Saved clipped+reprojected GeoTIFF: {out_tif}")
 
@@ -341,11 +268,6 @@ def ghs_builtup(aoi_file, city_inputs, local_output_dir, city_name_l, ghsl_bucke
         except Exception as e:
             print(f"Upload failed for {out_tif}: {e}")
 
-    # cleanup tile index zip
-    try:
-        os.remove(tmp_zip_path)
-    except Exception:
-        pass
 
     print("✅ ghs_builtup finished successfully.")
 
@@ -426,8 +348,7 @@ def ghs_builtup_overtime(
         })
 
     out_path = os.path.join(local_output_dir, f"{city_name_l}_ghs_built_over_time.tif")
-    with rasterio.open(out_path, "w", **clipped_meta) as dst:
-        dst.write(clipped_arr[0], 1)
+    raster_pro.write_raster(out_path, clipped_arr[0], clipped_meta)
 
     os.remove(tmp_path)
 
@@ -1,7 +1,6 @@
 def landcover_burn(city_name_l, aoi_file, data_bucket, blob_name, local_output_dir, cloud_bucket, output_dir):
     print('run landcover_burnability')
     
-    import rasterio
     import gc
     import utils
     import raster_pro
@@ -12,10 +11,8 @@ def landcover_burn(city_name_l, aoi_file, data_bucket, blob_name, local_output_d
     
     # Process data -----------------
     print('process data')
-    # Read raster and shapefile into memory
-    raster_bytes = utils.read_blob_to_memory(data_bucket, blob_name)
-
-    out_image, out_meta = raster_pro.raster_mask_bytes(raster_bytes, features)
+    # Read the AOI window of the raster (the whole raster if it is not tiled)
+    out_image, out_meta = raster_pro.raster_mask_blob(data_bucket, blob_name, features)
     out_meta.update({'nodata': 0})
 
     ls000 = [190, 200, 201, 202, 210, 220]
@@ -44,11 +41,10 @@ def landcover_burn(city_name_l, aoi_file, data_bucket, blob_name, local_output_d
     
     # Write output raster --------------------------
     print('write output raster')
-    with rasterio.open(f"{local_output_dir}/{city_name_l}_lc_burn.tif", "w", **out_meta) as dst:
-        dst.write(out_image)
+    raster_pro.write_raster(f"{local_output_dir}/{city_name_l}_lc_burn.tif", out_image, out_meta)
 
     utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_lc_burn.tif", f"{output_dir}/{city_name_l}_lc_burn.tif")
 
     # Clear memory -------------------
-    del raster_bytes
+    del out_image
     gc.collect()
\ No newline at end of file
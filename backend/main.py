@@ -1,13 +1,22 @@
+# Time the imports of the task before loading anything heavy. Only in the task itself:
+# spawned flood workers re-import this module as __mp_main__
+import perf
+if __name__ == "__main__":
+    perf.install_import_profiler()
+
 import os
 import yaml
 import utils
-import geopandas as gpd
 from datetime import datetime as dt
-import aoi_helper
-from google.cloud import firestore
-from google.cloud import run_v2
+import components
+import scheduler
+import work_queue
+import readiness
+import fingerprint
+import shared_assets
+import raster_pro
+from types import SimpleNamespace
 import logging
-import time
 
 ########################################################
 # CONFIGS ##############################################
@@ -18,6 +27,9 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def trigger_job2(project_id, region, job2_name, execution_id, GCS_CITY_DIR):
+    # Only the last task triggers job2, so the other tasks do not load the client
+    from google.cloud import run_v2
+
     # Create a client
     client = run_v2.JobsClient()
 
@@ -58,6 +70,8 @@ def trigger_job2(project_id, region, job2_name, execution_id, GCS_CITY_DIR):
 
 def update_completion_counter(counter_ref, db):
     """Update completion counter with transaction and return completion status"""
+    from google.cloud import firestore
+
     @firestore.transactional
     def update_counter(transaction, ref):
         snapshot = ref.get(transaction=transaction)
@@ -77,6 +91,101 @@ def update_completion_counter(counter_ref, db):
     transaction = db.transaction()
     return update_counter(transaction, counter_ref)
 
+def setup_city(city_inputs, city_name, global_inputs, menu, config, execution_id, in_batch = False):
+    """
+    Prepare one city: get its AOI and country, set up its directory in the bucket and
+    upload its inputs there. Returns the context object passed to the components.
+    """
+    import geopandas as gpd
+    import aoi_helper
+
+    cloud_bucket = config['cloud']['bucket']
+    data_bucket = config['cloud']['data_bucket']
+    input_dir = config['cloud']['input_dir']
+    output_dir = config['cloud']['output_dir']
+    render_dir = config['cloud']['render_dir']
+    local_aoi_dir = config['local']['aoi_dir']
+    local_data_dir = config['local']['data_dir']
+    local_output_dir = config['local']['output_dir']
+
+    if city_name is None:
+        city_name = city_inputs['city_name']
+    city_name_l = city_name.replace(' ', '_').replace("'", "").lower()
+    country_iso3, country_name, country_name_l = None, None, None
+
+    if city_inputs.get('AOI_shp_name', None):
+        aoi_name = city_inputs['AOI_shp_name']
+        utils.download_aoi(cloud_bucket, input_dir, aoi_name, local_aoi_dir)
+        aoi_file = gpd.read_file(f"{local_aoi_dir}/{aoi_name}.shp").to_crs(epsg = 4326)
+    else:
+        aoi_name = city_name_l
+        if not os.path.exists(f"{local_aoi_dir}/{city_name_l}.shp"):
+            ucdb_gpkg = "ucdb.gpkg"
+            utils.download_blob(data_bucket, global_inputs['ucdb_blob'], ucdb_gpkg, check_exists=True, cache=True)
+            
+            city_boundary_gdf, country_iso3, country_name, country_name_l = aoi_helper.get_city_boundary(city_name, ucdb_gpkg, data_bucket, global_inputs['countries_shp_dir'], global_inputs['countries_shp_blob'], local_data_dir)
+            aoi_helper.save_to_shp(city_boundary_gdf, f"{local_aoi_dir}/{city_name_l}.shp")
+
+            print(f"Boundary successfully saved for {city_name}.")
+
+        aoi_file = gpd.read_file(f"{local_aoi_dir}/{city_name_l}.shp")
+
+    features = aoi_file.geometry
+
+    # Checks country based on which country aoi_file overlaps with the most
+    country_name = country_name or city_inputs.get('country_name', None)
+    if country_name is not None:
+        country_name_l = country_name.replace(' ', '_').replace("'", "").lower()
+    if country_name_l is None:
+        country_iso3, country_name, country_name_l = aoi_helper.find_country(data_bucket, global_inputs['countries_shp_dir'], global_inputs['countries_shp_blob'], local_data_dir, aoi_file = aoi_file)
+
+    # Update directories and make a copy of city inputs and menu in city-specific directory
+    if city_inputs.get('prev_run_date', None) is not None:
+        city_dir = f"{city_inputs['prev_run_date']}-{country_name_l}-{city_name_l}"
+        # check if this directory exists on google cloud storage; if not, print message and exit
+        if not utils.check_dir_exists(cloud_bucket, city_dir):
+            print(f"Directory {city_dir} does not exist in the {cloud_bucket} bucket. Please check prev_run_date in city_inputs.yml.")
+            exit(1)
+    else:
+        city_dir = f"{dt.now().strftime('%Y-%m')}-{country_name_l}-{city_name_l}"
+    input_dir = f'{city_dir}/{input_dir}'
+    output_dir = f'{city_dir}/{output_dir}'
+    render_dir = f'{city_dir}/{render_dir}'
+    if in_batch:
+        # The city inputs of a batch city are merged from batch_inputs.yml and city_inputs.yml
+        utils.upload_string(cloud_bucket, yaml.dump(city_inputs, sort_keys=False), f'{input_dir}/city_inputs.yml')
+        utils.upload_blob(cloud_bucket, 'menu.yml', f'{input_dir}/menu.yml', type='input')
+    else:
+        utils.upload_many(cloud_bucket, [(f, f'{input_dir}/{f}') for f in ['city_inputs.yml', 'menu.yml']], type='input')
+
+    aoi_files = [f for f in os.listdir(local_aoi_dir) if os.path.isfile(os.path.join(local_aoi_dir, f)) and f.startswith(f'{aoi_name}.')]
+    utils.upload_many(cloud_bucket, [(f"{local_aoi_dir}/{f}", f"{input_dir}/AOI/{f}") for f in aoi_files], type='input', check_exists=True)
+
+    # Configure plot fonts
+    font_dict = {
+        'family': 'system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial, '
+                '"Noto Sans", "Liberation Sans", sans-serif, "Apple Color Emoji", '
+                '"Segoe UI Emoji", "Segoe UI Symbol", "Noto Color Emoji"',
+        'size': 12,  
+        'color': 'black'  
+    }
+
+    return SimpleNamespace(
+        aoi_file=aoi_file, features=features, city_inputs=city_inputs, global_inputs=global_inputs, menu=menu,
+        city_name=city_name, city_name_l=city_name_l, country_iso3=country_iso3, country_name=country_name, country_name_l=country_name_l,
+        data_bucket=data_bucket, cloud_bucket=cloud_bucket, city_dir=city_dir, output_dir=output_dir, render_dir=render_dir,
+        local_data_dir=local_data_dir, local_output_dir=local_output_dir, font_dict=font_dict, execution_id=execution_id
+    )
+
+def load_batch(city_inputs):
+    """
+    Read the cities of a batch from batch_inputs.yml. Each entry of its 'cities' list is
+    merged over city_inputs.yml, which thus holds the settings shared by all cities.
+    """
+    with open('batch_inputs.yml', 'r') as f:
+        batch_inputs = yaml.safe_load(f)
+    return [{**city_inputs, **entry} for entry in batch_inputs['cities']]
+
 def main():
     # Get environment variables
     task_index = int(os.getenv('CLOUD_RUN_TASK_INDEX', 0))
@@ -86,16 +195,22 @@ def main():
     region = os.getenv('CLOUD_RUN_REGION', 'us-central1')
     job2_name = os.getenv('JOB2_NAME', 'frontend')
     city_name = os.getenv('city_name', None)
+    scheduler_mode = os.getenv('SCHEDULER_MODE', 'plan')
     
     if not all([execution_id, project_id, region]):
         raise ValueError("Missing required environment variables")
 
     logger.info(f"Starting task {task_index} of {task_count} (Execution: {execution_id})")
+    perf.install_http_hooks()
+    # Every task reads the AOI; load geopandas while the inputs are downloaded
+    perf.preload(['geopandas', 'aoi_helper'])
 
     try:
         # Initialize Firestore
+        from google.cloud import firestore
         db = firestore.Client()
         counter_ref = db.collection('job_executions').document(execution_id)
+        readiness.configure(readiness.FirestoreRegistry(db))
 
         # Configure the directories
         print('Configure the directories')
@@ -103,264 +218,96 @@ def main():
             config = yaml.safe_load(f)
 
         cloud_bucket = config['cloud']['bucket']
-        data_bucket = config['cloud']['data_bucket']
         input_dir = config['cloud']['input_dir']
-        output_dir = config['cloud']['output_dir']
-        render_dir = config['cloud']['render_dir']
-        local_aoi_dir = config['local']['aoi_dir']
-        local_data_dir = config['local']['data_dir']
-        local_output_dir = config['local']['output_dir']
+        utils.configure_storage(config.get('storage'))
 
-        os.makedirs(local_aoi_dir, exist_ok=True)
-        os.makedirs(local_data_dir, exist_ok=True)
-        os.makedirs(local_output_dir, exist_ok=True)
+        # Enable the shared data cache if its volume is mounted
+        cache_config = config.get('cache') or {}
+        if cache_config.get('dir') and os.path.isdir(cache_config['dir']):
+            utils.configure_cache(cache_config['dir'], cache_config.get('max_gb', 200) * 1e9)
+        if cache_config.get('reprojection_dir'):
+            raster_pro.configure_reprojection_cache(cache_config['reprojection_dir'], cache_config.get('reprojection_max_gb', 5) * 1e9)
 
-        # Download the city inputs and the menu YAML files
+        for local_dir in config['local'].values():
+            os.makedirs(local_dir, exist_ok=True)
+
+        # Download the city inputs and the menu YAML files, and the list of cities of a batch if there is one
         print('Download the city inputs and the menu YAML files')
-        utils.download_blob(cloud_bucket, f"{input_dir}/city_inputs.yml", 'city_inputs.yml')
-        utils.download_blob(cloud_bucket, f"{input_dir}/global_inputs.yml", 'global_inputs.yml')
-        utils.download_blob(cloud_bucket, f"{input_dir}/menu.yml", 'menu.yml')
+        results = utils.download_many(cloud_bucket, [(f"{input_dir}/{f}", f) for f in ['city_inputs.yml', 'global_inputs.yml', 'menu.yml', 'batch_inputs.yml']])
+        is_batch = results[-1]['ok']
 
         # Load global inputs, such as data sources that generally remain the same across scans
         print('Load global inputs')
         with open("global_inputs.yml", 'r') as f:
             global_inputs = yaml.safe_load(f)
 
-        # Download the AOI and get city name
-        print('Download the AOI and get city name')
         with open('city_inputs.yml', 'r') as f:
             city_inputs = yaml.safe_load(f)
 
-        if city_name is None:
-            city_name = city_inputs['city_name']
-        city_name_l = city_name.replace(' ', '_').replace("'", "").lower()
-        country_iso3, country_name, country_name_l = None, None, None
-
-        if city_inputs.get('AOI_shp_name', None):
-            utils.download_aoi(cloud_bucket, input_dir, city_inputs['AOI_shp_name'], local_aoi_dir)
-            aoi_file = gpd.read_file(f"{local_aoi_dir}/{city_inputs['AOI_shp_name']}.shp").to_crs(epsg = 4326)
-        else:
-            if not os.path.exists(f"{local_aoi_dir}/{city_name_l}.shp"):
-                ucdb_gpkg = "ucdb.gpkg"
-                utils.download_blob(data_bucket, global_inputs['ucdb_blob'], ucdb_gpkg, check_exists=True)
-                
-                city_boundary_gdf, country_iso3, country_name, country_name_l = aoi_helper.get_city_boundary(city_name, ucdb_gpkg, data_bucket, global_inputs['countries_shp_dir'], global_inputs['countries_shp_blob'], local_data_dir)
-                aoi_helper.save_to_shp(city_boundary_gdf, f"{local_aoi_dir}/{city_name_l}.shp")
-
-                print(f"Boundary successfully saved for {city_name}.")
-
-                aoi_file = gpd.read_file(f"{local_aoi_dir}/{city_name_l}.shp")
-
-        features = aoi_file.geometry
-
         # Load menu
         print('Load menu')
         with open('menu.yml', 'r') as f:
             menu = yaml.safe_load(f)
 
-        # Checks country based on which country aoi_file overlaps with the most
-        country_name = country_name or city_inputs.get('country_name', None)
-        if country_name is not None:
-            country_name_l = country_name.replace(' ', '_').replace("'", "").lower()
-        if country_name_l is None:
-            country_iso3, country_name, country_name_l = aoi_helper.find_country(data_bucket, global_inputs['countries_shp_dir'], global_inputs['countries_shp_blob'], local_data_dir, aoi_file = aoi_file)
-
-        # Update directories and make a copy of city inputs and menu in city-specific directory
-        if city_inputs.get('prev_run_date', None) is not None:
-            city_dir = f"{city_inputs['prev_run_date']}-{country_name_l}-{city_name_l}"
-            # check if this directory exists on google cloud storage; if not, print message and exit
-            if not utils.check_dir_exists(cloud_bucket, city_dir):
-                print(f"Directory {city_dir} does not exist in the {cloud_bucket} bucket. Please check prev_run_date in city_inputs.yml.")
-                exit(1)
+        # Download the AOI and get city name of every city
+        print('Download the AOI and get city name')
+        if is_batch:
+            city_ctxs = [setup_city(c, None, global_inputs, menu, config, execution_id, in_batch=True) for c in load_batch(city_inputs)]
+            print(f"Batch of {len(city_ctxs)} cities: {', '.join(ctx.city_name for ctx in city_ctxs)}")
         else:
-            city_dir = f"{dt.now().strftime('%Y-%m')}-{country_name_l}-{city_name_l}"
-        input_dir = f'{city_dir}/{input_dir}'
-        output_dir = f'{city_dir}/{output_dir}'
-        render_dir = f'{city_dir}/{render_dir}'
-        utils.upload_blob(cloud_bucket, 'city_inputs.yml', f'{input_dir}/city_inputs.yml', type='input')
-        utils.upload_blob(cloud_bucket, 'menu.yml', f'{input_dir}/menu.yml', type='input')
-
-        aoi_files = [f for f in os.listdir(local_aoi_dir) if os.path.isfile(os.path.join(local_aoi_dir, f))]
-        for f in aoi_files:
-            utils.upload_blob(cloud_bucket, f"{local_aoi_dir}/{f}", f"{input_dir}/AOI/{f}", type='input', check_exists=True)
-
-        # Configure plot fonts
-        font_dict = {
-            'family': 'system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial, '
-                    '"Noto Sans", "Liberation Sans", sans-serif, "Apple Color Emoji", '
-                    '"Segoe UI Emoji", "Segoe UI Symbol", "Noto Color Emoji"',
-            'size': 12,  
-            'color': 'black'  
-        }
+            city_ctxs = [setup_city(city_inputs, city_name, global_inputs, menu, config, execution_id)]
 
 
         ########################################################
         # RUN COMPONENTS #######################################
         ########################################################
-        if task_index == 0:
-            if menu['accessibility']:  # processing time: 40m
-                import accessibility
-                accessibility.accessibility(aoi_file, city_inputs, local_output_dir, city_name_l, cloud_bucket, output_dir)
-        elif task_index in range(1, 6):
-            if menu['burned_area']:  # processing time: 1h
-                import burned_area
-                burned_area.burned_area(aoi_file, global_inputs['burned_area_dir'], global_inputs['burned_area_blob_prefix'], task_index, data_bucket, local_data_dir, local_output_dir, city_name_l, cloud_bucket, output_dir)
-        elif task_index == 6:
-            if menu['demographics']:  # processing time: 19m
-                import demographics
-                demographics.demographics(local_data_dir, local_output_dir, data_bucket, cloud_bucket, city_name_l, country_iso3, features, output_dir)
-                demographics.demo_plot(city_name, city_name_l, render_dir, font_dict, local_output_dir, cloud_bucket, output_dir)
-        elif task_index == 7:
-            if menu['population']:  # processing time: 20s
-                import raster_pro
-                import requests
-                import rasterio
-
-                local_pop_folder = f'{local_data_dir}/pop'
-                os.makedirs(local_pop_folder, exist_ok=True)
-
-                wp_file_json = requests.get(f"https://hub.worldpop.org/rest/data/pop/cic2020_100m?iso3={country_iso3}").json()
-                wp_file_list = wp_file_json['data'][0]['files']
-
-                downloaded_list = raster_pro.download_raster(wp_file_list, local_pop_folder, data_bucket, data_bucket_dir='WorldPop')
-                raster_pro.mosaic_raster(downloaded_list, local_pop_folder, f'{city_name_l}_population.tif')
-                out_image, out_meta = raster_pro.raster_mask_file(f'{local_pop_folder}/{city_name_l}_population.tif', features)
-                with rasterio.open(f'{local_output_dir}/{city_name_l}_population.tif', "w", **out_meta) as dest:
-                    dest.write(out_image)
-                utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_population.tif', f'{output_dir}/{city_name_l}_population.tif')
-        elif task_index == 8:
-            if menu['wsf']:  # processing time: 30s
-                import wsf
-                wsf.wsf(aoi_file, local_data_dir, data_bucket, city_name_l, local_output_dir, cloud_bucket, output_dir, render_dir, font_dict)
-        elif task_index == 9:
-            if menu['elevation']:  # processing time: 6m
-                import elevation
-                elevation.elevation(aoi_file, local_data_dir, data_bucket, city_name, city_name_l, local_output_dir, cloud_bucket, output_dir, render_dir, font_dict)
-
-            if menu['slope']:  # processing time: 20s
-                import raster_pro
-                from elevation import plot_slope_stats
-                raster_pro.slope(aoi_file, f'{local_output_dir}/{city_name_l}_elevation_buf.tif', cloud_bucket, output_dir, city_name_l, local_output_dir)
-                raster_pro.get_raster_histogram(f'{local_output_dir}/{city_name_l}_slope.tif', [0, 2, 5, 10, 20, 90], f'{local_output_dir}/{city_name_l}_slope.csv')
-                utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_slope.csv', f'{output_dir}/{city_name_l}_slope.csv')
-                plot_slope_stats(city_name, city_name_l, local_output_dir, cloud_bucket, output_dir, render_dir, font_dict)
-        elif task_index == 10:
-            if menu['flood_coastal'] or menu['flood_fluvial'] or menu['flood_pluvial']:  # processing time (2020 + 1 SSP): 13m
-                import fathom
-                
-                with open('fathom_aws_credentials.yml', 'r') as f:
-                    fathom_aws_credentials = yaml.safe_load(f)
-                    aws_access_key_id = fathom_aws_credentials['aws_access_key_id']
-                    aws_secret_access_key = fathom_aws_credentials['aws_secret_access_key']
-                aws_bucket = global_inputs['fathom_aws_bucket']
-                
-                fathom.process_fathom(aoi_file, city_name_l, local_data_dir, city_inputs, menu, aws_access_key_id, aws_secret_access_key, aws_bucket, data_bucket, 'Fathom', local_output_dir, cloud_bucket, output_dir)
-        elif task_index == 11:
-            if menu['fwi']:  # processing time: 5m
-                import fwi
-                fwi.fwi(aoi_file, local_data_dir, data_bucket, city_inputs['fwi_first_year'], city_inputs['fwi_last_year'], global_inputs['fwi_dir'], global_inputs['fwi_blob_prefix'], local_output_dir, city_name_l, cloud_bucket, output_dir)
-        elif task_index == 12:
-            if menu['landcover_burn']:  # processing time: 40s
-                import landcover_burnability
-                landcover_burnability.landcover_burn(city_name_l, aoi_file, data_bucket, global_inputs['lc_burn_blob'], local_output_dir, cloud_bucket, output_dir)
-        elif task_index == 13:
-            if menu['road_network']:  # processing time: 12h
-                import road_network
-                road_network.road_network(city_name_l, aoi_file, local_output_dir, cloud_bucket, output_dir)
-        elif task_index == 14:
-            if menu['rwi']:  # processing time: 50s
-                import rwi
-                rwi.rwi(global_inputs['rwi_dir'], global_inputs['rwi_blob_suffix'], country_iso3, data_bucket, local_data_dir, aoi_file, local_output_dir, city_name_l, cloud_bucket, output_dir)
-        elif task_index == 15:
-            for i in ['air', 'landslide', 'liquefaction', 'solar']:  # processing time: 1m
-                if menu[i]:
-                    import rasterio
-                    import raster_pro
-                    import gc
-
-                    raster_bytes = utils.read_blob_to_memory(data_bucket, global_inputs[f'{i}_blob'])
-                    out_image, out_meta = raster_pro.raster_mask_bytes(raster_bytes, features)
-                    with rasterio.open(f'{local_output_dir}/{city_name_l}_{i}.tif', "w", **out_meta) as dest:
-                        dest.write(out_image)
-
-                    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_{i}.tif", f"{output_dir}/{city_name_l}_{i}.tif")
-
-                    del raster_bytes
-                    gc.collect()
-            
-            if menu['solar']:
-                import solar
-                solar.plot_solar(cloud_bucket, local_data_dir, data_bucket, global_inputs['solar_graph_blob'], features, city_name_l, local_output_dir, output_dir, render_dir, font_dict)
-        elif task_index == 16:
-            import gee_fun
-            gee_outputs = []
-
-            if menu['forest']:  # processing time (all GEE): 1m
-                gee_outputs += gee_fun.gee_forest(city_name_l, aoi_file, cloud_bucket, output_dir)
-
-            if menu['green']:
-                gee_outputs += gee_fun.gee_ndxi(city_name_l, aoi_file, local_output_dir, city_inputs['first_year'], city_inputs['last_year'], data_bucket, cloud_bucket, output_dir, index_type = 'ndvi')
-
-            if menu['landcover']:
-                gee_outputs += gee_fun.gee_landcover(city_name_l, aoi_file, local_output_dir, cloud_bucket, output_dir)
-                utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_lc.csv", f'{output_dir}/{city_name_l}_lc.csv')
-                gee_fun.gee_landcover_stats(cloud_bucket, city_name, city_name_l, local_output_dir, output_dir, render_dir, font_dict)
-
-            if menu['lst_summer']:
-                gee_outputs += gee_fun.gee_lst(city_name_l, aoi_file, local_output_dir, city_inputs['first_year'], city_inputs['last_year'], data_bucket, cloud_bucket, output_dir, season = 'summer')
+        enabled = components.enabled_components(menu)
+        city_plans = []
+        for ctx in city_ctxs:
+            # Fingerprint the inputs of the components this task runs (on first use); on a re-run,
+            # unchanged components and scenarios reuse their outputs
+            ctx.fingerprints = fingerprint.Fingerprints(enabled, ctx)
+            ctx.previous_records = fingerprint.load_previous_records(ctx) if ctx.city_inputs.get('prev_run_date', None) is not None else {}
+            if scheduler_mode == 'queue':
+                city_plans.append((ctx, enabled))
+            else:
+                # Pack the enabled components onto the available tasks and take this task's share
+                task_plan = scheduler.plan(enabled, task_count)
+                if task_index == 0:
+                    scheduler.print_plan(task_plan)
+                city_plans.append((ctx, task_plan[task_index] if task_index < len(task_plan) else []))
+
+        if is_batch:
+            # Download and process the source assets shared by several cities once, before any city
+            assets, users = shared_assets.resolve(city_plans)
+            for key, n in users.items():
+                print(f"Shared asset {key}: used by {n} cities")
+            shared_assets.prepare(assets)
+
+        failed_components = []
+        for ctx, city_components in city_plans:
+            if scheduler_mode == 'queue':
+                # Every task pulls the next runnable component from a queue shared by the execution
+                queue = work_queue.FirestoreWorkQueue(db, f'{execution_id}-{ctx.city_name_l}' if is_batch else execution_id)
+                queue.seed(city_components)
+                failed = work_queue.run_queue(queue, {c.name: c for c in city_components}, ctx, worker_id=f'task-{task_index}')
+            else:
+                logger.info(f"Task {task_index} runs for {ctx.city_name}: {', '.join(c.name for c in city_components) or 'nothing'}")
+                failed = scheduler.run_components(city_components, ctx)
+            failed_components += [f'{ctx.city_name_l}/{name}' if is_batch else name for name in failed]
 
-            if menu['lst_winter']:
-                gee_outputs += gee_fun.gee_lst(city_name_l, aoi_file, local_output_dir, city_inputs['first_year'], city_inputs['last_year'], data_bucket, cloud_bucket, output_dir, season = 'winter')
+            # Upload the run manifest of this city
+            perf.write_manifest(ctx, task_index, task_count, scheduler_mode)
+            perf.reset_records()
 
-            if menu['ndmi']:
-                gee_outputs += gee_fun.gee_ndxi(city_name_l, aoi_file, local_output_dir, city_inputs['first_year'], city_inputs['last_year'], data_bucket, cloud_bucket, output_dir, index_type = 'ndmi')
+        # TODO: Add a step to copy the user provided data in 01-user-input/ to the city directory
 
-            if menu['nightlight']:
-                gee_outputs += gee_fun.gee_nightlight(city_name_l, aoi_file, cloud_bucket, output_dir)
-            
-            for blob in gee_outputs:
-                # Check every blob exists and only move on to the next blob if the current blob exists
-                while not utils.check_blob_exists(cloud_bucket, blob):
-                    time.sleep(60)
-            print('All GEE outputs are ready.')
-        elif task_index == 17:
-            if menu['basic_info']:
-                import basic_info
-
-                basic_info_dict = {
-                    'country': country_name,
-                    'aoi_area': basic_info.calculate_aoi_area(aoi_file),
-                    'koeppen': basic_info.get_koeppen_classification(features, data_bucket, global_inputs['koeppen_blob'], local_data_dir)
-                }
-
-                with open(f'{local_output_dir}/{city_name_l}_basic_info.yml', 'w') as f:
-                    yaml.dump(basic_info_dict, f)
-                utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_basic_info.yml', f'{output_dir}/{city_name_l}_basic_info.yml')
-        elif task_index == 18:
-            if menu['oe_plot']:
-                import oe_plot
-                oe_plot.oe_plot(data_bucket, cloud_bucket, global_inputs['oe_dir'], global_inputs['oe_locations_blob'], global_inputs['oegc_blob'], global_inputs['countries_shp_blob'], local_data_dir, 
-                                country_name, country_name_l, city_name, city_name_l, city_inputs.get('alternate_city_name', None), local_output_dir, output_dir, render_dir, font_dict)
-        elif task_index == 19:
-            if menu['earthquake']:
-                import earthquake_event
-                earthquake_event.plot_earthquake_event(features, city_name_l, local_output_dir, cloud_bucket, output_dir, render_dir, font_dict)
-        elif task_index == 20:
-            if menu['flood_event']:
-                import flood_event
-                flood_event.plot_flood_event(data_bucket, cloud_bucket, global_inputs['flood_archive_dir'], global_inputs['flood_archive_blob'], features, local_data_dir, local_output_dir, city_name_l, output_dir, render_dir, font_dict)
-        elif task_index == 21:
-            if menu['ghs_population']:
-                import ghs_population
-                ghs_population.ghs_population(aoi_file,city_inputs, local_output_dir, city_name_l, global_inputs['ghsl_bucket'],cloud_bucket, output_dir, global_inputs['ghsl_blob'])
-        elif task_index == 22:
-            if menu['ghs_builtup']:
-                import ghs_builtup
-                ghs_builtup.ghs_builtup(aoi_file,city_inputs, local_output_dir, city_name_l, global_inputs['ghsl_bucket'],cloud_bucket, output_dir, global_inputs['ghsl_blob'])
-                ghs_builtup.ghs_builtup_overtime(aoi_file, city_inputs, local_output_dir, city_name_l, global_inputs['ghsl_bucket'], cloud_bucket, output_dir, global_inputs['ghsl_blob'], threshold=1200)
+        # Report cloud storage usage and import time of this task
+        utils.print_storage_stats()
+        perf.print_import_profile()
 
-            
-        # TODO: Add a step to copy the user provided data in 01-user-input/ to the city directory
+        if failed_components:
+            raise RuntimeError(f"Components failed: {', '.join(failed_components)}")
 
         # Update completion counter
         completed_tasks = update_completion_counter(counter_ref, db)
@@ -368,11 +315,12 @@ def main():
 
         # If all tasks are done, trigger job2
         if completed_tasks == task_count:
-            logger.info("All tasks completed. Triggering job2...")
-            if trigger_job2(project_id, region, job2_name, execution_id, city_dir):
-                logger.info("Job2 triggered successfully")
-            else:
-                logger.error("Failed to trigger job2")
+            for ctx in city_ctxs:
+                logger.info(f"All tasks completed. Triggering job2 for {ctx.city_dir}...")
+                if trigger_job2(project_id, region, job2_name, execution_id, ctx.city_dir):
+                    logger.info("Job2 triggered successfully")
+                else:
+                    logger.error("Failed to trigger job2")
 
     except Exception as e:
         logger.error(f"Task {task_index} failed: {e}")
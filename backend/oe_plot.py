@@ -745,10 +745,10 @@ def oe_plot(data_bucket, cloud_bucket, oe_dir, oe_locations_blob, oegc_blob, cou
     import utils
     import pandas as pd
 
-    utils.download_blob(data_bucket, f'{oe_dir}/{oe_locations_blob}', f'{local_data_dir}/oe_locations.csv', check_exists=True)
+    utils.download_blob(data_bucket, f'{oe_dir}/{oe_locations_blob}', f'{local_data_dir}/oe_locations.csv', check_exists=True, cache=True)
     oe_locations = pd.read_csv(f'{local_data_dir}/oe_locations.csv')
     if check_city_in_oxford(oe_locations, country_name, city_name):
-        utils.download_blob(data_bucket, f'{oe_dir}/{oegc_blob}', f'{local_data_dir}/oegc.csv', check_exists=True)
+        utils.download_blob(data_bucket, f'{oe_dir}/{oegc_blob}', f'{local_data_dir}/oegc.csv', check_exists=True, cache=True)
         oegc = pd.read_csv(f'{local_data_dir}/oegc.csv')
 
         bm_cities, bm_cities_countries = find_benchmark_cities(oe_locations, oegc, countries_shp_blob, local_data_dir, country_name, city_name)
@@ -0,0 +1,270 @@
+"""
+Per-component performance instrumentation and the run manifest.
+
+measure() wraps one component and records its wall time, CPU time (including child
+processes), peak resident memory, and the calls and bytes per data source while it ran:
+Cloud Storage (from the counters of the utils storage session, per operation), HTTP
+(requests, per host, see install_http_hooks) and S3 (reported with record_transfer).
+
+install_import_profiler() times the imports of the process, and record_startup() other
+fixed startup costs (e.g. Earth Engine initialization), to track the cold-start cost of
+each task.
+
+write_manifest() uploads the records of a task as JSON to
+<city_dir>/manifests/<execution id>/task-<index>.json, so that runs can be compared and
+Cloud Run memory and CPU sized per task.
+"""
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_transfers = {}
+_records = []
+_http_hooks_installed = False
+_startup = {}
+_imports = []
+_import_depth = threading.local()
+_process_start = time.perf_counter()
+
+def record_transfer(source, operation, nbytes = 0):
+    """Count one call and its bytes for a data source, e.g. ('s3:bucket', 'download', 1024)."""
+    with _lock:
+        counter = _transfers.setdefault(source, {}).setdefault(operation, {'calls': 0, 'bytes': 0})
+        counter['calls'] += 1
+        counter['bytes'] += nbytes
+
+def transfer_stats():
+    with _lock:
+        return {source: {op: dict(v) for op, v in ops.items()} for source, ops in _transfers.items()}
+
+def install_http_hooks():
+    """Count the calls and response bytes of every requests call, per host."""
+    global _http_hooks_installed
+    if _http_hooks_installed:
+        return
+    import requests
+    from urllib.parse import urlparse
+
+    send = requests.Session.send
+
+    def counting_send(self, request, **kwargs):
+        response = send(self, request, **kwargs)
+        # Content-Length avoids reading streamed responses; fall back to the body if it was read
+        nbytes = response.headers.get('Content-Length')
+        if nbytes is None and not kwargs.get('stream'):
+            nbytes = len(response.content or b'')
+        record_transfer(f'http:{urlparse(request.url).netloc}', request.method.lower(), int(nbytes or 0))
+        return response
+
+    requests.Session.send = counting_send
+    _http_hooks_installed = True
+
+class _ImportTimer:
+    """
+    Meta path finder that finds nothing itself, but wraps the loaders found by the other
+    finders to time module execution. Imports nested in another timed import are counted
+    in the outer one, so the top-level entries add up to the total import time.
+    """
+    def find_spec(self, fullname, path, target = None):
+        import sys
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                # Built-in and frozen modules are loaded by classes shared by all modules
+                if spec.loader is not None and not isinstance(spec.loader, type) and hasattr(spec.loader, 'exec_module'):
+                    spec.loader.exec_module = _timed_exec(fullname, spec.loader.exec_module)
+                return spec
+        return None
+
+def _timed_exec(fullname, exec_module):
+    def timed(module):
+        depth = getattr(_import_depth, 'value', 0)
+        _import_depth.value = depth + 1
+        time0 = time.perf_counter()
+        try:
+            return exec_module(module)
+        finally:
+            _import_depth.value = depth
+            if depth == 0:
+                with _lock:
+                    _imports.append((fullname, time.perf_counter() - time0))
+    return timed
+
+def install_import_profiler():
+    """Time the imports from now on; call before importing the heavy modules."""
+    import sys
+
+    if not any(isinstance(f, _ImportTimer) for f in sys.meta_path):
+        sys.meta_path.insert(0, _ImportTimer())
+
+def preload(module_names):
+    """
+    Import modules in a background thread, e.g. while the task downloads its inputs. A later
+    import of the same module in another thread waits for this one to finish.
+    """
+    import importlib
+
+    def run():
+        for name in module_names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.warning(f'Could not preload {name}: {e}')
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def record_startup(name, seconds):
+    """Record a fixed startup cost, e.g. ('ee_initialize', 3.2)."""
+    with _lock:
+        _startup[name] = round(_startup.get(name, 0) + seconds, 3)
+
+def import_profile(top = 20):
+    """Total import time and the slowest top-level imports, as a dict."""
+    with _lock:
+        imports = sorted(_imports, key=lambda i: -i[1])
+    return {
+        'total_seconds': round(sum(s for _, s in imports), 3),
+        'count': len(imports),
+        'slowest': [{'module': m, 'seconds': round(s, 3)} for m, s in imports[:top]],
+    }
+
+def startup_report():
+    """Cold-start costs of this task: imports, other recorded startup costs and time since perf was loaded."""
+    with _lock:
+        startup = dict(_startup)
+    return {'imports': import_profile(), **startup, 'seconds_since_start': round(time.perf_counter() - _process_start, 3)}
+
+def print_import_profile(top = 10):
+    profile = import_profile(top)
+    print(f"Imports: {profile['total_seconds']:.2f} s in {profile['count']} top-level imports")
+    for i in profile['slowest']:
+        print(f"  {i['module']}: {i['seconds']:.2f} s")
+
+def _current_rss():
+    """Resident memory of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Not Linux: the lifetime peak is the best available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class _RssSampler:
+    """Samples the resident memory in the background to find the peak within a block."""
+    def __init__(self, interval = 0.5):
+        self.interval = interval
+        self.peak = _current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+        return self.peak
+
+def _cpu_seconds():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime
+
+def _diff(after, before):
+    """Difference of two nested {source: {operation: {counter: value}}} dicts, without empty entries."""
+    diff = {}
+    for source, ops in after.items():
+        for op, counters in ops.items():
+            prev = before.get(source, {}).get(op, {})
+            delta = {k: v - prev.get(k, 0) for k, v in counters.items()}
+            if delta.get('calls'):
+                diff.setdefault(source, {})[op] = delta
+    return diff
+
+def _sources():
+    import utils
+
+    sources = transfer_stats()
+    sources['gcs'] = {op: v for op, v in utils.get_storage_stats().items() if op != 'total'}
+    return sources
+
+@contextmanager
+def measure(name):
+    """
+    Measure the block as component name and add it to the records of this process.
+    Yields the record, so the caller can add e.g. its status.
+    """
+    record = {'component': name, 'started': datetime.now(timezone.utc).isoformat()}
+    sources0 = _sources()
+    cpu0 = _cpu_seconds()
+    time0 = time.perf_counter()
+    sampler = _RssSampler()
+    sampler.start()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = round(time.perf_counter() - time0, 3)
+        record['cpu_seconds'] = round(_cpu_seconds() - cpu0, 3)
+        record['peak_rss_mb'] = round(sampler.stop() / 2**20, 1)
+        record['sources'] = _diff(_sources(), sources0)
+        record['calls'] = sum(v['calls'] for ops in record['sources'].values() for v in ops.values())
+        with _lock:
+            _records.append(record)
+        print(f"{name}: {record['wall_seconds']:.0f} s wall, {record['cpu_seconds']:.0f} s CPU, "
+              f"peak RSS {record['peak_rss_mb']:.0f} MB, {record['calls']} calls")
+
+def get_records():
+    with _lock:
+        return [dict(r) for r in _records]
+
+def reset_records():
+    """Clear the component records, e.g. after writing the manifest of one city of a batch."""
+    with _lock:
+        _records.clear()
+
+def build_manifest(ctx, task_index, task_count, scheduler_mode):
+    """The run manifest of this task: run metadata and the records of its components."""
+    return {
+        'execution_id': ctx.execution_id,
+        'task_index': task_index,
+        'task_count': task_count,
+        'scheduler_mode': scheduler_mode,
+        'city_name': ctx.city_name,
+        'country_iso3': ctx.country_iso3,
+        'cpu_count': os.cpu_count(),
+        'written': datetime.now(timezone.utc).isoformat(),
+        'startup': startup_report(),
+        'components': get_records(),
+    }
+
+def manifest_blob(ctx, task_index):
+    return f'{ctx.city_dir}/manifests/{ctx.execution_id}/task-{task_index}.json'
+
+def write_manifest(ctx, task_index, task_count, scheduler_mode):
+    """Upload the run manifest of this task. Failures are logged and do not fail the task."""
+    import utils
+
+    manifest = build_manifest(ctx, task_index, task_count, scheduler_mode)
+    try:
+        utils.upload_string(ctx.cloud_bucket, json.dumps(manifest, indent=2), manifest_blob(ctx, task_index))
+    except Exception as e:
+        logger.warning(f'Could not upload the run manifest: {e}')
+    return manifest
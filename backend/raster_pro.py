@@ -1,11 +1,67 @@
+import threading
+from collections import OrderedDict
+
+# AOI masks rasterized by grid signature and features (see aoi_mask)
+AOI_MASK_CACHE_SIZE = 32
+_aoi_masks = OrderedDict()
+_aoi_masks_lock = threading.Lock()
+
+def _features_key(features):
+    import hashlib
+    import json
+
+    h = hashlib.sha256()
+    for geom in features:
+        h.update(geom.wkb if hasattr(geom, 'wkb') else json.dumps(geom, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def aoi_mask(src, features):
+    """
+    The AOI mask of an open raster, as rasterio.features.raster_geometry_mask with
+    all_touched and crop: (shape_mask, transform, window). It is rasterized once per grid
+    (CRS, transform and shape) and features, and reused for every raster on that grid,
+    e.g. the WorldPop age and sex rasters of a country or the daily FWI files.
+    """
+    from rasterio.features import raster_geometry_mask
+
+    key = (src.crs.to_wkt() if src.crs else None, tuple(src.transform), src.width, src.height, _features_key(features))
+    with _aoi_masks_lock:
+        if key in _aoi_masks:
+            _aoi_masks.move_to_end(key)
+            return _aoi_masks[key]
+
+    result = raster_geometry_mask(src, features, all_touched = True, crop = True)
+    with _aoi_masks_lock:
+        _aoi_masks[key] = result
+        while len(_aoi_masks) > AOI_MASK_CACHE_SIZE:
+            _aoi_masks.popitem(last=False)
+    return result
+
+def mask_dataset(src, features, indexes = None):
+    """
+    Mask an open raster to features, as rasterio.mask.mask with all_touched and crop, but
+    with the AOI mask from aoi_mask.
+
+    Returns:
+        out_image (filled with the raster's nodata value, or 0) and its transform.
+    """
+    shape_mask, out_transform, window = aoi_mask(src, features)
+    if indexes is None:
+        out_shape = (src.count,) + shape_mask.shape
+    elif isinstance(indexes, int):
+        out_shape = shape_mask.shape
+    else:
+        out_shape = (len(indexes),) + shape_mask.shape
+    out_image = src.read(window=window, out_shape=out_shape, masked=True, indexes=indexes)
+    out_image.mask = out_image.mask | shape_mask
+    return out_image.filled(src.nodata if src.nodata is not None else 0), out_transform
+
 def raster_mask_bytes(raster_bytes, features):
-    import rasterio.mask
     from rasterio.io import MemoryFile
 
     with MemoryFile(raster_bytes) as memfile:
         with memfile.open() as src:
-            out_image, out_transform = rasterio.mask.mask(
-                src, features, all_touched = True, crop = True)
+            out_image, out_transform = mask_dataset(src, features)
             out_meta = src.meta.copy()
 
         out_meta.update({"driver": "GTiff",
@@ -15,13 +71,44 @@ def raster_mask_bytes(raster_bytes, features):
 
     return out_image, out_meta
 
+# Creation options of the raster products: Cloud-Optimized GeoTIFFs, tiled and compressed,
+# with a floating point or horizontal differencing predictor and nearest-neighbour overviews
+COG_OPTIONS = {'BLOCKSIZE': 512, 'COMPRESS': 'DEFLATE', 'PREDICTOR': 'YES',
+               'OVERVIEW_RESAMPLING': 'NEAREST', 'BIGTIFF': 'IF_SAFER', 'NUM_THREADS': 'ALL_CPUS'}
+
+def write_raster(output_raster, out_image, out_meta):
+    """
+    Write a raster product as a Cloud-Optimized GeoTIFF (see COG_OPTIONS). out_image is an
+    array of shape (bands, height, width) or (height, width), and out_meta its metadata, e.g.
+    from raster_mask_file; its driver and GTiff layout options are replaced.
+    """
+    import os
+    import tempfile
+    import rasterio
+    from rasterio.shutil import copy
+
+    if out_image.ndim == 2:
+        out_image = out_image[None]
+    meta = {k: v for k, v in out_meta.items() if k.lower() not in ('driver', 'compress', 'predictor', 'tiled', 'blockxsize', 'blockysize', 'interleave')}
+    meta.update({'driver': 'GTiff', 'count': out_image.shape[0]})
+
+    # The COG driver copies from an existing dataset; the intermediate GeoTIFF is written
+    # to disk next to the output rather than to memory, so the array is not held twice
+    fd, tmp_path = tempfile.mkstemp(suffix='.tif', dir=os.path.dirname(os.path.abspath(output_raster)))
+    os.close(fd)
+    try:
+        with rasterio.open(tmp_path, 'w', **meta) as tmp:
+            tmp.write(out_image)
+        with rasterio.open(tmp_path) as tmp:
+            copy(tmp, output_raster, driver='COG', **COG_OPTIONS)
+    finally:
+        os.remove(tmp_path)
+
 def raster_mask_file(raster_file, features):
     import rasterio
-    import rasterio.mask
 
     with rasterio.open(raster_file) as src:
-        out_image, out_transform = rasterio.mask.mask(
-            src, features, all_touched = True, crop = True)
+        out_image, out_transform = mask_dataset(src, features)
         out_meta = src.meta.copy()
 
     out_meta.update({"driver": "GTiff",
@@ -31,6 +118,71 @@ def raster_mask_file(raster_file, features):
 
     return out_image, out_meta
 
+# GDAL settings for reading remote rasters over HTTP range requests
+REMOTE_GDAL_OPTIONS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_MAX_RETRY': '3',
+    'GDAL_HTTP_RETRY_DELAY': '1',
+    'VSI_CACHE': 'TRUE',
+}
+
+def is_tiled(src):
+    """Whether an open raster is stored in tiles, so that a window can be read without whole rows."""
+    return bool(src.profile.get('tiled')) or src.block_shapes[0][1] < src.width
+
+def raster_mask_remote(raster_path, features, gdal_options = None):
+    """
+    Mask a tiled raster (e.g. a Cloud-Optimized GeoTIFF) in place, reading only the tiles of
+    the features' window. raster_path is any path GDAL can open, e.g. a local file or an
+    http(s) URL, read with range requests.
+
+    Returns:
+        out_image and out_meta as raster_mask_file, or None if the raster is not tiled.
+    """
+    import rasterio
+
+    if raster_path.startswith(('http://', 'https://')):
+        raster_path = f'/vsicurl/{raster_path}'
+
+    with rasterio.Env(**{**REMOTE_GDAL_OPTIONS, **(gdal_options or {})}):
+        with rasterio.open(raster_path) as src:
+            if not is_tiled(src):
+                return None
+            out_image, out_transform = mask_dataset(src, features)
+            out_meta = src.meta.copy()
+
+    out_meta.update({"driver": "GTiff",
+                    "height": out_image.shape[1],
+                    "width": out_image.shape[2],
+                    "transform": out_transform})
+
+    return out_image, out_meta
+
+def raster_mask_blob(bucket_name, blob_name, features):
+    """
+    Mask a raster blob, e.g. a global raster in the data bucket. Tiled rasters are read in
+    place (only the window of the features); other rasters, or blobs the storage backend
+    cannot open in place, are read into memory as before.
+    """
+    import utils
+
+    remote = utils.blob_raster_path(bucket_name, blob_name)
+    if remote is not None:
+        raster_path, gdal_options = remote
+        try:
+            with utils.get_storage_session().timed('range_read'):
+                result = raster_mask_remote(raster_path, features, gdal_options)
+            if result is not None:
+                print(f'Read the AOI window of {blob_name}.')
+                return result
+            print(f'{blob_name} is not tiled; reading the whole raster. Convert it with cog.py.')
+        except Exception as e:
+            print(f'Windowed read of {blob_name} failed, reading the whole raster: {e}')
+
+    return raster_mask_bytes(utils.read_blob_to_memory(bucket_name, blob_name, cache=True), features)
+
 def tile_finder(aoi_file, direction, tile_size = 1):
     import math
 
@@ -125,10 +277,13 @@ def download_raster(download_list, local_data_dir, data_bucket, data_bucket_dir)
     
     downloaded_list = []
 
-    for f in download_list:
+    # fetch every file already mirrored in the data bucket concurrently
+    mirror_results = utils.download_many(data_bucket, [(f'{data_bucket_dir}/{f.split("/")[-1]}', f'{local_data_dir}/{f.split("/")[-1]}') for f in download_list], cache=True)
+
+    for f, mirror_result in zip(download_list, mirror_results):
         dl_file_name = f.split('/')[-1]
 
-        if utils.download_blob(data_bucket, f'{data_bucket_dir}/{dl_file_name}', f'{local_data_dir}/{dl_file_name}'):
+        if mirror_result['ok']:
             downloaded_list.append(f'{local_data_dir}/{dl_file_name}')
         else:
             try:
@@ -145,12 +300,92 @@ def download_raster(download_list, local_data_dir, data_bucket, data_bucket_dir)
     
     return downloaded_list
 
-def mosaic_raster(mosaic_list, local_output_dir, mosaic_file, method = 'first'):
-    # mosaic or rename raster file(s) as needed
+# GDAL data type names of the numpy dtypes supported in virtual mosaics
+VRT_DATA_TYPES = {'uint8': 'Byte', 'int8': 'Int8', 'uint16': 'UInt16', 'int16': 'Int16', 'uint32': 'UInt32',
+                  'int32': 'Int32', 'float32': 'Float32', 'float64': 'Float64'}
+
+def build_vrt(mosaic_list, vrt_path):
+    """
+    Write a virtual mosaic (GDAL VRT) of raster tiles, with the 'first' semantics of
+    rasterio.merge: where tiles overlap, the first tile with valid data wins.
+
+    Returns:
+        True if the VRT was written, False if the tiles do not share a CRS, band count,
+        data type, nodata value and resolution (they must then be merged).
+    """
+    import os
+    import math
+    import rasterio
+    from xml.sax.saxutils import escape
+
+    tiles = []
+    for f in mosaic_list:
+        with rasterio.open(f) as src:
+            tiles.append({'path': os.path.abspath(f), 'crs': src.crs, 'count': src.count, 'dtype': src.dtypes[0],
+                          'nodata': src.nodata, 'res': src.res, 'bounds': src.bounds,
+                          'width': src.width, 'height': src.height, 'block': src.block_shapes[0]})
+    first = tiles[0]
+    for t in tiles:
+        if (t['crs'] != first['crs'] or t['count'] != first['count'] or t['dtype'] != first['dtype']
+                or first['dtype'] not in VRT_DATA_TYPES or str(t['nodata']) != str(first['nodata'])
+                or not all(math.isclose(a, b, rel_tol=1e-6) for a, b in zip(t['res'], first['res']))):
+            return False
+
+    res_x, res_y = first['res']
+    minx = min(t['bounds'].left for t in tiles)
+    maxy = max(t['bounds'].top for t in tiles)
+    width = round((max(t['bounds'].right for t in tiles) - minx) / res_x)
+    height = round((maxy - min(t['bounds'].bottom for t in tiles)) / res_y)
+    data_type = VRT_DATA_TYPES[first['dtype']]
+    nodata = first['nodata']
+
+    lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+             f'  <SRS>{escape(first["crs"].to_wkt())}</SRS>',
+             f'  <GeoTransform>{minx!r}, {res_x!r}, 0.0, {maxy!r}, 0.0, {-res_y!r}</GeoTransform>']
+    for band in range(1, first['count'] + 1):
+        lines.append(f'  <VRTRasterBand dataType="{data_type}" band="{band}">')
+        if nodata is not None:
+            lines.append(f'    <NoDataValue>{nodata!r}</NoDataValue>')
+        # Later sources are drawn over earlier ones, so the first tile goes last; with a
+        # nodata value, only valid pixels are drawn, as in rasterio.merge
+        for t in reversed(tiles):
+            source = 'ComplexSource' if nodata is not None else 'SimpleSource'
+            lines += [f'    <{source}>',
+                      f'      <SourceFilename relativeToVRT="0">{escape(t["path"])}</SourceFilename>',
+                      f'      <SourceBand>{band}</SourceBand>',
+                      f'      <SourceProperties RasterXSize="{t["width"]}" RasterYSize="{t["height"]}" DataType="{data_type}" BlockXSize="{t["block"][1]}" BlockYSize="{t["block"][0]}"/>',
+                      f'      <SrcRect xOff="0" yOff="0" xSize="{t["width"]}" ySize="{t["height"]}"/>',
+                      f'      <DstRect xOff="{round((t["bounds"].left - minx) / res_x)}" yOff="{round((maxy - t["bounds"].top) / res_y)}" xSize="{t["width"]}" ySize="{t["height"]}"/>']
+            if nodata is not None:
+                lines.append(f'      <NODATA>{nodata!r}</NODATA>')
+            lines.append(f'    </{source}>')
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+
+    with open(vrt_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return True
+
+def mosaic_raster(mosaic_list, local_output_dir, mosaic_file, method = 'first', virtual = False):
+    """
+    Mosaic or rename raster file(s) as needed, and return the path of the mosaic.
+
+    With virtual=True, a VRT referencing the tiles is written instead (named like
+    mosaic_file, with a .vrt extension) and its path returned. Nothing is merged: reading
+    it, e.g. with raster_mask_file, only reads the tiles and windows needed. The tiles
+    must be kept. Only the 'first' method can be virtual; other methods, and tiles that
+    cannot be combined in a VRT, are merged as without virtual.
+    """
     import os
     import rasterio
     from rasterio.merge import merge
 
+    if virtual and mosaic_list and method == 'first':
+        vrt_path = f'{local_output_dir}/{os.path.splitext(mosaic_file)[0]}.vrt'
+        if build_vrt(mosaic_list, vrt_path):
+            return vrt_path
+        print(f'Tiles of {mosaic_file} cannot be combined in a VRT; merging them.')
+
     if len(mosaic_list) > 1:
         try:
             mosaic, output = merge(mosaic_list, method = method)
@@ -163,18 +398,54 @@ def mosaic_raster(mosaic_list, local_output_dir, mosaic_file, method = 'first'):
                  "transform": output,
                 }
             )
-            with rasterio.open(f'{local_output_dir}/{mosaic_file}', 'w', **output_meta) as m:
-                m.write(mosaic)
+            write_raster(f'{local_output_dir}/{mosaic_file}', mosaic, output_meta)
         except MemoryError:
             print('MemoryError when merging raster files:')
             print(mosaic_list)
             print('Try downloading raw files from cloud storage and using GIS for merging.')
     elif len(mosaic_list) == 1:
         os.rename(mosaic_list[0], f'{local_output_dir}/{mosaic_file}')
+    return f'{local_output_dir}/{mosaic_file}'
+
+_reprojection_cache = None
+
+def configure_reprojection_cache(cache_dir, max_bytes):
+    """Keep the outputs of reproject_raster in cache_dir, evicting least recently used ones beyond max_bytes."""
+    global _reprojection_cache
+    import utils
+
+    try:
+        _reprojection_cache = utils.DataCache(cache_dir, max_bytes)
+        print(f'Reprojection cache enabled at {cache_dir} ({max_bytes / 1e9:.1f} GB).')
+    except OSError as e:
+        _reprojection_cache = None
+        print(f'Reprojection cache at {cache_dir} is not available: {e}')
+    return _reprojection_cache
+
+def _reprojection_key(src_raster_path, dst_crs, target_raster_path):
+    """
+    Cache key of a reprojection: the source file (path, size and modification time, which
+    are cheap to read, unlike a hash of its content) and the target CRS or grid.
+    """
+    import os
+    import rasterio
+    from rasterio.crs import CRS
+
+    if target_raster_path:
+        with rasterio.open(target_raster_path) as target_raster:
+            target = (target_raster.crs.to_wkt(), tuple(target_raster.transform), target_raster.width, target_raster.height)
+    else:
+        target = CRS.from_user_input(dst_crs).to_wkt()
+    st = os.stat(src_raster_path)
+    source = (os.path.abspath(src_raster_path), st.st_size, st.st_mtime_ns)
+    return _reprojection_cache.make_key('reproject_raster', 'nearest', source, target, sorted(COG_OPTIONS.items()))
 
 def reproject_raster(src_raster_path, dst_raster_path, dst_crs=None, target_raster_path=None):
     """
     Reproject a raster to a new CRS, with an option to match the grid to a target raster.
+    If the reprojection cache is configured, the output is reused for the same, unmodified
+    source file and target CRS or grid (e.g. a population raster reprojected onto the grid
+    of each flood raster).
     
     Parameters:
         src_raster_path (str): Path to the input raster.
@@ -185,14 +456,29 @@ def reproject_raster(src_raster_path, dst_raster_path, dst_crs=None, target_rast
     Raises:
         ValueError: If neither dst_crs nor target_raster_path is provided.
     """
+    # Check if both dst_crs and target_raster_path are None
+    if dst_crs is None and target_raster_path is None:
+        raise ValueError("Either 'dst_crs' or 'target_raster_path' must be specified.")
+
+    if _reprojection_cache is None:
+        _reproject_raster(src_raster_path, dst_raster_path, dst_crs, target_raster_path)
+        return
 
+    filled = []
+    def fill_fn(tmp_path):
+        _reproject_raster(src_raster_path, tmp_path, dst_crs, target_raster_path)
+        filled.append(True)
+        return True
+    if not _reprojection_cache.fetch(_reprojection_key(src_raster_path, dst_crs, target_raster_path), fill_fn, dst_raster_path):
+        _reproject_raster(src_raster_path, dst_raster_path, dst_crs, target_raster_path)
+    elif not filled:
+        print(f'Reused the cached reprojection of {src_raster_path}.')
+
+def _reproject_raster(src_raster_path, dst_raster_path, dst_crs, target_raster_path):
+    import numpy as np
     import rasterio
     from rasterio.warp import calculate_default_transform, reproject, Resampling
 
-    # Check if both dst_crs and target_raster_path are None
-    if dst_crs is None and target_raster_path is None:
-        raise ValueError("Either 'dst_crs' or 'target_raster_path' must be specified.")
-    
     # If target_raster_path is provided, use its CRS and transform
     if target_raster_path:
         with rasterio.open(target_raster_path) as target_raster:
@@ -222,104 +508,389 @@ def reproject_raster(src_raster_path, dst_raster_path, dst_crs=None, target_rast
             'height': height
         })
 
-        # Open the destination raster for writing
-        with rasterio.open(dst_raster_path, 'w', **dst_meta) as dst_raster:
-            # Reproject and write to the new file
-            for i in range(1, src_raster.count + 1):
-                reproject(
-                    source=rasterio.band(src_raster, i),
-                    destination=rasterio.band(dst_raster, i),
-                    src_transform=src_raster.transform,
-                    src_crs=src_raster.crs,
-                    dst_transform=transform,
-                    dst_crs=dst_crs,
-                    resampling=Resampling.nearest
-                )
+        # Reproject band by band, then write the output
+        nodata = src_raster.nodata
+        destination = np.full((src_raster.count, height, width), 0 if nodata is None else nodata, dtype=src_raster.dtypes[0])
+        for i in range(1, src_raster.count + 1):
+            reproject(
+                source=rasterio.band(src_raster, i),
+                destination=destination[i - 1],
+                src_transform=src_raster.transform,
+                src_crs=src_raster.crs,
+                dst_transform=transform,
+                dst_crs=dst_crs,
+                dst_nodata=nodata,
+                resampling=Resampling.nearest
+            )
 
-def get_raster_histogram(input_raster, bins, output_csv):
+    write_raster(dst_raster_path, destination, dst_meta)
+
+def warp_outputs(out_image, out_meta, outputs, num_threads = None):
+    """
+    Write an in-memory raster (e.g. from raster_mask_file) to one or more outputs, warping
+    it in memory with nearest-neighbour resampling, as reproject_raster does.
+
+    Args:
+        out_image: Array of shape (bands, height, width).
+        out_meta: Its rasterio metadata.
+        outputs: List of dicts with the output 'path' and either 'crs' (the target CRS, on the
+            default grid of calculate_default_transform), 'target' (a raster whose CRS and grid
+            are matched) or neither (written as is).
+        num_threads: Warping threads (default: all CPUs).
+    """
+    import os
+    import numpy as np
+    import rasterio
+    from rasterio.transform import array_bounds
+    from rasterio.warp import calculate_default_transform, reproject, Resampling
+
+    num_threads = num_threads or os.cpu_count() or 1
+    nodata = out_meta.get('nodata')
+    for output in outputs:
+        if output.get('crs') is None and output.get('target') is None:
+            write_raster(output['path'], out_image, out_meta)
+            continue
+
+        if output.get('target') is not None:
+            with rasterio.open(output['target']) as target_raster:
+                dst_crs = target_raster.crs
+                transform, width, height = target_raster.transform, target_raster.width, target_raster.height
+        else:
+            dst_crs = output['crs']
+            transform, width, height = calculate_default_transform(
+                out_meta['crs'], dst_crs, out_meta['width'], out_meta['height'],
+                *array_bounds(out_meta['height'], out_meta['width'], out_meta['transform']))
+
+        destination = np.full((out_image.shape[0], height, width), 0 if nodata is None else nodata, dtype=out_image.dtype)
+        reproject(
+            source=out_image,
+            destination=destination,
+            src_transform=out_meta['transform'],
+            src_crs=out_meta['crs'],
+            src_nodata=nodata,
+            dst_transform=transform,
+            dst_crs=dst_crs,
+            dst_nodata=nodata,
+            resampling=Resampling.nearest,
+            num_threads=num_threads
+        )
+        dst_meta = out_meta.copy()
+        dst_meta.update({'crs': dst_crs, 'transform': transform, 'width': width, 'height': height})
+        write_raster(output['path'], destination, dst_meta)
+
+def warp_pipeline(sources, features, outputs, nodata = None, num_threads = None):
+    """
+    Mosaic, clip and reproject in a single read of the source pixels: the tiles are combined
+    in a virtual mosaic (see build_vrt), only the window of the features is read and masked,
+    and the clipped raster is warped in memory to each output (see warp_outputs).
+
+    Args:
+        sources: Raster tiles (a list of paths) or a single raster path.
+        features: AOI geometries to clip to.
+        outputs: Outputs, as in warp_outputs.
+        nodata: Nodata value of the outputs, if it differs from the sources'.
+        num_threads: Warping threads (default: all CPUs).
+
+    Returns:
+        out_image and out_meta of the clipped raster in the source CRS, as raster_mask_file.
+    """
+    import os
+    import tempfile
+
+    if isinstance(sources, str):
+        sources = [sources]
+    fd, vrt_path = tempfile.mkstemp(suffix='.vrt', dir=os.path.dirname(os.path.abspath(sources[0])))
+    os.close(fd)
+    try:
+        if len(sources) == 1:
+            out_image, out_meta = raster_mask_file(sources[0], features)
+        elif build_vrt(sources, vrt_path):
+            out_image, out_meta = raster_mask_file(vrt_path, features)
+        else:
+            print('Tiles cannot be combined in a VRT; merging them.')
+            mosaic_file = os.path.basename(vrt_path)[:-4] + '.tif'
+            out_image, out_meta = raster_mask_file(mosaic_raster(sources, os.path.dirname(vrt_path), mosaic_file), features)
+            os.remove(os.path.join(os.path.dirname(vrt_path), mosaic_file))
+    finally:
+        os.remove(vrt_path)
+
+    if nodata is not None:
+        out_meta.update({'nodata': nodata})
+    warp_outputs(out_image, out_meta, outputs, num_threads)
+    return out_image, out_meta
+
+def sample_points(raster_paths, xs, ys, band = 1, fill = float('nan')):
+    """
+    Sample rasters at points. The points are converted to rows and columns in one
+    vectorized step per grid (shared by rasters on the same grid, e.g. flood scenarios),
+    and only the window containing them is read.
+
+    Args:
+        raster_paths: A raster path, or a list of rasters to sample in one call.
+        xs, ys: Point coordinates, in the CRS of the rasters.
+        band: Band to sample.
+        fill: Value of the points outside a raster.
+
+    Returns:
+        A float64 array of the values at the points, or a list of them for a list of rasters.
+    """
+    import numpy as np
     import rasterio
+    from rasterio.windows import Window
+
+    single = isinstance(raster_paths, str)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    grids = {}
+    results = []
+    for raster_path in ([raster_paths] if single else raster_paths):
+        with rasterio.open(raster_path) as src:
+            grid = (tuple(src.transform), src.width, src.height)
+            if grid not in grids:
+                cols, rows = ~src.transform * (xs, ys)
+                rows = np.floor(rows).astype(np.int64)
+                cols = np.floor(cols).astype(np.int64)
+                inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+                grids[grid] = (rows[inside], cols[inside], inside)
+            rows, cols, inside = grids[grid]
+
+            values = np.full(len(xs), fill, dtype=np.float64)
+            if inside.any():
+                row_off, col_off = rows.min(), cols.min()
+                window = Window(col_off, row_off, cols.max() - col_off + 1, rows.max() - row_off + 1)
+                values[inside] = src.read(band, window=window)[rows - row_off, cols - col_off]
+            results.append(values)
+
+    return results[0] if single else results
+
+def line_cell_lengths(geometries, transform, width, height, step = None):
+    """
+    Length of lines in each cell of a grid, for line-over-raster stats (e.g. the length of
+    roads in flood zones) without polygonizing the raster. The lines are densified into
+    pieces of at most step (default: a quarter of the pixel size), each counted in the cell
+    of its midpoint. Computed once per grid, the index serves every raster on that grid.
+
+    Args:
+        geometries: Lines (or multi-lines), in the CRS of the grid.
+        transform, width, height: The grid.
+
+    Returns:
+        The flat indices (row * width + col) of the cells crossed by the lines, and the
+        length of the lines in each.
+    """
     import numpy as np
-    import csv
+    import shapely
+
+    coords, index = shapely.get_coordinates(shapely.get_parts(np.asarray(geometries)), return_index=True)
+    same_line = index[:-1] == index[1:]
+    start, end = coords[:-1][same_line], coords[1:][same_line]
+    segment_lengths = np.hypot(*(end - start).T)
+
+    step = step or min(abs(transform.a), abs(transform.e)) / 4
+    pieces = np.maximum(np.ceil(segment_lengths / step).astype(np.int64), 1)
+    segment = np.repeat(np.arange(len(pieces)), pieces)
+    t = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces) + 0.5) / pieces[segment]
+    midpoints = start[segment] + (end - start)[segment] * t[:, None]
+
+    cols, rows = ~transform * (midpoints[:, 0], midpoints[:, 1])
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    cells, inverse = np.unique(rows[inside] * width + cols[inside], return_inverse=True)
+    lengths = np.bincount(inverse, weights=(segment_lengths / pieces)[segment][inside], minlength=len(cells))
+    return cells, lengths
+
+def zonal_counts(input_raster, values = None, bins = None, features = None, where = None, area = False, band = 1, block_rows = 1024):
+    """
+    Count the pixels of a raster by value or by bin in one pass, block by block.
+
+    Args:
+        input_raster: Path of the raster.
+        values: Values to count, e.g. the years of WSF evolution.
+        bins: Bin edges, binned as np.histogram (the last bin includes its right edge).
+        features: Optional AOI geometries; only pixels touching them are counted.
+        where: Optional path of a raster on the same grid; only pixels where it is
+            nonzero are counted.
+        area: Sum pixel areas instead of counts: res x res in CRS units on projected
+            grids, or square metres of each row's latitude on geographic grids.
+        band: Band to read.
+        block_rows: Rows read at a time.
+
+    Returns:
+        A dict of value to count (or area) with values, or an array of bin counts (or
+        areas) with bins.
+    """
+    import math
+    import numpy as np
+    import rasterio
+    from rasterio.features import geometry_mask
+    from rasterio.windows import Window
+
+    if (values is None) == (bins is None):
+        raise ValueError("Exactly one of 'values' or 'bins' must be specified.")
+    if values is not None:
+        values = list(values)
+        if not values:
+            return {}
+        keys = np.asarray(values)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        n = len(values)
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+        n = len(edges) - 1
 
     with rasterio.open(input_raster) as src:
-        # Read raster data
-        raster_data = src.read(1)
-        
-        # Calculate histogram
-        hist, _ = np.histogram(raster_data, bins=bins)
-        
-        # Write bins and hist to a CSV file
-        with open(output_csv, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Bin', 'Count'])
-            for i, count in enumerate(hist):
-                bin_range = f"{bins[i]}-{bins[i+1]}"
-                writer.writerow([bin_range, count])
+        transform = src.transform
+        geographic = src.crs is not None and src.crs.is_geographic
+        if area and geographic:
+            metres_per_degree = math.pi / 180 * EARTH_RADIUS
+            row_lats = transform.f + (np.arange(src.height) + 0.5) * transform.e
+            row_areas = transform.a * metres_per_degree * np.cos(np.radians(row_lats)) * -transform.e * metres_per_degree
+        totals = np.zeros(n, dtype=np.float64 if area and geographic else np.int64)
+
+        where_src = rasterio.open(where) if where is not None else None
+        try:
+            for row_off in range(0, src.height, block_rows):
+                window = Window(0, row_off, src.width, min(block_rows, src.height - row_off))
+                block = src.read(band, window=window)
+                keep = np.ones(block.shape, dtype=bool)
+                if features is not None:
+                    keep &= geometry_mask(features, out_shape=block.shape, transform=src.window_transform(window), invert=True, all_touched=True)
+                if where_src is not None:
+                    keep &= where_src.read(1, window=window) != 0
+
+                if values is not None:
+                    idx = np.searchsorted(sorted_keys, block)
+                    np.minimum(idx, n - 1, out=idx)
+                    keep &= sorted_keys[idx] == block
+                    idx = order[idx]
+                else:
+                    idx = np.searchsorted(edges, block, side='right') - 1
+                    idx[block == edges[-1]] = n - 1
+                    keep &= (idx >= 0) & (idx < n)
+
+                if area and geographic:
+                    weights = np.broadcast_to(row_areas[row_off:row_off + block.shape[0], None], block.shape)
+                    totals += np.bincount(idx[keep], weights=weights[keep], minlength=n)
+                else:
+                    totals += np.bincount(idx[keep], minlength=n)
+        finally:
+            if where_src is not None:
+                where_src.close()
+
+        if area and not geographic:
+            pixelSizeX, pixelSizeY = src.res
+            totals = totals * pixelSizeX * pixelSizeY
+
+    if values is not None:
+        return {v: totals[i] for i, v in enumerate(values)}
+    return totals
+
+def get_raster_histogram(input_raster, bins, output_csv):
+    import csv
+
+    # Calculate histogram
+    hist = zonal_counts(input_raster, bins=bins)
+
+    # Write bins and hist to a CSV file
+    with open(output_csv, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Bin', 'Count'])
+        for i, count in enumerate(hist):
+            bin_range = f"{bins[i]}-{bins[i+1]}"
+            writer.writerow([bin_range, count])
 
 def calculate_raster_area(input_raster, value_list):
-    import rasterio
+    return zonal_counts(input_raster, values=value_list, area=True)
+
+# Earth radius (m) used for the pixel sizes of geographic grids, as in Web Mercator
+EARTH_RADIUS = 6378137
+
+def _slope_block(elevation, pixel_size_x, pixel_size_y):
+    """
+    Slope in degrees of the inner rows of a block of elevation rows with one halo row above
+    and below. pixel_size_x holds the pixel width of each inner row. Columns are edge-padded,
+    so the result matches np.gradient over the edge-padded raster.
+    """
     import numpy as np
 
-    with rasterio.open(input_raster) as src:
-        pixelSizeX, pixelSizeY = src.res
-        array = src.read()
+    elevation = np.pad(elevation.astype(np.float64), ((0, 0), (1, 1)), mode='edge')
+    slope = (elevation[1:-1, 2:] - elevation[1:-1, :-2]) / (2 * pixel_size_x[:, None])
+    np.square(slope, out=slope)
+    dy = (elevation[2:, 1:-1] - elevation[:-2, 1:-1]) / (2 * pixel_size_y)
+    np.square(dy, out=dy)
+    slope += dy
+    del dy
+    np.sqrt(slope, out=slope)
+    np.arctan(slope, out=slope)
+    np.degrees(slope, out=slope)
+    return slope.astype(np.float32)
+
+def slope_raster(elev_raster, output_raster, block_rows = 512, num_threads = None):
+    """
+    Write the slope (degrees) of a DEM. Rows are processed in blocks with a one-row halo
+    across threads, and each block is written as soon as it is done, so memory stays
+    bounded by a few blocks. On geographic grids the pixel sizes are converted to metres
+    for each row's latitude; raster edges are edge-padded as before.
+    """
+    import os
+    import math
+    import numpy as np
+    import rasterio
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from rasterio.windows import Window
 
-        value_dict = {}
-        for v in value_list:
-            value_dict[v] = np.count_nonzero(array == v) * pixelSizeX * pixelSizeY
+    num_threads = num_threads or os.cpu_count() or 1
+    with rasterio.open(elev_raster) as src:
+        transform = src.transform
+        width, height = src.width, src.height
+        if src.crs is not None and src.crs.is_geographic:
+            metres_per_degree = math.pi / 180 * EARTH_RADIUS
+            row_lats = transform.f + (np.arange(height) + 0.5) * transform.e
+            row_pixel_size_x = transform.a * metres_per_degree * np.cos(np.radians(row_lats))
+            pixel_size_y = -transform.e * metres_per_degree
+        else:
+            row_pixel_size_x = np.full(height, transform.a)
+            pixel_size_y = -transform.e
 
-        return value_dict
+        profile = src.profile
+        profile.update(dtype=rasterio.float32, count=1, compress='lzw')
+
+        def read_block(row_off, rows):
+            # one halo row above and below, edge-padded at the top and bottom of the raster
+            first, last = max(row_off - 1, 0), min(row_off + rows + 1, height)
+            block = src.read(1, window=Window(0, first, width, last - first))
+            return np.pad(block, ((int(row_off == 0), int(row_off + rows == height)), (0, 0)), mode='edge')
+
+        with rasterio.open(output_raster, 'w', **profile) as dst, ThreadPoolExecutor(num_threads) as executor:
+            pending = deque()
+            for row_off in range(0, height, block_rows):
+                rows = min(block_rows, height - row_off)
+                block = read_block(row_off, rows)
+                pending.append((row_off, rows, executor.submit(_slope_block, block, row_pixel_size_x[row_off:row_off + rows], pixel_size_y)))
+                while len(pending) > 2 * num_threads or (pending and row_off + rows == height):
+                    done_row_off, done_rows, future = pending.popleft()
+                    dst.write(future.result(), 1, window=Window(0, done_row_off, width, done_rows))
 
 def slope(aoi_file, elev_raster, cloud_bucket, output_dir, city_name_l, local_output_dir):
     print('run slope')
 
     import os
     import utils
-    import rasterio
-    import numpy as np
 
     if not os.path.exists(elev_raster):
         if not utils.download_blob_timed(cloud_bucket, f'{output_dir}/spatial/{city_name_l}_elevation_buf.tif', elev_raster, 30*60, 60):
             return
     
-    # Reproject elevation raster to a projected coordinate system
-    reproject_raster(elev_raster, f'{local_output_dir}/{city_name_l}_elevation_3857.tif', 'EPSG:3857')
-
-    with rasterio.open(f'{local_output_dir}/{city_name_l}_elevation_3857.tif') as src:
-        elevation = src.read(1)
-        transform = src.transform
-        crs = src.crs
-        profile = src.profile
-
-    # Define pixel size (assumed square pixels for simplicity)
-    pixel_size_x = transform[0]
-    pixel_size_y = -transform[4]
-
-    # Calculate the gradient (difference) in the x and y directions with padding
-    padded_elevation = np.pad(elevation, 1, mode='edge')
-    dy, dx = np.gradient(padded_elevation, pixel_size_y, pixel_size_x)
-
-    # Remove the padding after calculation
-    dy = dy[1:-1, 1:-1]
-    dx = dx[1:-1, 1:-1]
-
-    # Calculate the slope in degrees
-    slope = np.arctan(np.sqrt(dx**2 + dy**2)) * (180 / np.pi)
-
-    # Update the profile for the output slope raster
-    profile.update(dtype=rasterio.float32, count=1, compress='lzw')
-
-    # Save the slope array to a new raster file
-    with rasterio.open(f'{local_output_dir}/{city_name_l}_slope_3857.tif', 'w', **profile) as dst:
-        dst.write(slope.astype(np.float32), 1)
-
-    # Reproject slope raster to WGS84
-    reproject_raster(f'{local_output_dir}/{city_name_l}_slope_3857.tif', f'{local_output_dir}/{city_name_l}_slope_4326.tif', 'EPSG:4326')
+    # Slope on the geographic grid, block by block
+    slope_raster(elev_raster, f'{local_output_dir}/{city_name_l}_slope_4326.tif')
 
     # Mask slope raster with AOI
     out_image, out_meta = raster_mask_file(f'{local_output_dir}/{city_name_l}_slope_4326.tif', aoi_file.geometry)
-    with rasterio.open(f'{local_output_dir}/{city_name_l}_slope.tif', 'w', **out_meta) as dest:
-        dest.write(out_image)
+    write_raster(f'{local_output_dir}/{city_name_l}_slope.tif', out_image, out_meta)
 
     utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_slope.tif', f'{output_dir}/{city_name_l}_slope.tif')
     utils.delete_blob(cloud_bucket, f'{output_dir}/spatial/{city_name_l}_elevation_buf.tif')
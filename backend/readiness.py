@@ -0,0 +1,191 @@
+"""
+Readiness registry: producers publish a record when an artifact is ready, and consumers
+wait on those records instead of repeatedly probing Cloud Storage.
+
+Keys are strings, e.g. blob_key(bucket, blob) for a blob in a bucket, and a record has a
+value (True by default, or e.g. 'done'/'failed' for a component status). utils.upload_blob
+and utils.upload_string publish every blob they write, so outputs of the pipeline are
+announced as soon as they are uploaded, and utils.delete_blob retracts the record of the
+blob it deletes, so that a record never outlives its blob.
+
+Artifacts written by other producers (e.g. Earth Engine exports, which write to the bucket
+directly) are never published. For those, wait() takes a probe function that checks the
+artifact itself; the probe runs with exponential backoff between notifications.
+
+FirestoreRegistry shares the records between all tasks of all executions through the
+Firestore collection 'readiness' and wakes waiters with snapshot listeners. Every record
+has an 'expires' timestamp for a Firestore TTL policy, so the collection does not grow
+without bound (see README.md). LocalRegistry
+keeps the records in memory and wakes waiters with a condition variable; it is the
+default, for running the pipeline on one machine.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def blob_key(bucket_name, blob_name):
+    return f'gs://{bucket_name}/{blob_name}'
+
+def _wait_loop(keys, lookup, notified, probe, timeout, max_interval):
+    """
+    Shared waiting logic. lookup(key) returns the published value or None; notified(seconds)
+    blocks until a record is published or the time has passed.
+    """
+    values = {key: lookup(key) for key in keys}
+    interval = 1
+    time0 = time.time()
+    while True:
+        pending = [key for key, value in values.items() if value is None]
+        if probe is not None:
+            for key in pending:
+                value = probe(key)
+                if value:
+                    values[key] = value
+            pending = [key for key, value in values.items() if value is None]
+        if not pending:
+            return values
+
+        remaining = None if timeout is None else timeout - (time.time() - time0)
+        if remaining is not None and remaining <= 0:
+            return values
+        wait_time = interval if remaining is None else min(interval, remaining)
+        if notified(wait_time):
+            for key in pending:
+                values[key] = lookup(key)
+        else:
+            # Only back off while nothing happens
+            interval = min(interval * 2, max_interval)
+
+class LocalRegistry:
+    """In-memory readiness registry for one process."""
+    def __init__(self):
+        self._records = {}
+        self._condition = threading.Condition()
+        self._version = 0
+
+    def publish(self, key, value = True):
+        with self._condition:
+            self._records[key] = value
+            self._version += 1
+            self._condition.notify_all()
+
+    def retract(self, key):
+        with self._condition:
+            self._records.pop(key, None)
+
+    def get(self, key):
+        with self._condition:
+            return self._records.get(key)
+
+    def wait(self, keys, timeout = None, probe = None, max_interval = 60):
+        """
+        Wait until every key is published (or confirmed by probe).
+
+        Args:
+            keys: Keys to wait for.
+            timeout: Maximum time to wait in seconds, or None to wait indefinitely.
+            probe: Optional function key -> value or None, checking an artifact that might not
+                be published, e.g. a blob exported by Earth Engine.
+            max_interval: Longest interval in seconds between probes.
+
+        Returns:
+            A dict of key to published value, or None for keys that are not ready.
+        """
+        with self._condition:
+            seen = [self._version]
+
+        def notified(seconds):
+            with self._condition:
+                self._condition.wait_for(lambda: self._version != seen[0], timeout=seconds)
+                changed = self._version != seen[0]
+                seen[0] = self._version
+                return changed
+
+        return _wait_loop(list(keys), self.get, notified, probe, timeout, max_interval)
+
+class FirestoreRegistry:
+    """
+    Readiness registry in the Firestore collection 'readiness', shared by all tasks. Records
+    expire ttl_days after they are published, once the TTL policy on 'expires' is enabled.
+    """
+    def __init__(self, db, collection = 'readiness', ttl_days = 7):
+        self.db = db
+        self.collection = db.collection(collection)
+        self.ttl_days = ttl_days
+
+    def _ref(self, key):
+        # Keys contain slashes, which are not allowed in document ids
+        return self.collection.document(hashlib.sha1(key.encode()).hexdigest())
+
+    def publish(self, key, value = True):
+        from datetime import datetime, timedelta, timezone
+        from google.cloud import firestore
+
+        expires = datetime.now(timezone.utc) + timedelta(days=self.ttl_days)
+        self._ref(key).set({'key': key, 'value': value, 'published': firestore.SERVER_TIMESTAMP, 'expires': expires})
+
+    def retract(self, key):
+        self._ref(key).delete()
+
+    def get(self, key):
+        snapshot = self._ref(key).get()
+        return snapshot.to_dict().get('value') if snapshot.exists else None
+
+    def wait(self, keys, timeout = None, probe = None, max_interval = 60):
+        """Same as LocalRegistry.wait, woken by Firestore snapshot listeners."""
+        keys = list(keys)
+        values = {}
+        ids = {self._ref(key).id: key for key in keys}
+        event = threading.Event()
+
+        def on_snapshot(snapshots, changes, read_time):
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    record = snapshot.to_dict()
+                    values[record['key']] = record.get('value')
+                    event.set()
+                else:
+                    # Retracted, e.g. the blob was deleted
+                    values.pop(ids.get(snapshot.id), None)
+
+        watches = [self._ref(key).on_snapshot(on_snapshot) for key in keys]
+        try:
+            def notified(seconds):
+                changed = event.wait(seconds)
+                event.clear()
+                return changed
+
+            return _wait_loop(keys, values.get, notified, probe, timeout, max_interval)
+        finally:
+            for watch in watches:
+                watch.unsubscribe()
+
+_registry = LocalRegistry()
+
+def configure(registry):
+    """Use registry (e.g. a FirestoreRegistry) for all publish and wait calls of this process."""
+    global _registry
+    _registry = registry
+
+def get_registry():
+    return _registry
+
+def publish(key, value = True):
+    """Publish that key is ready. Failures are logged, since waiters fall back to their probes."""
+    try:
+        _registry.publish(key, value)
+    except Exception as e:
+        logger.warning(f'Could not publish {key}: {e}')
+
+def retract(key):
+    """
+    Remove the record of key, e.g. of a deleted blob. Unlike publish, failures raise: a
+    stale record would satisfy waiters for an artifact that no longer exists.
+    """
+    _registry.retract(key)
+
+def wait(keys, timeout = None, probe = None, max_interval = 60):
+    return _registry.wait(keys, timeout=timeout, probe=probe, max_interval=max_interval)
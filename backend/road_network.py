@@ -260,9 +260,6 @@ def road_network(city_name_l, aoi_file, local_output_dir, cloud_bucket, output_d
     plot_radar(G, city_name_l, aoi_file, local_output_dir)
 
     # upload local outputs
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_nodes_and_edges.gpkg", f"{output_dir}/{city_name_l}_nodes_and_edges.gpkg")
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_road_network_extended_stats.csv", f"{output_dir}/{city_name_l}_road_network_extended_stats.csv")
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_road_network_basic_stats.csv", f"{output_dir}/{city_name_l}_road_network_basic_stats.csv")
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_network_plot.png", f"{output_dir}/{city_name_l}_network_plot.png")
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_road_bearings.csv", f"{output_dir}/{city_name_l}_road_bearings.csv")
-    utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_road_radar_plot.png", f"{output_dir}/{city_name_l}_road_radar_plot.png")
+    utils.upload_many(cloud_bucket, [(f"{local_output_dir}/{city_name_l}_{f}", f"{output_dir}/{city_name_l}_{f}") 
+                                     for f in ['nodes_and_edges.gpkg', 'road_network_extended_stats.csv', 'road_network_basic_stats.csv', 
+                                               'network_plot.png', 'road_bearings.csv', 'road_radar_plot.png']])
@@ -1,19 +1,19 @@
 def rwi(rwi_dir, rwi_blob_suffix, country_iso3, data_bucket, local_data_dir, aoi_file, local_output_dir, city_name_l, cloud_bucket, output_dir):
     print('run rwi')
     
-    import os
     import pandas as pd
     import geopandas as gpd
     from pyquadkey2.quadkey import QuadKey
     from pyquadkey2.quadkey import TileAnchor, QuadKey
     from shapely.geometry import Polygon
     import utils
+    import shared_assets
 
     # PROCESS RWI DATA ################################
-    rwi_data = f"{country_iso3}{rwi_blob_suffix}"
+    rwi_table = shared_assets.rwi_table(rwi_dir, rwi_blob_suffix, country_iso3, data_bucket, local_data_dir)
     
-    if utils.download_blob(data_bucket, f'{rwi_dir}/{rwi_data}', f'{local_data_dir}/{rwi_data}'):
-        FB_QKdata = pd.read_csv(f'{local_data_dir}/{rwi_data}')
+    if rwi_table is not None:
+        FB_QKdata = pd.read_csv(rwi_table)
         # change quadkey format to str
         FB_QKdata["quadkey1"] = FB_QKdata["quadkey"].astype('str')
         # fill 13 digit quadkeys with 0 before the QK
@@ -69,7 +69,6 @@ def rwi(rwi_dir, rwi_blob_suffix, country_iso3, data_bucket, local_data_dir, aoi
         gdf_aoi.to_file(f"{local_output_dir}/{city_name_l}_rwi.gpkg", driver = 'GPKG', layer = 'rwi')
         utils.upload_blob(cloud_bucket, f"{local_output_dir}/{city_name_l}_rwi.gpkg", f"{output_dir}/{city_name_l}_rwi.gpkg")
 
-        # delete data file
-        os.remove(f'{local_data_dir}/{rwi_data}')
+        # The data file is kept for other cities in the same country
     else:
         print(f'No RWI data for {country_iso3}')
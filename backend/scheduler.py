@@ -0,0 +1,217 @@
+"""
+Dependency-aware scheduling of the components in components.py onto Cloud Run tasks.
+
+plan() packs the enabled components onto the available task count with critical-path
+list scheduling: components on the longest remaining chain of work are placed first,
+each on the task where it can start earliest given its dependencies. Every task
+computes the same plan from the same menu and task count, and runs its own share with
+run_components(), waiting for dependencies that run on other tasks.
+
+Completion of each component is recorded as a status blob in the city directory, under
+status/<execution id>/<component>.<done|failed>, and published in the readiness registry,
+so that downstream components on other tasks are woken as soon as their inputs exist.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ['done', 'failed']
+
+def _predecessors(component):
+    return list(component.deps) + list(component.soft_deps)
+
+def bottom_levels(components):
+    """Return the length (in estimated minutes) of the longest chain starting at each component."""
+    by_name = {c.name: c for c in components}
+    successors = {c.name: [] for c in components}
+    for c in components:
+        for p in _predecessors(c):
+            if p in successors:
+                successors[p].append(c.name)
+
+    levels = {}
+    visiting = set()
+
+    def level(name):
+        if name in levels:
+            return levels[name]
+        if name in visiting:
+            raise ValueError(f'Circular dependency involving component {name}')
+        visiting.add(name)
+        levels[name] = by_name[name].cost + max([level(s) for s in successors[name]], default=0)
+        visiting.discard(name)
+        return levels[name]
+
+    for c in components:
+        level(c.name)
+    return levels
+
+def plan(components, task_count):
+    """
+    Assign components to tasks.
+
+    Args:
+        components: Enabled components, as returned by components.enabled_components.
+        task_count: Number of tasks available (CLOUD_RUN_TASK_COUNT).
+
+    Returns:
+        A list with one list of components per task, in the order each task runs them.
+    """
+    task_count = max(1, task_count)
+    levels = bottom_levels(components)
+    by_name = {c.name: c for c in components}
+
+    task_lists = [[] for _ in range(task_count)]
+    task_free = [0.0] * task_count
+    finish = {}
+    remaining = list(components)
+
+    while remaining:
+        ready = [c for c in remaining if all(p in finish for p in _predecessors(c) if p in by_name)]
+        if not ready:
+            raise ValueError(f'Circular dependency among components {[c.name for c in remaining]}')
+
+        # Most critical component first; ties keep registry order
+        component = max(ready, key=lambda c: levels[c.name])
+        deps_finish = max([finish[p] for p in _predecessors(component) if p in by_name], default=0.0)
+
+        # Task where the component can start earliest; ties go to the lowest task index
+        starts = [max(free, deps_finish) for free in task_free]
+        task = min(range(task_count), key=lambda t: (starts[t], t))
+
+        finish[component.name] = starts[task] + component.cost
+        task_free[task] = finish[component.name]
+        task_lists[task].append(component)
+        remaining.remove(component)
+
+    return task_lists
+
+def estimated_makespan(task_lists):
+    """Estimated end-to-end time of a plan in minutes, assuming the cost estimates hold."""
+    planned = {c.name for task_components in task_lists for c in task_components}
+    finish = {}
+    task_free = [0.0] * len(task_lists)
+    pending = [list(t) for t in task_lists]
+    while any(pending):
+        progressed = False
+        for t, task_components in enumerate(pending):
+            while task_components:
+                c = task_components[0]
+                preds = [p for p in _predecessors(c) if p in planned]
+                if not all(p in finish for p in preds):
+                    break
+                start = max([task_free[t]] + [finish[p] for p in preds])
+                finish[c.name] = start + c.cost
+                task_free[t] = finish[c.name]
+                task_components.pop(0)
+                progressed = True
+        if not progressed:
+            raise ValueError('Plan cannot be completed')
+    return max(task_free, default=0.0)
+
+def print_plan(task_lists):
+    for t, task_components in enumerate(task_lists):
+        if task_components:
+            print(f"Task {t}: {', '.join(c.name for c in task_components)}")
+    print(f'Estimated processing time: {estimated_makespan(task_lists):.0f} minutes')
+
+
+########################################################
+# COMPONENT STATUS #####################################
+########################################################
+
+def status_blob(ctx, name, status):
+    return f'{ctx.city_dir}/status/{ctx.execution_id}/{name}.{status}'
+
+def status_key(ctx, name):
+    # The city directory keeps the keys of the cities of a batch apart
+    return f'component:{ctx.execution_id}/{ctx.city_dir}/{name}'
+
+def mark_component(ctx, name, status):
+    import readiness
+    import utils
+
+    utils.upload_string(ctx.cloud_bucket, status, status_blob(ctx, name, status))
+    readiness.publish(status_key(ctx, name), status)
+
+def get_component_status(ctx, name):
+    import utils
+
+    for status in STATUSES:
+        if utils.check_blob_exists(ctx.cloud_bucket, status_blob(ctx, name, status)):
+            return status
+    return None
+
+def wait_for_components(ctx, names, time_limit = 24*60*60, max_interval = 60):
+    """
+    Wait until every named component is done or failed. Waiters are woken by the readiness
+    registry; the status blobs are checked with backoff in case a status was not published.
+
+    Returns:
+        A dict of component name to 'done', 'failed' or None (time limit reached).
+    """
+    import readiness
+
+    if not names:
+        return {}
+    keys = {status_key(ctx, name): name for name in names}
+    print(f"Waiting for {', '.join(names)}")
+    values = readiness.wait(keys, timeout=time_limit, probe=lambda key: get_component_status(ctx, keys[key]), max_interval=max_interval)
+    return {keys[key]: value for key, value in values.items()}
+
+def run_component(component, ctx):
+    """Run one component once its dependencies have finished and record its status. Returns True on success."""
+    status = get_component_status(ctx, component.name)
+    if status == 'done':
+        # e.g. when Cloud Run retries a task that had already finished some components
+        print(f'Component {component.name} already done in this execution.')
+        return True
+
+    statuses = wait_for_components(ctx, component.deps + component.soft_deps)
+    failed_deps = [d for d in component.deps if statuses[d] != 'done']
+    if failed_deps:
+        logger.error(f"Skipping {component.name}: required components {', '.join(failed_deps)} did not finish")
+        mark_component(ctx, component.name, 'failed')
+        return False
+
+    return execute_component(component, ctx)
+
+def execute_component(component, ctx):
+    """
+    Run one component without waiting for its dependencies and record its status. If its
+    fingerprint matches a previous run in the same city directory and its outputs exist,
+    the outputs are reused instead; if only some of its scenarios have outputs, it runs
+    the others. Returns True on success.
+    """
+    import fingerprint
+    import perf
+
+    with perf.measure(component.name) as record:
+        fingerprints = getattr(ctx, 'fingerprints', None)
+        if fingerprints is not None:
+            record['fingerprint'] = fingerprints.get(component.name)
+            record['base_fingerprint'] = fingerprints.base(component.name)
+        if fingerprint.can_reuse(component, ctx):
+            print(f'Component {component.name} is unchanged since the previous run; reusing its outputs.')
+            record['status'] = 'reused'
+        else:
+            reusable = fingerprint.reusable_scenarios(component, ctx)
+            if reusable:
+                print(f'Component {component.name}: reusing the outputs of {len(reusable)} scenarios of the previous run.')
+            ctx.reusable_scenarios = {**getattr(ctx, 'reusable_scenarios', {}), component.name: reusable}
+            logger.info(f'Running component {component.name}')
+            record['status'] = _run_component(component, ctx)
+    mark_component(ctx, component.name, 'failed' if record['status'] == 'failed' else 'done')
+    return record['status'] != 'failed'
+
+def _run_component(component, ctx):
+    try:
+        component.run(ctx)
+        return 'done'
+    except Exception as e:
+        logger.exception(f'Component {component.name} failed: {e}')
+        return 'failed'
+
+def run_components(task_components, ctx):
+    """Run a task's share of the plan in order. Returns the names of the components that failed."""
+    return [c.name for c in task_components if not run_component(c, ctx)]
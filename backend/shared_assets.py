@@ -0,0 +1,257 @@
+"""
+Source assets shared by several cities, such as the WorldPop rasters of a country, the
+RWI table of a country and the GHSL tile index and tiles.
+
+Each asset is resolved and processed once per process and then reused by every city
+that needs it: the components call the functions below instead of downloading the
+assets themselves. In batch mode (several cities in one execution, see main.py), every
+task resolves the union of the assets needed by its components in all cities with
+resolve() and prepares them up front, concurrently, with prepare().
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_results = {}
+_key_locks = {}
+# Set by prepare(): only batch executions keep downloaded tiles for the other cities
+_keep_downloads = False
+
+def _once(key, fn, *args):
+    """
+    Call fn(*args) once per key in this process and return its (cached) result. If fn
+    raises, nothing is cached and the next call tries again.
+    """
+    with _lock:
+        if key in _results:
+            return _results[key]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        # Another thread may have finished while this one waited
+        if key not in _results:
+            result = fn(*args)
+            with _lock:
+                _results[key] = result
+    return _results[key]
+
+def shared_dir():
+    """Local directory for assets kept for the lifetime of the process."""
+    import tempfile
+
+    path = os.path.join(tempfile.gettempdir(), 'city-scan-shared')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+########################################################
+# WORLDPOP #############################################
+########################################################
+
+WORLDPOP_POPULATION = 'https://hub.worldpop.org/rest/data/pop/cic2020_100m'
+WORLDPOP_AGE_STRUCTURES = 'https://www.worldpop.org/rest/data/age_structures/ascic_2020'
+
+def worldpop_files(api_url, country_iso3):
+    """File URLs of a WorldPop dataset for a country, queried once per process."""
+    def query():
+        import requests
+        return requests.get(f'{api_url}?iso3={country_iso3}').json()['data'][0]['files']
+    return _once(('worldpop_files', api_url, country_iso3), query)
+
+def population_mosaic(country_iso3, local_data_dir, data_bucket):
+    """Path of the WorldPop population mosaic (a VRT) of a country, downloaded and mosaicked once."""
+    def build():
+        import raster_pro
+
+        local_pop_folder = f'{local_data_dir}/pop'
+        os.makedirs(local_pop_folder, exist_ok=True)
+        mosaic_file = f'{country_iso3.lower()}_population_mosaic.tif'
+        downloaded_list = raster_pro.download_raster(worldpop_files(WORLDPOP_POPULATION, country_iso3), local_pop_folder, data_bucket, data_bucket_dir='WorldPop')
+        # A virtual mosaic: the cities only read their window of the country tiles
+        return raster_pro.mosaic_raster(downloaded_list, local_pop_folder, mosaic_file, virtual=True)
+    return _once(('population_mosaic', country_iso3), build)
+
+def age_structure_rasters(country_iso3, local_data_dir, data_bucket):
+    """Folder with the WorldPop age structure rasters of a country, downloaded once."""
+    def download():
+        import raster_pro
+
+        local_demo_folder = f'{local_data_dir}/demographics'
+        os.makedirs(local_demo_folder, exist_ok=True)
+        raster_pro.download_raster(worldpop_files(WORLDPOP_AGE_STRUCTURES, country_iso3), local_demo_folder, data_bucket, data_bucket_dir='WorldPop age structures')
+        return local_demo_folder
+    return _once(('age_structures', country_iso3), download)
+
+########################################################
+# RWI ##################################################
+########################################################
+
+def rwi_table(rwi_dir, rwi_blob_suffix, country_iso3, data_bucket, local_data_dir):
+    """Path of the relative wealth index CSV of a country, or None if there is none."""
+    def download():
+        import utils
+
+        rwi_data = f'{country_iso3}{rwi_blob_suffix}'
+        if utils.download_blob(data_bucket, f'{rwi_dir}/{rwi_data}', f'{local_data_dir}/{rwi_data}', check_exists=True, cache=True):
+            return f'{local_data_dir}/{rwi_data}'
+        return None
+    return _once(('rwi', country_iso3), download)
+
+########################################################
+# GHSL #################################################
+########################################################
+
+GHSL_TILE_SHP_LINK = 'https://ghsl.jrc.ec.europa.eu/download/GHSL_data_54009_shapefile.zip'
+MOLLWEIDE_PROJ = '+proj=moll +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs'
+
+def ghsl_tile_index(ghsl_bucket, ghsl_blob):
+    """
+    The GHSL tile index in Mollweide, loaded once: from the shapefile in ghsl_bucket if
+    available, otherwise from the GHSL website. Callers must not modify it.
+    """
+    def load():
+        import shutil
+        import tempfile
+
+        print("Downloading GHSL tile shapefile...")
+        # The index is read fully into memory, so its files are removed once loaded
+        tmp_dir = tempfile.mkdtemp(dir=shared_dir())
+        try:
+            return read(tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def read(tmp_dir):
+        import zipfile
+        from pathlib import Path
+        import geopandas as gpd
+        import requests
+        import utils
+
+        # --- Try downloading from GCS first ---
+        if ghsl_blob:
+            print(f"Attempting to download GHSL tile shapefile from GCS: {ghsl_blob}")
+            try:
+                # Get base name (e.g., 'GHSL2_0_MWD_L1_tile_schema_land')
+                base_name = Path(ghsl_blob).stem
+                prefix = str(Path(ghsl_blob).parent)
+                gcs_success = False
+                for suf in ["shp", "dbf", "shx", "prj"]:
+                    ok = utils.download_blob(ghsl_bucket, f"{prefix}/{base_name}.{suf}", os.path.join(tmp_dir, f"{base_name}.{suf}"), cache=True)
+                    gcs_success = gcs_success or ok  # mark success if any downloaded
+                if gcs_success:
+                    tile_gdf = gpd.read_file(os.path.join(tmp_dir, f"{base_name}.shp")).to_crs(MOLLWEIDE_PROJ)
+                    print("✅ Loaded GHSL tile shapefile from GCS.")
+                    return tile_gdf
+            except Exception as e:
+                print(f"GCS download failed: {e}")
+
+        # --- If GCS fails, fall back to GHSL website (ZIP) ---
+        print("Falling back to GHSL website...")
+        tmp_zip_path = os.path.join(tmp_dir, 'ghsl_tiles.zip')
+        try:
+            r = requests.get(GHSL_TILE_SHP_LINK, timeout=60)
+            r.raise_for_status()
+            with open(tmp_zip_path, "wb") as f:
+                f.write(r.content)
+            print("✅ Downloaded GHSL shapefile ZIP from website.")
+
+            with zipfile.ZipFile(tmp_zip_path, "r") as z:
+                shp_candidates = [n for n in z.namelist() if n.endswith(".shp")]
+                if not shp_candidates:
+                    raise FileNotFoundError("No shapefile found inside downloaded ZIP.")
+                shp_name = shp_candidates[0]
+                print(f"Found shapefile inside ZIP: {shp_name}")
+                return gpd.read_file(f"zip://{tmp_zip_path}!{shp_name}").to_crs(MOLLWEIDE_PROJ)
+        except Exception as e:
+            raise ConnectionError(f"❌ Failed to download GHSL shapefile from both GCS and website: {e}")
+
+    return _once(('ghsl_tile_index', ghsl_bucket, ghsl_blob), load)
+
+def download_url(url, timeout = 90):
+    """
+    Download a file over HTTP and return its local path, e.g. a GHSL tile that several
+    cities intersect. In batch mode the file is downloaded once per process and kept;
+    otherwise every call downloads it again. Callers pass the path to release() after
+    its last use. Raises on HTTP errors, like requests.
+    """
+    def download():
+        import hashlib
+        import requests
+
+        r = requests.get(url, timeout=timeout)
+        r.raise_for_status()
+        local_path = os.path.join(shared_dir(), f"{hashlib.sha1(url.encode()).hexdigest()[:12]}_{url.split('/')[-1]}")
+        with open(local_path, 'wb') as f:
+            f.write(r.content)
+        return local_path
+
+    if not _keep_downloads:
+        return download()
+    return _once(('url', url), download)
+
+def release(path):
+    """Delete a file returned by download_url() unless batch mode keeps it for other cities."""
+    if _keep_downloads:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+########################################################
+# BATCH PREPARATION ####################################
+########################################################
+
+def _component_assets(component_name, ctx):
+    """Shared assets used by a component for one city, as a dict of key to (function, args)."""
+    g = ctx.global_inputs
+    if component_name == 'population':
+        return {('population_mosaic', ctx.country_iso3): (population_mosaic, (ctx.country_iso3, ctx.local_data_dir, ctx.data_bucket))}
+    if component_name == 'demographics':
+        return {('age_structures', ctx.country_iso3): (age_structure_rasters, (ctx.country_iso3, ctx.local_data_dir, ctx.data_bucket))}
+    if component_name == 'rwi':
+        return {('rwi', ctx.country_iso3): (rwi_table, (g['rwi_dir'], g['rwi_blob_suffix'], ctx.country_iso3, ctx.data_bucket, ctx.local_data_dir))}
+    if component_name in ('ghs_population', 'ghs_builtup'):
+        return {('ghsl_tile_index',): (ghsl_tile_index, (g['ghsl_bucket'], g['ghsl_blob']))}
+    return {}
+
+def resolve(city_components):
+    """
+    The union of the shared assets needed by the components of several cities.
+
+    Args:
+        city_components: List of (ctx, components) pairs, one per city.
+
+    Returns:
+        A dict of asset key to (function, args) and the number of cities using each asset.
+    """
+    assets = {}
+    users = {}
+    for ctx, city_comps in city_components:
+        for c in city_comps:
+            for key, task in _component_assets(c.name, ctx).items():
+                assets.setdefault(key, task)
+                users.setdefault(key, set()).add(ctx.city_name_l)
+    return assets, {key: len(cities) for key, cities in users.items()}
+
+def prepare(assets, max_workers = 4):
+    """
+    Prepare shared assets concurrently. Failures are logged; the components then retry
+    when they need the asset.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    global _keep_downloads
+
+    _keep_downloads = True
+
+    def run(item):
+        key, (fn, args) = item
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.warning(f'Could not prepare shared asset {key}: {e}')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run, assets.items()))
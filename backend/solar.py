@@ -1,35 +1,35 @@
 def plot_solar(cloud_bucket, local_data_dir, data_bucket, solar_graph_blob, features, city_name_l, local_output_dir, output_dir, render_dir, font_dict):
     import utils
     import rasterio
-    from rasterio.mask import mask
+    import raster_pro
     import numpy as np
     import pandas as pd
     import matplotlib.pyplot as plt
     import plotly.express as px
     import yaml
     
-    utils.download_blob(data_bucket, solar_graph_blob, f'{local_data_dir}/solar.tif')
+    utils.download_blob(data_bucket, solar_graph_blob, f'{local_data_dir}/solar.tif', cache=True)
     
     monthly_pv = {}
 
-    # Loop through each band in the GeoTIFF
+    # Mask all bands with the polygon(s) at once: the AOI is rasterized a single time
     with rasterio.open(f'{local_data_dir}/solar.tif') as src:
-        for band_index in range(1, src.count + 1):  # Bands are 1-indexed in rasterio
-            # Mask the raster with the polygon(s)
-            masked, _ = mask(src, features, crop=True, all_touched=True, indexes=band_index)
-            
-            # Flatten the masked array and remove nodata values (masked values)
-            masked_data = masked[0]  # Extract the first (and only) layer from masking
-            valid_data = masked_data[~np.isnan(masked_data)]  # Remove NaN values
-            
-            # Calculate the max value for this band
-            if valid_data.size > 0:  # Ensure there are valid data points
-                max_value = valid_data.max()
-            else:
-                max_value = None  # No valid data within the polygon
-            
-            # Store in dictionary with band index as key
-            monthly_pv[band_index] = max_value
+        masked, _ = raster_pro.mask_dataset(src, features)
+
+    # Loop through each band in the GeoTIFF
+    for band_index in range(1, masked.shape[0] + 1):  # Bands are 1-indexed in rasterio
+        # Remove nodata values (masked values) of the band
+        masked_data = masked[band_index - 1]
+        valid_data = masked_data[~np.isnan(masked_data)]  # Remove NaN values
+        
+        # Calculate the max value for this band
+        if valid_data.size > 0:  # Ensure there are valid data points
+            max_value = valid_data.max()
+        else:
+            max_value = None  # No valid data within the polygon
+        
+        # Store in dictionary with band index as key
+        monthly_pv[band_index] = max_value
 
     # Convert dictionary to DataFrame
     monthly_pv_df = pd.DataFrame(list(monthly_pv.items()), columns=['month', 'max'])
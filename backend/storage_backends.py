@@ -0,0 +1,244 @@
+"""
+Storage backends behind the utils helpers.
+
+Every helper in utils (download_blob, upload_blob, list_blobs_with_prefix, ...) goes
+through one backend object with the small interface below, so the pipeline can run
+against something other than Google Cloud Storage:
+
+- GCSBackend: Google Cloud Storage through the pooled utils storage session (default).
+- LocalBackend: a local directory with one subdirectory per bucket, e.g. a local mirror
+  of the data bucket, to run and profile components on a workstation without network
+  variance.
+- MemoryBackend: an in-memory dict, for quick experiments and benchmarks.
+
+The backend is selected by the 'storage' section of config.yaml (see utils.configure_storage).
+Blob listings return BlobInfo objects with the attributes of google.cloud.storage blobs
+that the pipeline uses: name, size, generation and md5_hash.
+
+raster_path() returns a path that GDAL (rasterio) can open in place, with the GDAL options
+needed to read it, so that windows of large rasters can be read without downloading them
+(see raster_pro.raster_mask_blob). Backends without such a path return None.
+"""
+import os
+import shutil
+import threading
+
+class BlobInfo:
+    """Metadata of a stored object."""
+    def __init__(self, name, size = None, generation = None, md5_hash = None):
+        self.name = name
+        self.size = size
+        self.generation = generation
+        self.md5_hash = md5_hash
+
+    def __repr__(self):
+        return f'BlobInfo({self.name})'
+
+class GCSBackend:
+    """Google Cloud Storage, using the client and bucket handles of a utils.StorageSession."""
+    name = 'gcs'
+
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        self._credentials = None
+
+    def exists(self, bucket_name, blob_name):
+        return self.session.blob(bucket_name, blob_name).exists()
+
+    def stat(self, bucket_name, blob_name):
+        # get_blob fetches generation and md5 in one metadata request and returns None if missing
+        blob = self.session.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            return None
+        return BlobInfo(blob.name, blob.size, blob.generation, blob.md5_hash)
+
+    def download_to_file(self, bucket_name, blob_name, file_name):
+        self.session.blob(bucket_name, blob_name).download_to_filename(file_name)
+
+    def download_bytes(self, bucket_name, blob_name):
+        return self.session.blob(bucket_name, blob_name).download_as_bytes()
+
+    def upload_file(self, bucket_name, blob_name, file_name):
+        self.session.blob(bucket_name, blob_name).upload_from_filename(file_name)
+
+    def upload_bytes(self, bucket_name, blob_name, data):
+        self.session.blob(bucket_name, blob_name).upload_from_string(data)
+
+    def delete(self, bucket_name, blob_name):
+        self.session.blob(bucket_name, blob_name).delete()
+
+    def list(self, bucket_name, prefix, delimiter = None, max_results = None):
+        # Blobs returned by the client already have the BlobInfo attributes
+        return self.session.client.list_blobs(self.session.bucket(bucket_name), prefix=prefix, delimiter=delimiter, max_results=max_results)
+
+    def raster_path(self, bucket_name, blob_name):
+        # Read over HTTP range requests with an OAuth token, refreshed when it expires
+        import google.auth
+        from google.auth.transport.requests import Request
+        from urllib.parse import quote
+
+        with self._lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/devstorage.read_only'])
+            if not self._credentials.valid:
+                self._credentials.refresh(Request())
+            token = self._credentials.token
+        return f'/vsicurl/https://storage.googleapis.com/{bucket_name}/{quote(blob_name)}', {'GDAL_HTTP_HEADERS': f'Authorization: Bearer {token}'}
+
+class LocalBackend:
+    """A local directory, with buckets as subdirectories and blob names as relative paths."""
+    name = 'local'
+    # Suffix of the files being written, which are not listed
+    TMP_SUFFIX = '.local-backend-tmp'
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket_name, blob_name):
+        return os.path.join(self.root, bucket_name, blob_name)
+
+    def exists(self, bucket_name, blob_name):
+        return os.path.isfile(self._path(bucket_name, blob_name))
+
+    def stat(self, bucket_name, blob_name):
+        path = self._path(bucket_name, blob_name)
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        # The modification time stands in for the generation, like a rewritten GCS object
+        return BlobInfo(blob_name, st.st_size, st.st_mtime_ns)
+
+    def download_to_file(self, bucket_name, blob_name, file_name):
+        path = self._path(bucket_name, blob_name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'{bucket_name}/{blob_name}')
+        shutil.copyfile(path, file_name)
+
+    def download_bytes(self, bucket_name, blob_name):
+        with open(self._path(bucket_name, blob_name), 'rb') as f:
+            return f.read()
+
+    def _write(self, bucket_name, blob_name, write_fn):
+        # Write to a temporary file and rename, so readers never see a partial object
+        path = self._path(bucket_name, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}{self.TMP_SUFFIX}'
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+
+    def upload_file(self, bucket_name, blob_name, file_name):
+        self._write(bucket_name, blob_name, lambda tmp_path: shutil.copyfile(file_name, tmp_path))
+
+    def upload_bytes(self, bucket_name, blob_name, data):
+        if isinstance(data, str):
+            data = data.encode()
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._write(bucket_name, blob_name, write)
+
+    def delete(self, bucket_name, blob_name):
+        os.remove(self._path(bucket_name, blob_name))
+
+    def list(self, bucket_name, prefix, delimiter = None, max_results = None):
+        bucket_root = os.path.join(self.root, bucket_name)
+        # Only walk the directory the prefix points into
+        start = os.path.join(bucket_root, os.path.dirname(prefix))
+        names = []
+        for dirpath, dirnames, filenames in os.walk(start):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                name = os.path.relpath(os.path.join(dirpath, fn), bucket_root).replace(os.sep, '/')
+                if name.startswith(prefix) and not fn.endswith(self.TMP_SUFFIX):
+                    names.append(name)
+        names.sort()
+        if delimiter:
+            names = [n for n in names if delimiter not in n[len(prefix):]]
+        if max_results is not None:
+            names = names[:max_results]
+        return [self.stat(bucket_name, n) for n in names]
+
+    def raster_path(self, bucket_name, blob_name):
+        path = self._path(bucket_name, blob_name)
+        return (path, {}) if os.path.isfile(path) else None
+
+class MemoryBackend:
+    """An in-memory store, shared by the threads of one process."""
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._generation = 0
+
+    def exists(self, bucket_name, blob_name):
+        with self._lock:
+            return (bucket_name, blob_name) in self._objects
+
+    def stat(self, bucket_name, blob_name):
+        with self._lock:
+            obj = self._objects.get((bucket_name, blob_name))
+        if obj is None:
+            return None
+        data, generation = obj
+        return BlobInfo(blob_name, len(data), generation)
+
+    def download_bytes(self, bucket_name, blob_name):
+        with self._lock:
+            obj = self._objects.get((bucket_name, blob_name))
+        if obj is None:
+            raise FileNotFoundError(f'{bucket_name}/{blob_name}')
+        return obj[0]
+
+    def download_to_file(self, bucket_name, blob_name, file_name):
+        data = self.download_bytes(bucket_name, blob_name)
+        with open(file_name, 'wb') as f:
+            f.write(data)
+
+    def upload_bytes(self, bucket_name, blob_name, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            self._generation += 1
+            self._objects[(bucket_name, blob_name)] = (bytes(data), self._generation)
+
+    def upload_file(self, bucket_name, blob_name, file_name):
+        with open(file_name, 'rb') as f:
+            self.upload_bytes(bucket_name, blob_name, f.read())
+
+    def delete(self, bucket_name, blob_name):
+        with self._lock:
+            if self._objects.pop((bucket_name, blob_name), None) is None:
+                raise FileNotFoundError(f'{bucket_name}/{blob_name}')
+
+    def list(self, bucket_name, prefix, delimiter = None, max_results = None):
+        with self._lock:
+            names = sorted(n for b, n in self._objects if b == bucket_name and n.startswith(prefix))
+        if delimiter:
+            names = [n for n in names if delimiter not in n[len(prefix):]]
+        if max_results is not None:
+            names = names[:max_results]
+        return [info for info in (self.stat(bucket_name, n) for n in names) if info is not None]
+
+    def raster_path(self, bucket_name, blob_name):
+        return None
+
+def create_backend(storage_config, session):
+    """
+    Create the backend described by the 'storage' section of config.yaml.
+
+    Args:
+        storage_config: Dict with 'backend' ('gcs' (default), 'local' or 'memory') and,
+            for the local backend, 'local_dir'.
+        session: The utils storage session, used by the GCS backend.
+    """
+    storage_config = storage_config or {}
+    backend = storage_config.get('backend', 'gcs')
+    if backend == 'gcs':
+        return GCSBackend(session)
+    if backend == 'local':
+        return LocalBackend(storage_config.get('local_dir', 'storage'))
+    if backend == 'memory':
+        return MemoryBackend()
+    raise ValueError(f'Unknown storage backend: {backend}')
@@ -0,0 +1,108 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import components
+import fingerprint
+import readiness
+import utils
+
+BUCKET = 'test-bucket'
+
+@pytest.fixture
+def memory_storage():
+    """Memory storage backend and a fresh local readiness registry, restored afterwards."""
+    backend, registry = utils._storage_backend, readiness.get_registry()
+    utils.configure_storage({'backend': 'memory'})
+    readiness.configure(readiness.LocalRegistry())
+    yield
+    utils._storage_backend = backend
+    readiness.configure(registry)
+
+def run_producer(ctx):
+    pass
+
+def run_consumer(ctx):
+    pass
+
+def run_scenarios(ctx):
+    pass
+
+def make_ctx(enabled, city_inputs = None):
+    ctx = SimpleNamespace(
+        aoi_file=SimpleNamespace(crs='EPSG:4326', geometry=[SimpleNamespace(wkb=b'aoi')]),
+        city_inputs=city_inputs or {}, global_inputs={}, menu={'item': True}, country_iso3='UZB',
+        data_bucket=BUCKET, cloud_bucket=BUCKET, output_dir='city/output', city_name_l='city',
+    )
+    ctx.fingerprints = fingerprint.Fingerprints(enabled, ctx)
+    return ctx
+
+def previous_run(ctx, names):
+    """Records of a previous run with the current fingerprints of the components."""
+    ctx.previous_records = {name: {'component': name, 'fingerprint': ctx.fingerprints.get(name), 'base_fingerprint': ctx.fingerprints.base(name)} for name in names}
+
+def upload_outputs(names):
+    for name in names:
+        utils.upload_string(BUCKET, b'data', utils.output_blob_name(f'city/output/city_{name}'))
+
+def producer_and_consumer():
+    producer = components.Component('producer', run_producer, ['item'], outputs=['producer.tif'], transient=['producer_buf.tif'])
+    consumer = components.Component('consumer', run_consumer, ['item'], deps=['producer'], outputs=['consumer.tif'])
+    return producer, consumer
+
+def test_transient_outputs_are_not_required(memory_storage):
+    producer, consumer = producer_and_consumer()
+    ctx = make_ctx([producer, consumer])
+    previous_run(ctx, ['producer', 'consumer'])
+    upload_outputs(['producer.tif', 'consumer.tif'])
+
+    assert fingerprint.can_reuse(producer, ctx)
+    assert fingerprint.can_reuse(consumer, ctx)
+
+def test_transient_outputs_rerun_producer_when_consumer_reruns(memory_storage):
+    producer, consumer = producer_and_consumer()
+    ctx = make_ctx([producer, consumer])
+    previous_run(ctx, ['producer', 'consumer'])
+    upload_outputs(['producer.tif'])
+
+    assert not fingerprint.can_reuse(consumer, ctx)
+    assert not fingerprint.can_reuse(producer, ctx)
+
+def test_missing_scenario_outputs_are_not_reused(memory_storage):
+    def scenarios(ctx):
+        return {year: [f'scenario_{year}.tif'] for year in ctx.city_inputs['scenario']['year']}
+
+    component = components.Component('scenarios', run_scenarios, ['item'], inputs=['city:scenario.threshold'],
+                                     scenarios=scenarios, scenario_inputs=['city:scenario.year'])
+    ctx = make_ctx([component], {'scenario': {'threshold': 15, 'year': [2020, 2050]}})
+    previous_run(ctx, ['scenarios'])
+    upload_outputs(['scenario_2020.tif'])
+
+    assert not fingerprint.can_reuse(component, ctx)
+    assert fingerprint.reusable_scenarios(component, ctx) == {2020}
+
+    upload_outputs(['scenario_2050.tif'])
+    assert fingerprint.can_reuse(component, ctx)
+
+def test_new_scenario_keeps_base_fingerprint(memory_storage):
+    component = components.Component('scenarios', run_scenarios, ['item'], inputs=['city:scenario.threshold'],
+                                     scenarios=lambda ctx: {}, scenario_inputs=['city:scenario.year'])
+    before = make_ctx([component], {'scenario': {'threshold': 15, 'year': [2020]}}).fingerprints
+    after = make_ctx([component], {'scenario': {'threshold': 15, 'year': [2020, 2050]}}).fingerprints
+    changed = make_ctx([component], {'scenario': {'threshold': 20, 'year': [2020]}}).fingerprints
+
+    assert before.base('scenarios') == after.base('scenarios')
+    assert before.get('scenarios') != after.get('scenarios')
+    assert before.base('scenarios') != changed.base('scenarios')
+
+def test_flood_scenarios_expand_years_and_ssps():
+    city_inputs = {'flood': {'threshold': 15, 'year': [2020, 2050], 'ssp': [2, 5], 'return_period': [10]}}
+    menu = {'flood_coastal': False, 'flood_fluvial': True, 'flood_pluvial': False, 'flood_comb': True}
+    outputs = components.flood_scenarios(SimpleNamespace(city_inputs=city_inputs, menu=menu))
+
+    assert set(outputs) == {(2020, None), (2050, 2), (2050, 5)}
+    assert outputs[(2050, 5)] == ['fluvial_2050_ssp5.tif', 'fluvial_2050_ssp5_utm.tif', 'comb_2050_ssp5.tif', 'comb_2050_ssp5_utm.tif']
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import readiness
+import utils
+
+BUCKET = 'test-bucket'
+
+@pytest.fixture
+def memory_storage():
+    """Memory storage backend and a fresh local readiness registry, restored afterwards."""
+    backend, registry = utils._storage_backend, readiness.get_registry()
+    utils.configure_storage({'backend': 'memory'})
+    readiness.configure(readiness.LocalRegistry())
+    yield
+    utils._storage_backend = backend
+    readiness.configure(registry)
+
+def test_upload_publishes_blob(memory_storage):
+    utils.upload_string(BUCKET, b'data', 'spatial/city_elevation_buf.tif')
+
+    assert readiness.get_registry().get(readiness.blob_key(BUCKET, 'spatial/city_elevation_buf.tif'))
+    assert utils.wait_for_blobs(BUCKET, ['spatial/city_elevation_buf.tif'], time_limit=0)
+
+def test_wait_after_delete_is_not_satisfied_by_stale_record(memory_storage):
+    utils.upload_string(BUCKET, b'data', 'spatial/city_elevation_buf.tif')
+    utils.delete_blob(BUCKET, 'spatial/city_elevation_buf.tif')
+
+    assert readiness.get_registry().get(readiness.blob_key(BUCKET, 'spatial/city_elevation_buf.tif')) is None
+    assert not utils.wait_for_blobs(BUCKET, ['spatial/city_elevation_buf.tif'], time_limit=0.5, max_interval=0.1)
+    assert not utils.download_blob_timed(BUCKET, 'spatial/city_elevation_buf.tif', os.devnull, 0.5, 0.1)
+
+def test_wait_after_delete_wakes_on_new_upload(memory_storage):
+    import threading
+
+    utils.upload_string(BUCKET, b'old', 'spatial/city_elevation_buf.tif')
+    utils.delete_blob(BUCKET, 'spatial/city_elevation_buf.tif')
+
+    timer = threading.Timer(0.2, utils.upload_string, (BUCKET, b'new', 'spatial/city_elevation_buf.tif'))
+    timer.start()
+    try:
+        assert utils.wait_for_blobs(BUCKET, ['spatial/city_elevation_buf.tif'], time_limit=10, max_interval=0.1)
+    finally:
+        timer.join()
+    assert utils.read_blob_to_memory(BUCKET, 'spatial/city_elevation_buf.tif') == b'new'
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage_backends
+
+def test_local_list_skips_only_files_being_written(tmp_path):
+    backend = storage_backends.LocalBackend(str(tmp_path))
+    for name in ['out/foo.tmp.csv', 'out/.tmp/a.tif', 'out/b.tif']:
+        backend.upload_bytes('bucket', name, b'data')
+    # a write in progress
+    (tmp_path / 'bucket' / 'out' / f'c.tif.1.2{backend.TMP_SUFFIX}').write_bytes(b'partial')
+
+    assert [b.name for b in backend.list('bucket', 'out/')] == ['out/.tmp/a.tif', 'out/b.tif', 'out/foo.tmp.csv']
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import readiness
+import utils
+
+BUCKET = 'test-bucket'
+
+@pytest.fixture
+def memory_storage():
+    """Memory storage backend and a fresh local readiness registry, restored afterwards."""
+    backend, registry = utils._storage_backend, readiness.get_registry()
+    utils.configure_storage({'backend': 'memory'})
+    readiness.configure(readiness.LocalRegistry())
+    yield
+    utils._storage_backend = backend
+    readiness.configure(registry)
+
+def test_upload_many_reports_existing_blobs_as_ok(memory_storage, tmp_path):
+    local_file = tmp_path / 'aoi.shp'
+    local_file.write_bytes(b'data')
+    utils.upload_string(BUCKET, b'old', 'input/AOI/aoi.shp')
+
+    results = utils.upload_many(BUCKET, [(str(local_file), 'input/AOI/aoi.shp'), (str(tmp_path / 'missing.shp'), 'input/AOI/missing.shp')], type='input', check_exists=True)
+
+    assert [r['ok'] for r in results] == [True, False]
+    # the existing blob is kept
+    assert utils.read_blob_to_memory(BUCKET, 'input/AOI/aoi.shp') == b'old'
@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import components
+import work_queue
+
+def make_components():
+    """a -> b -> d and a -> c, with c softly depending on b."""
+    def run(ctx):
+        pass
+
+    return [
+        components.Component('a', run, ['item'], cost=1),
+        components.Component('b', run, ['item'], deps=['a'], cost=10),
+        components.Component('c', run, ['item'], deps=['a'], soft_deps=['b'], cost=1),
+        components.Component('d', run, ['item'], deps=['b'], cost=1),
+    ]
+
+def make_queue(**kwargs):
+    queue = work_queue.LocalWorkQueue(**kwargs)
+    queue.seed(make_components())
+    return queue
+
+def test_claims_follow_dependencies():
+    queue = make_queue()
+
+    assert queue.claim('w1') == 'a'
+    # b and c wait for a
+    assert queue.claim('w2') is None
+    queue.complete('a', 'w1', work_queue.DONE)
+
+    # b is on the critical path; c also waits for b (soft)
+    assert queue.claim('w1') == 'b'
+    assert queue.claim('w2') is None
+    queue.complete('b', 'w1', work_queue.DONE)
+
+    assert {queue.claim('w1'), queue.claim('w2')} == {'c', 'd'}
+
+def test_expired_lease_is_reclaimed():
+    items = work_queue.make_items(make_components())
+
+    name, changed = work_queue._claim_item(items, 'w1', 60, 2, now=0)
+    assert (name, changed) == ('a', True)
+    # still leased to w1
+    assert work_queue._claim_item(items, 'w2', 60, 2, now=30) == (None, False)
+
+    # w1 died: the lease expires and w2 runs a again
+    name, changed = work_queue._claim_item(items, 'w2', 60, 2, now=61)
+    assert (name, changed) == ('a', True)
+    assert items['a']['owner'] == 'w2' and items['a']['attempts'] == 2
+
+    # out of attempts: a fails, and so do the components requiring it
+    name, changed = work_queue._claim_item(items, 'w3', 60, 2, now=200)
+    assert (name, changed) == (None, True)
+    assert {n: item['state'] for n, item in items.items()} == {n: work_queue.FAILED for n in items}
+
+def test_lease_is_renewed_by_owner_only():
+    queue = make_queue()
+    queue.claim('w1')
+
+    assert queue.renew('a', 'w1')
+    assert not queue.renew('a', 'w2')
+
+def test_failed_dependency_does_not_unblock_dependents():
+    queue = make_queue()
+    queue.claim('w1')
+    queue.complete('a', 'w1', work_queue.FAILED)
+
+    assert queue.claim('w1') is None
+    assert queue.states() == {n: work_queue.FAILED for n in 'abcd'}
+    assert queue.is_drained()
+
+def test_failed_soft_dependency_unblocks_dependents():
+    queue = make_queue()
+    queue.claim('w1')
+    queue.complete('a', 'w1', work_queue.DONE)
+    queue.claim('w1')
+    queue.complete('b', 'w1', work_queue.FAILED)
+
+    assert queue.claim('w1') == 'c'
+    assert queue.states()['d'] == work_queue.FAILED
+
+def test_run_queue_drains_with_several_workers():
+    queue = make_queue()
+    components_by_name = {c.name: c for c in make_components()}
+    ran = []
+    lock = threading.Lock()
+
+    def execute(component, ctx):
+        with lock:
+            ran.append(component.name)
+        return component.name != 'd'
+
+    results = {}
+    def worker(worker_id):
+        results[worker_id] = work_queue.run_queue(queue, components_by_name, None, worker_id, execute=execute, max_interval=0.05)
+
+    threads = [threading.Thread(target=worker, args=(f'w{i}',)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+
+    assert sorted(ran) == ['a', 'b', 'c', 'd']
+    assert ran.index('a') < ran.index('b') < ran.index('d')
+    assert sorted(f for failed in results.values() for f in failed) == ['d']
+    assert queue.is_drained()
+    assert queue.states() == {'a': 'done', 'b': 'done', 'c': 'done', 'd': 'failed'}
@@ -1,30 +1,383 @@
 import os
-from google.cloud import storage
+import threading
+import time
+from contextlib import contextmanager
 from os.path import exists
 
+class StorageSession:
+    """
+    Process-wide Google Cloud Storage session.
+
+    Keeps one storage.Client (and its HTTP connection pool) and one bucket handle
+    per bucket name alive for the whole task, instead of creating a new client and
+    auth handshake on every helper call. Also counts calls, bytes and latency per
+    operation so the savings can be reported per task.
+    """
+    def __init__(self, pool_size=32):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._client = None
+        self._buckets = {}
+        self._pid = None
+        self._stats = {}
+
+    @property
+    def client(self):
+        # A client created before a fork must not be reused by the child process
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    from google.cloud import storage
+
+                    self._client = storage.Client()
+                    self._buckets = {}
+                    self._pid = os.getpid()
+                    self._mount_pool(self._client)
+        return self._client
+
+    def _mount_pool(self, client):
+        # Enlarge the HTTP connection pool so concurrent transfers reuse connections
+        try:
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            client._http.mount('https://', adapter)
+        except Exception as e:
+            print(f'Could not enlarge storage connection pool: {e}')
+
+    def bucket(self, bucket_name):
+        client = self.client
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(bucket_name, client.bucket(bucket_name))
+        return bucket
+
+    def blob(self, bucket_name, blob_name):
+        return self.bucket(bucket_name).blob(blob_name)
+
+    def record(self, operation, elapsed, nbytes=0):
+        with self._lock:
+            op_stats = self._stats.setdefault(operation, {'calls': 0, 'bytes': 0, 'seconds': 0.0})
+            op_stats['calls'] += 1
+            op_stats['bytes'] += nbytes
+            op_stats['seconds'] += elapsed
+
+    def timed(self, operation):
+        return _TimedCall(self, operation)
+
+    def stats(self):
+        """Return a copy of the per-operation counters, with a 'total' entry."""
+        with self._lock:
+            stats = {op: dict(v) for op, v in self._stats.items()}
+        stats['total'] = {
+            'calls': sum(v['calls'] for v in stats.values()),
+            'bytes': sum(v['bytes'] for v in stats.values()),
+            'seconds': sum(v['seconds'] for v in stats.values())
+        }
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+class _TimedCall:
+    def __init__(self, session, operation):
+        self.session = session
+        self.operation = operation
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.time0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.session.record(self.operation, time.perf_counter() - self.time0, self.nbytes)
+        return False
+
+_storage_session = StorageSession()
+
+def get_storage_session():
+    """Return the process-wide storage session used by all helpers in this module."""
+    return _storage_session
+
+def get_storage_stats():
+    """Return calls, bytes and latency counters of the storage session, per operation."""
+    return _storage_session.stats()
+
+_storage_backend = None
+
+def configure_storage(storage_config):
+    """
+    Select the storage backend of all helpers in this module from the 'storage' section of
+    config.yaml: Google Cloud Storage (default), a local directory or memory (see
+    storage_backends.py).
+    """
+    global _storage_backend
+    import storage_backends
+
+    _storage_backend = storage_backends.create_backend(storage_config, _storage_session)
+    if _storage_backend.name != 'gcs':
+        print(f'Storage backend: {_storage_backend.name}')
+    return _storage_backend
+
+def get_storage_backend():
+    """Return the storage backend used by all helpers in this module, Google Cloud Storage by default."""
+    global _storage_backend
+    if _storage_backend is None:
+        import storage_backends
+
+        _storage_backend = storage_backends.GCSBackend(_storage_session)
+    return _storage_backend
+
+def print_storage_stats():
+    for op, v in get_storage_stats().items():
+        print(f"storage {op}: {v['calls']} calls, {v['bytes'] / 1e6:.1f} MB, {v['seconds']:.1f} s")
+
+@contextmanager
+def _file_lock(lock_path, shared = False, blocking = True):
+    """
+    Advisory file lock shared between processes (and Cloud Run tasks on the same volume).
+    Yields False if the lock could not be taken without blocking. On filesystems without
+    lock support the lock is skipped and atomic renames keep the cache consistent.
+    """
+    import fcntl
+
+    with open(lock_path, 'a') as lock_file:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        except OSError:
+            yield True
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class DataCache:
+    """
+    Content-addressed local file cache with least-recently-used eviction.
+
+    Entries are keyed by a hash of whatever identifies their content (for blobs: bucket,
+    blob name, generation and md5), stored under cache_dir/objects and evicted oldest-use
+    first once the cache grows beyond max_bytes. cache_dir can be a volume mounted into
+    several tasks of one execution; per-entry file locks make sure each entry is filled
+    once and never deleted while another task is copying it.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        import hashlib
+
+        return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the path of a cached entry and mark it as recently used, or None."""
+        path = self.path(key)
+        if exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        return None
+
+    def put(self, key, fill_fn):
+        """
+        Return the path of the entry for key, creating it with fill_fn(tmp_path) if it
+        is not cached yet. fill_fn must write the file and return True, or return False
+        if there is nothing to cache.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _file_lock(f'{path}.lock'):
+            if self.get(key):
+                return path
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                if not fill_fn(tmp_path):
+                    return None
+                os.replace(tmp_path, path)
+            finally:
+                if exists(tmp_path):
+                    os.remove(tmp_path)
+        self.evict(keep=key)
+        return path
+
+    def fetch(self, key, fill_fn, destination_file_name):
+        """Copy the entry for key to destination_file_name, filling the cache first if needed."""
+        import shutil
+
+        for _ in range(2):
+            path = self.put(key, fill_fn)
+            if path is None:
+                return False
+            with _file_lock(f'{path}.lock', shared=True):
+                # the entry may have been evicted between put and the shared lock
+                if exists(path):
+                    os.makedirs(os.path.dirname(destination_file_name) or '.', exist_ok=True)
+                    shutil.copyfile(path, destination_file_name)
+                    return True
+        return False
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.objects_dir):
+            for f in files:
+                if f.endswith(('.lock', '.tmp')):
+                    continue
+                p = os.path.join(root, f)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def evict(self, keep = None):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with _file_lock(os.path.join(self.cache_dir, 'evict.lock')):
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                if os.path.basename(p) == keep:
+                    continue
+                # skip entries that are being filled or copied right now
+                with _file_lock(f'{p}.lock', blocking=False) as locked:
+                    if not locked:
+                        continue
+                    try:
+                        os.remove(p)
+                        total -= size
+                        print(f'Evicted {p} from data cache.')
+                    except FileNotFoundError:
+                        pass
+
+_data_cache = None
+
+def configure_cache(cache_dir, max_bytes):
+    """Enable the shared data cache for downloads requested with cache=True."""
+    global _data_cache
+    try:
+        _data_cache = DataCache(cache_dir, max_bytes)
+        print(f'Data cache enabled at {cache_dir} ({max_bytes / 1e9:.1f} GB).')
+    except OSError as e:
+        _data_cache = None
+        print(f'Data cache at {cache_dir} is not available: {e}')
+    return _data_cache
+
+def get_data_cache():
+    return _data_cache
+
+def _download_blob_cached(bucket_name, source_blob_name, destination_file_name):
+    backend = get_storage_backend()
+    with _storage_session.timed('exists'):
+        blob = backend.stat(bucket_name, source_blob_name)
+    if blob is None:
+        print(f"Blob {source_blob_name} does not exist.")
+        return False
+
+    filled = []
+    def fill_fn(tmp_path):
+        with _storage_session.timed('download') as call:
+            backend.download_to_file(bucket_name, source_blob_name, tmp_path)
+            call.nbytes = os.path.getsize(tmp_path)
+        filled.append(True)
+        return True
+
+    key = DataCache.make_key(bucket_name, source_blob_name, blob.generation, blob.md5_hash)
+    if not _data_cache.fetch(key, fill_fn, destination_file_name):
+        return False
+    if not filled:
+        _storage_session.record('cache_hit', 0, os.path.getsize(destination_file_name))
+    print(f"Blob {source_blob_name} {'downloaded' if filled else 'copied from data cache'} to {destination_file_name}.")
+    return True
+
 def check_blob_exists(bucket_name, blob_name):
-    """Check if a blob exists in the Google Cloud Storage bucket."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    return blob.exists()
-
-def download_blob(bucket_name, source_blob_name, destination_file_name, check_exists = False):
-    """Downloads a blob from the bucket."""
+    """Check if a blob exists in the bucket."""
+    with _storage_session.timed('exists'):
+        return get_storage_backend().exists(bucket_name, blob_name)
+
+def download_blob(bucket_name, source_blob_name, destination_file_name, check_exists = False, cache = False):
+    """
+    Downloads a blob from the bucket.
+
+    With cache=True and a data cache configured (see configure_cache), the blob is
+    served from the shared data cache and downloaded only if that generation of the
+    blob is not cached yet.
+    """
     if check_exists:
         if exists(destination_file_name):
             print(f"File {destination_file_name} already exists.")
             return True
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
-    if blob.exists():
-        blob.download_to_filename(destination_file_name)
+    if cache and _data_cache is not None:
+        return _download_blob_cached(bucket_name, source_blob_name, destination_file_name)
+    backend = get_storage_backend()
+    with _storage_session.timed('exists'):
+        blob_exists = backend.exists(bucket_name, source_blob_name)
+    if blob_exists:
+        with _storage_session.timed('download') as call:
+            backend.download_to_file(bucket_name, source_blob_name, destination_file_name)
+            call.nbytes = os.path.getsize(destination_file_name)
         print(f"Blob {source_blob_name} downloaded to {destination_file_name}.")
         return True
     print(f"Blob {source_blob_name} does not exist.")
     return False
 
+def output_blob_name(destination_blob_name, type = 'output'):
+    """
+    Return the blob name a file is stored under by upload_blob: outputs and renders are
+    sorted into subfolders by file extension, e.g. <output_dir>/spatial/<file>.tif.
+    """
+    if type == 'output':
+        # Mapping of file extensions to folder names
+        folder_map = {
+            ('.tif', '.gpkg'): 'spatial',
+            ('.csv', '.txt', '.yml'): 'tabular',
+            ('.png'): 'images'
+        }
+    elif type == 'render':
+        # Mapping of file extensions to folder names
+        folder_map = {
+            ('.html'): 'plots/html',
+            ('.png'): 'plots/png'
+        }
+    else:
+        return destination_blob_name
+
+    # Default folder name for other file types
+    default_folder = 'other'
+
+    # Get the folder name based on file extension
+    for extensions, folder_name in folder_map.items():
+        if any(destination_blob_name.endswith(ext) for ext in extensions):
+            target_folder = folder_name
+            break
+    else:
+        target_folder = default_folder
+
+    # Construct the new destination_blob_name
+    return f'{os.path.dirname(destination_blob_name)}/{target_folder}/{os.path.basename(destination_blob_name)}'
+
 def upload_blob(bucket_name, source_file_name, destination_blob_name, type = 'output', check_exists = False):
     """
     Uploads a file to the bucket.
@@ -35,81 +388,70 @@ def upload_blob(bucket_name, source_file_name, destination_blob_name, type = 'ou
         destination_blob_name: Destination name of the file in the bucket.
         type: Type of the file (output (default), render, input, data)
         check_exists: Check if the file already exists in the bucket.
+
+    Returns:
+        True if the file is in the bucket (uploaded, or already there with check_exists),
+        False if the local file does not exist.
     """
     if exists(source_file_name):
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-
-        if type == 'output':
-            # Mapping of file extensions to folder names
-            folder_map = {
-                ('.tif', '.gpkg'): 'spatial',
-                ('.csv', '.txt', '.yml'): 'tabular',
-                ('.png'): 'images'
-            }
-
-            # Default folder name for other file types
-            default_folder = 'other'
-
-            # Get the folder name based on file extension
-            for extensions, folder_name in folder_map.items():
-                if any(destination_blob_name.endswith(ext) for ext in extensions):
-                    target_folder = folder_name
-                    break
-            else:
-                target_folder = default_folder
-
-            # Construct the new destination_blob_name
-            destination_blob_name = f'{os.path.dirname(destination_blob_name)}/{target_folder}/{os.path.basename(destination_blob_name)}'
-        elif type == 'render':
-            # Mapping of file extensions to folder names
-            folder_map = {
-                ('.html'): 'plots/html',
-                ('.png'): 'plots/png'
-            }
-
-            # Default folder name for other file types
-            default_folder = 'other'
-
-            # Get the folder name based on file extension
-            for extensions, folder_name in folder_map.items():
-                if any(destination_blob_name.endswith(ext) for ext in extensions):
-                    target_folder = folder_name
-                    break
-            else:
-                target_folder = default_folder
+        destination_blob_name = output_blob_name(destination_blob_name, type)
 
-            # Construct the new destination_blob_name
-            destination_blob_name = f'{os.path.dirname(destination_blob_name)}/{target_folder}/{os.path.basename(destination_blob_name)}'
-
-        blob = bucket.blob(destination_blob_name)
+        backend = get_storage_backend()
         if check_exists:
-            if blob.exists():
+            with _storage_session.timed('exists'):
+                blob_exists = backend.exists(bucket_name, destination_blob_name)
+            if blob_exists:
                 print(f"File {destination_blob_name} already exists.")
-                return
-        blob.upload_from_filename(source_file_name)
+                _publish_blob(bucket_name, destination_blob_name)
+                return True
+        with _storage_session.timed('upload') as call:
+            backend.upload_file(bucket_name, destination_blob_name, source_file_name)
+            call.nbytes = os.path.getsize(source_file_name)
         print(f"File {source_file_name} uploaded to {destination_blob_name}.")
+        _publish_blob(bucket_name, destination_blob_name)
         return True
     print(f"File {source_file_name} does not exist.")
     return False
 
-def read_blob_to_memory(bucket_name, blob_name):
-    """Reads a blob from Google Cloud Storage directly into memory."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    return blob.download_as_bytes()
+def upload_string(bucket_name, data, destination_blob_name):
+    """Uploads a string (e.g. a small status or manifest file) to the bucket."""
+    with _storage_session.timed('upload') as call:
+        get_storage_backend().upload_bytes(bucket_name, destination_blob_name, data)
+        call.nbytes = len(data)
+    _publish_blob(bucket_name, destination_blob_name)
+
+def _publish_blob(bucket_name, blob_name):
+    import readiness
+
+    readiness.publish(readiness.blob_key(bucket_name, blob_name))
+
+def read_blob_to_memory(bucket_name, blob_name, cache = False):
+    """Reads a blob from the bucket directly into memory."""
+    if cache and _data_cache is not None:
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_file = os.path.join(tmp_dir, os.path.basename(blob_name))
+            if _download_blob_cached(bucket_name, blob_name, tmp_file):
+                with open(tmp_file, 'rb') as f:
+                    return f.read()
+    with _storage_session.timed('download') as call:
+        blob_bytes = get_storage_backend().download_bytes(bucket_name, blob_name)
+        call.nbytes = len(blob_bytes)
+    return blob_bytes
+
+def blob_raster_path(bucket_name, blob_name):
+    """
+    Path and GDAL options to open a raster blob in place with rasterio (e.g. over HTTP
+    range requests), or None if the storage backend cannot provide one.
+    """
+    return get_storage_backend().raster_path(bucket_name, blob_name)
 
 def download_aoi(bucket_name, input_dir, aoi_shp_name, destination_dir):
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=f"{input_dir}/AOI/{aoi_shp_name}.")
+    blobs = list_blobs_with_prefix(bucket_name, f"{input_dir}/AOI/{aoi_shp_name}.")
     os.makedirs(destination_dir, exist_ok=True)
-    downloaded_list = []
-    for blob in blobs:
-        fn = f"{destination_dir}/{blob.name.split('/')[-1]}"
-        blob.download_to_filename(fn)
-        downloaded_list.append(fn)
+    results = download_many(bucket_name, [(blob.name, f"{destination_dir}/{blob.name.split('/')[-1]}") for blob in blobs])
+    downloaded_list = [r['destination'] for r in results if r['ok']]
     print(f"AOI {aoi_shp_name} downloaded to {destination_dir}.")
     return downloaded_list
 
@@ -154,10 +496,10 @@ def list_blobs_with_prefix(bucket_name, prefix, delimiter=None):
         a/b/
     """
 
-    storage_client = storage.Client()
-
     # Note: Client.list_blobs requires at least package version 1.17.0.
-    blobs = storage_client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+    # The bucket handle is reused so listing does not create a new client.
+    with _storage_session.timed('list'):
+        blobs = get_storage_backend().list(bucket_name, prefix, delimiter=delimiter)
     
     return blobs
     # Note: The call returns a response only when the iterator is consumed.
@@ -171,31 +513,118 @@ def list_blobs_with_prefix(bucket_name, prefix, delimiter=None):
     #         print(prefix)
 
 def delete_blob(bucket_name, blob_name):
-    """Deletes a blob from the bucket."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    blob.delete()
+    """Deletes a blob from the bucket and retracts its readiness record."""
+    import readiness
+
+    # Retract first, so that waiters never see a record of a deleted blob
+    readiness.retract(readiness.blob_key(bucket_name, blob_name))
+    with _storage_session.timed('delete'):
+        get_storage_backend().delete(bucket_name, blob_name)
 
     print(f"Blob {blob_name} deleted.")
 
+def wait_for_blobs(bucket_name, blob_names, time_limit = None, max_interval = 60):
+    """
+    Wait until all blobs exist, woken by the readiness registry when they are uploaded by
+    this pipeline and checking the bucket with backoff for blobs written elsewhere (e.g.
+    Earth Engine exports).
+
+    Args:
+        bucket_name: Name of the bucket.
+        blob_names: Names of the blobs to wait for.
+        time_limit: Maximum time to wait in seconds, or None to wait indefinitely.
+        max_interval: Longest interval in seconds between checks of the bucket.
+
+    Returns:
+        True if all blobs exist, False if the time limit was reached.
+    """
+    import readiness
+
+    keys = {readiness.blob_key(bucket_name, b): b for b in blob_names}
+    values = readiness.wait(keys, timeout=time_limit, probe=lambda key: check_blob_exists(bucket_name, keys[key]), max_interval=max_interval)
+    return all(values.values())
+
 def download_blob_timed(bucket_name, source_blob_name, destination_file_name, time_limit, attempt_interval, check_exists = False):
-    from datetime import datetime as dt
-    import time
+    """Download a blob once it exists, waiting up to time_limit seconds (see wait_for_blobs). attempt_interval is the longest interval between checks."""
+    if not wait_for_blobs(bucket_name, [source_blob_name], time_limit, attempt_interval):
+        return False
+    return download_blob(bucket_name, source_blob_name, destination_file_name, check_exists)
+
+def _transfer_with_retries(transfer_fn, source, destination, retries, backoff):
+    # Retry only on exceptions; a missing source (False) is a final answer
+    result = {'source': source, 'destination': destination, 'ok': False, 'attempts': 0, 'error': None}
+    for attempt in range(1, retries + 1):
+        result['attempts'] = attempt
+        try:
+            result['ok'] = bool(transfer_fn(source, destination))
+            result['error'] = None
+            return result
+        except Exception as e:
+            result['error'] = str(e)
+            print(f'Transfer of {source} failed (attempt {attempt}/{retries}): {e}')
+            if attempt < retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return result
+
+def _run_transfers(transfer_fn, transfers, max_workers, retries, backoff):
+    from concurrent.futures import ThreadPoolExecutor
+
+    transfers = list(transfers)
+    if not transfers:
+        return []
+    max_workers = max(1, min(max_workers, len(transfers), _storage_session.pool_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_transfer_with_retries, transfer_fn, src, dst, retries, backoff) for src, dst in transfers]
+        return [f.result() for f in futures]
+
+def download_many(bucket_name, transfers, check_exists = False, max_workers = 8, retries = 3, backoff = 1, cache = False):
+    """
+    Downloads many blobs from the bucket concurrently.
 
-    time0 = dt.now()
-    while (dt.now()-time0).total_seconds() <= time_limit:
-        if download_blob(bucket_name, source_blob_name, destination_file_name, check_exists):
-            return True
-        time.sleep(attempt_interval)
-    
-    return False
+    Args:
+        bucket_name: Name of the bucket.
+        transfers: Iterable of (source_blob_name, destination_file_name) pairs.
+        check_exists: Skip files that already exist locally.
+        max_workers: Maximum number of concurrent downloads.
+        retries: Number of attempts per file when the download raises.
+        backoff: Seconds to wait before the first retry; doubled on every retry.
+        cache: Serve the files through the shared data cache, as in download_blob.
+
+    Returns:
+        A list of per-file results, in the order of transfers, each a dict with
+        source, destination, ok, attempts and error.
+    """
+    def transfer_fn(source, destination):
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        return download_blob(bucket_name, source, destination, check_exists=check_exists, cache=cache)
+
+    return _run_transfers(transfer_fn, transfers, max_workers, retries, backoff)
+
+def upload_many(bucket_name, transfers, type = 'output', check_exists = False, max_workers = 8, retries = 3, backoff = 1):
+    """
+    Uploads many files to the bucket concurrently.
+
+    Args:
+        bucket_name: Name of the bucket.
+        transfers: Iterable of (source_file_name, destination_blob_name) pairs.
+        type: Type of the files, as in upload_blob (output (default), render, input, data)
+        check_exists: Skip files that already exist in the bucket.
+        max_workers: Maximum number of concurrent uploads.
+        retries: Number of attempts per file when the upload raises.
+        backoff: Seconds to wait before the first retry; doubled on every retry.
+
+    Returns:
+        A list of per-file results, in the order of transfers, each a dict with
+        source, destination, ok, attempts and error.
+    """
+    def transfer_fn(source, destination):
+        return upload_blob(bucket_name, source, destination, type=type, check_exists=check_exists)
+
+    return _run_transfers(transfer_fn, transfers, max_workers, retries, backoff)
 
 def check_dir_exists(bucket_name, dir_name):
-    """Check if a blob or directory exists in the Google Cloud Storage bucket."""
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    
-    # Check if any blobs exist with the given prefix (directory)
-    blobs = list(bucket.list_blobs(prefix=dir_name))
+    """Check if a blob or directory exists in the bucket."""
+    # Check if any blobs exist with the given prefix (directory); one result is enough
+    with _storage_session.timed('list'):
+        blobs = list(get_storage_backend().list(bucket_name, dir_name, max_results=1))
     return len(blobs) > 0
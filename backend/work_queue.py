@@ -0,0 +1,251 @@
+"""
+Work-queue mode: instead of running a fixed share of the plan, every Cloud Run task
+keeps claiming the next runnable component from a queue shared by the execution until
+the queue is drained. Short components then no longer leave tasks idle while long ones
+run alone.
+
+A component is runnable once all components it depends on (deps and soft_deps) have
+finished; if a required dependency failed, the component is marked failed without
+running. Runnable components are handed out in critical-path order. A claim is a lease
+that the worker renews while the component runs; if a task dies, its lease expires and
+another task picks the component up again (up to max_attempts).
+
+FirestoreWorkQueue keeps the queue of an execution in one Firestore document and makes
+every change in a transaction. LocalWorkQueue is an in-memory implementation with the
+same interface, for running and testing the queue logic without Firestore.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+def make_items(components):
+    """Build the queue items of an execution from the enabled components."""
+    import scheduler
+
+    levels = scheduler.bottom_levels(components)
+    return {c.name: {'deps': list(c.deps),
+                     'soft_deps': list(c.soft_deps),
+                     'priority': levels[c.name],
+                     'state': PENDING,
+                     'owner': None,
+                     'lease_expires': 0,
+                     'attempts': 0} for c in components}
+
+def _claim_item(items, worker_id, lease_seconds, max_attempts, now):
+    """
+    Pick the next runnable item and lease it to worker_id, updating items in place.
+    Returns (name, changed): the claimed name or None, and whether any item was updated
+    (claimed, failed or released from an expired lease) and must be written back. Shared
+    by the queue implementations so that the same rules apply inside a Firestore
+    transaction and in memory.
+    """
+    changed = False
+    runnable = []
+    for name, item in items.items():
+        if item['state'] == RUNNING and item['lease_expires'] < now:
+            # The worker holding the lease died
+            logger.warning(f"Lease of {name} held by {item['owner']} expired")
+            item['state'] = PENDING if item['attempts'] < max_attempts else FAILED
+            item['owner'] = None
+            changed = True
+        if item['state'] != PENDING:
+            continue
+
+        dep_states = [items[d]['state'] for d in item['deps'] if d in items]
+        soft_dep_states = [items[d]['state'] for d in item['soft_deps'] if d in items]
+        if FAILED in dep_states:
+            item['state'] = FAILED
+            changed = True
+        elif all(s in (DONE, FAILED) for s in dep_states + soft_dep_states):
+            runnable.append(name)
+
+    if not runnable:
+        return None, changed
+
+    name = max(runnable, key=lambda n: items[n]['priority'])
+    items[name].update({'state': RUNNING, 'owner': worker_id, 'lease_expires': now + lease_seconds,
+                        'attempts': items[name]['attempts'] + 1})
+    return name, True
+
+def _is_drained(items):
+    return all(item['state'] in (DONE, FAILED) for item in items.values())
+
+class LocalWorkQueue:
+    """In-memory work queue, shared by the threads of one process."""
+    def __init__(self, lease_seconds = 15*60, max_attempts = 2):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._items = None
+
+    def seed(self, components):
+        with self._lock:
+            if self._items is None:
+                self._items = make_items(components)
+
+    def claim(self, worker_id):
+        with self._lock:
+            name, _ = _claim_item(self._items, worker_id, self.lease_seconds, self.max_attempts, time.time())
+            return name
+
+    def renew(self, name, worker_id):
+        with self._lock:
+            item = self._items[name]
+            if item['owner'] != worker_id or item['state'] != RUNNING:
+                return False
+            item['lease_expires'] = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, name, worker_id, status):
+        with self._lock:
+            item = self._items[name]
+            if item['owner'] == worker_id:
+                item.update({'state': status, 'owner': None})
+
+    def is_drained(self):
+        with self._lock:
+            return _is_drained(self._items)
+
+    def states(self):
+        with self._lock:
+            return {name: item['state'] for name, item in self._items.items()}
+
+class FirestoreWorkQueue:
+    """Work queue of one execution, stored in the Firestore document work_queues/<execution_id>."""
+    def __init__(self, db, execution_id, lease_seconds = 15*60, max_attempts = 2):
+        self.db = db
+        self.ref = db.collection('work_queues').document(execution_id)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _transact(self, fn):
+        """Run fn(items) -> (result, changed) on the queue document in a transaction."""
+        from google.cloud import firestore
+
+        @firestore.transactional
+        def update_queue(transaction, ref):
+            snapshot = ref.get(transaction=transaction)
+            data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            items = data.get('items', {})
+            result, changed = fn(items)
+            if changed:
+                transaction.set(ref, {'items': items})
+            return result
+
+        transaction = self.db.transaction()
+        return update_queue(transaction, self.ref)
+
+    def seed(self, components):
+        # Only the first task to get here creates the queue
+        new_items = make_items(components)
+        def fn(items):
+            if items:
+                return None, False
+            items.update(new_items)
+            return None, True
+        self._transact(fn)
+
+    def claim(self, worker_id):
+        return self._transact(lambda items: _claim_item(items, worker_id, self.lease_seconds, self.max_attempts, time.time()))
+
+    def renew(self, name, worker_id):
+        def fn(items):
+            item = items[name]
+            if item['owner'] != worker_id or item['state'] != RUNNING:
+                return False, False
+            item['lease_expires'] = time.time() + self.lease_seconds
+            return True, True
+        return self._transact(fn)
+
+    def complete(self, name, worker_id, status):
+        def fn(items):
+            item = items[name]
+            if item['owner'] != worker_id:
+                return None, False
+            item.update({'state': status, 'owner': None})
+            return None, True
+        self._transact(fn)
+
+    def is_drained(self):
+        return self._transact(lambda items: (_is_drained(items), False))
+
+    def states(self):
+        return self._transact(lambda items: ({name: item['state'] for name, item in items.items()}, False))
+
+class _LeaseHeartbeat:
+    """Renews the lease of a claimed item in the background while its component runs."""
+    def __init__(self, queue, name, worker_id):
+        self.queue = queue
+        self.name = name
+        self.worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.name, self.worker_id):
+                    logger.warning(f'Lost the lease of {self.name}')
+                    return
+            except Exception as e:
+                logger.warning(f'Could not renew the lease of {self.name}: {e}')
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+def run_queue(queue, components_by_name, ctx, worker_id, execute = None, max_interval = 60):
+    """
+    Claim and run components until the queue is drained.
+
+    Args:
+        queue: A FirestoreWorkQueue or LocalWorkQueue, already seeded.
+        components_by_name: Dict of component name to component.
+        ctx: Context object passed to the components.
+        worker_id: Unique id of this worker, e.g. the Cloud Run task index.
+        execute: Function (component, ctx) -> bool running a component; defaults to
+            scheduler.execute_component.
+        max_interval: Longest wait in seconds between claims when nothing is runnable.
+
+    Returns:
+        The names of the components this worker ran that failed.
+    """
+    if execute is None:
+        import scheduler
+        execute = scheduler.execute_component
+
+    failed = []
+    interval = 1
+    while True:
+        name = queue.claim(worker_id)
+        if name is None:
+            if queue.is_drained():
+                return failed
+            # Everything left is running elsewhere or waiting for its dependencies
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+            continue
+
+        interval = 1
+        logger.info(f'Worker {worker_id} claimed {name}')
+        with _LeaseHeartbeat(queue, name, worker_id):
+            try:
+                ok = execute(components_by_name[name], ctx)
+            except Exception as e:
+                logger.exception(f'Component {name} failed: {e}')
+                ok = False
+        queue.complete(name, worker_id, DONE if ok else FAILED)
+        if not ok:
+            failed.append(name)
@@ -4,7 +4,6 @@ def wsf(aoi_file, local_data_dir, data_bucket, city_name_l, local_output_dir, cl
     import csv
     import utils
     import os
-    import rasterio
 
     local_wsf_folder = f'{local_data_dir}/wsf'
     os.makedirs(local_wsf_folder, exist_ok=True)
@@ -19,13 +18,12 @@ def wsf(aoi_file, local_data_dir, data_bucket, city_name_l, local_output_dir, cl
     wsf_download_list = [f'https://download.geoservice.dlr.de/WSF_EVO/files/{f}/{f}.tif' for f in wsf_file_list]
 
     downloaded_list = raster_pro.download_raster(wsf_download_list, local_wsf_folder, data_bucket, data_bucket_dir='WSFevolution')
-    raster_pro.mosaic_raster(downloaded_list, local_wsf_folder, f'{city_name_l}_wsf_evolution.tif')
-    out_image, out_meta = raster_pro.raster_mask_file(f'{local_wsf_folder}/{city_name_l}_wsf_evolution.tif', aoi_file.geometry)
-    out_meta.update({"nodata": 0})
-    with rasterio.open(f'{local_output_dir}/{city_name_l}_wsf_evolution.tif', "w", **out_meta) as dest:
-        dest.write(out_image)
-
-    raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_wsf_evolution.tif', f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif', dst_crs=utils.find_utm(aoi_file))
+    # mosaic, clip, and reproject to UTM and web mercator in one read of the tiles
+    raster_pro.warp_pipeline(downloaded_list, aoi_file.geometry,
+                             [{'path': f'{local_output_dir}/{city_name_l}_wsf_evolution.tif'},
+                              {'path': f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif', 'crs': utils.find_utm(aoi_file)},
+                              {'path': f'{local_output_dir}/{city_name_l}_wsf_evolution_3857.tif', 'crs': 'epsg:3857'}],
+                             nodata=0)
     area_dict = raster_pro.calculate_raster_area(f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif', range(1985, 2016))
     # Calculate the cumulative built-up area
     cumulative_area = 0
@@ -42,14 +40,10 @@ def wsf(aoi_file, local_data_dir, data_bucket, city_name_l, local_output_dir, cl
         for year, cumulative_area in cumulative_dict.items():
             writer.writerow([year, cumulative_area])
 
-    raster_pro.reproject_raster(f'{local_output_dir}/{city_name_l}_wsf_evolution.tif', f'{local_output_dir}/{city_name_l}_wsf_evolution_3857.tif', dst_crs='epsg:3857')
-
     plot_wsf_stats(cloud_bucket, local_output_dir, output_dir, city_name_l, render_dir, font_dict)
 
-    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_wsf_evolution.tif', f'{output_dir}/{city_name_l}_wsf_evolution.tif')
-    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_wsf_evolution_utm.tif', f'{output_dir}/{city_name_l}_wsf_evolution_utm.tif')
-    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_wsf_stats.csv', f'{output_dir}/{city_name_l}_wsf_stats.csv')
-    utils.upload_blob(cloud_bucket, f'{local_output_dir}/{city_name_l}_wsf_evolution_3857.tif', f'{output_dir}/{city_name_l}_wsf_evolution_3857.tif')
+    utils.upload_many(cloud_bucket, [(f'{local_output_dir}/{city_name_l}_{f}', f'{output_dir}/{city_name_l}_{f}') 
+                                     for f in ['wsf_evolution.tif', 'wsf_evolution_utm.tif', 'wsf_stats.csv', 'wsf_evolution_3857.tif']])
 
 def plot_wsf_stats(cloud_bucket, local_output_dir, output_dir, city_name_l, render_dir, font_dict):
     from os.path import exists